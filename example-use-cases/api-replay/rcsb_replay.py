@@ -0,0 +1,370 @@
+"""
+Record and replay RCSB.org API traffic with a local HTTP server, so that the example scripts can be run,
+benchmarked and load-tested without access to search.rcsb.org, data.rcsb.org, models.rcsb.org or
+alignment.rcsb.org.
+
+The server exposes every RCSB.org host under its own path prefix, e.g.:
+
+    https://search.rcsb.org/rcsbsearch/v2/query  ->  http://127.0.0.1:8765/search.rcsb.org/rcsbsearch/v2/query
+
+In "record" mode, each request is forwarded to the real service and the response is saved in a
+content-addressed fixture store (except throttling (429) and server error (5xx) responses, which are passed on
+without being recorded, so that a transient error is not replayed forever). In "replay" mode (the default), requests are answered from the store only;
+"record-missing" replays what is available and records the rest. Latency, throttling (HTTP 429) and random
+server errors can be injected to test how scripts behave under load.
+
+Fixture store layout:
+    <store>/requests/<request key>.json   # status, headers and body hash of the recorded response
+    <store>/blobs/<ab>/<body sha256>      # response bodies, shared between identical responses
+
+The request key is a hash of the method, URL and (normalized) body of the request. Volatile parts are removed
+before hashing: the random `request_info` of Search API queries, the order of URL parameters and JSON keys,
+and multipart boundaries (used for file uploads to the Alignment API).
+
+Any script can be pointed at the server with the `exec` command, which redirects all requests made to
+*.rcsb.org through `requests` or `httpx` (and therefore `rcsb-api`) before running the script.
+
+Requirements:
+    pip install requests httpx
+
+Usage:
+    # Record the traffic of a script
+        python3 rcsb_replay.py serve --store fixtures --mode record
+        python3 rcsb_replay.py exec --server http://127.0.0.1:8765 -- ../structures/non_redundant_targets.py
+
+    # Replay it offline, with 200 ms latency, at most 10 requests per second and 5% server errors
+        python3 rcsb_replay.py serve --store fixtures --latency-ms 200 --rate-limit 10 --error-rate 0.05
+        python3 rcsb_replay.py exec --server http://127.0.0.1:8765 -- ../structures/non_redundant_targets.py
+
+    # Server statistics (hits, misses, recorded responses, injected errors)
+        curl http://127.0.0.1:8765/_replay/stats
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import runpy
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+RCSB_URL_RE = re.compile(r"^https?://([A-Za-z0-9.-]+\.rcsb\.org)(?=[/?]|$)")
+
+# Response headers worth keeping when recording (bodies are stored decoded, so Content-Encoding is dropped)
+RECORDED_HEADERS = ["Content-Type", "Content-Disposition", "Retry-After"]
+
+MODES = ["replay", "record", "record-missing"]
+
+
+def is_recordable(status):
+    """Whether a response is stable enough to replay: successes and client errors other than throttling."""
+    return 200 <= status < 300 or (400 <= status < 500 and status != 429)
+
+
+class FixtureStore:
+    """Content-addressed store of recorded responses."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        (self.root / "requests").mkdir(parents=True, exist_ok=True)
+        (self.root / "blobs").mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def request_key(method, host, path_qs, body, content_type=""):
+        """Hash a request, ignoring parts that change between otherwise identical requests."""
+        split = urlsplit(path_qs)
+        query = urlencode(sorted(parse_qsl(split.query, keep_blank_values=True)))
+        body = normalize_body(body, content_type)
+        digest = hashlib.sha256()
+        for part in (method.upper(), host.lower(), split.path, query):
+            digest.update(part.encode() + b"\n")
+        digest.update(body)
+        return digest.hexdigest()
+
+    def _blob_path(self, sha):
+        return self.root / "blobs" / sha[:2] / sha
+
+    def get(self, key):
+        """Return (status, headers, body) for a recorded request, or None."""
+        meta_path = self.root / "requests" / f"{key}.json"
+        if not meta_path.exists():
+            return None
+        meta = json.loads(meta_path.read_text())
+        body = self._blob_path(meta["body_sha256"]).read_bytes()
+        return meta["status"], meta["headers"], body
+
+    def put(self, key, method, url, status, headers, body):
+        sha = hashlib.sha256(body).hexdigest()
+        blob_path = self._blob_path(sha)
+        if not blob_path.exists():
+            blob_path.parent.mkdir(exist_ok=True)
+            _atomic_write(blob_path, body)
+        meta = {"method": method, "url": url, "status": status, "headers": headers, "body_sha256": sha, "recorded": time.time()}
+        _atomic_write(self.root / "requests" / f"{key}.json", json.dumps(meta, indent=2).encode())
+
+
+def _atomic_write(path, data):
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def normalize_body(body, content_type=""):
+    if not body:
+        return b""
+    if content_type.startswith("multipart/"):
+        boundary = re.search(r"boundary=\"?([^\";]+)", content_type)
+        if boundary:
+            return body.replace(boundary.group(1).encode(), b"BOUNDARY")
+        return body
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return body
+    if isinstance(payload, dict):
+        # Search API queries carry a random query ID
+        payload.pop("request_info", None)
+    return json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+
+
+class TokenBucket:
+    """Allow `rate` requests per second on average, with bursts of up to `burst` requests."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def do_GET(self):
+        if self.path == "/_replay/stats":
+            self.reply(200, {"Content-Type": "application/json"}, json.dumps(self.server.stats_snapshot()).encode())
+            return
+        self.handle_api_request()
+
+    def do_POST(self):
+        self.handle_api_request()
+
+    def handle_api_request(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        host, _, path_qs = self.path.lstrip("/").partition("/")
+        path_qs = "/" + path_qs
+        if not host.endswith(".rcsb.org"):
+            self.reply(404, {"Content-Type": "application/json"}, b'{"error": "expected /<host>.rcsb.org/<path>"}')
+            return
+
+        server.count("requests")
+        if server.bucket and not server.bucket.take():
+            server.count("throttled")
+            self.reply(429, {"Content-Type": "application/json", "Retry-After": "1"}, b'{"error": "too many requests"}')
+            return
+        if server.error_rate and server.random() < server.error_rate:
+            server.count("injected_errors")
+            self.reply(server.error_status, {"Content-Type": "application/json"}, b'{"error": "injected error"}')
+            return
+
+        key = FixtureStore.request_key(self.command, host, path_qs, body, self.headers.get("Content-Type", ""))
+        recorded = None if server.mode == "record" else server.store.get(key)
+        if recorded is not None:
+            server.count("hits")
+            status, headers, out = recorded
+        elif server.mode == "replay":
+            server.count("misses")
+            logger.warning("No recorded response for %s https://%s%s", self.command, host, path_qs)
+            self.reply(404, {"Content-Type": "application/json"}, b'{"error": "no recorded response for this request"}')
+            return
+        else:
+            try:
+                status, headers, out = self.forward(host, path_qs, body)
+            except requests.RequestException as e:
+                logger.error("Failed to forward %s https://%s%s: %s", self.command, host, path_qs, e)
+                self.reply(502, {"Content-Type": "application/json"}, json.dumps({"error": str(e)}).encode())
+                return
+            if is_recordable(status):
+                server.store.put(key, self.command, f"https://{host}{path_qs}", status, headers, out)
+                server.count("recorded")
+            else:
+                logger.warning("Not recording transient response %s for %s https://%s%s", status, self.command, host, path_qs)
+                server.count("not_recorded")
+
+        if server.latency:
+            time.sleep(server.latency + server.random() * server.jitter)
+        self.reply(status, headers, out)
+
+    def forward(self, host, path_qs, body):
+        headers = {name: self.headers[name] for name in ("Content-Type", "Accept", "User-Agent") if self.headers.get(name)}
+        response = self.server.session.request(self.command, f"https://{host}{path_qs}", data=body or None, headers=headers, timeout=self.server.timeout)
+        recorded_headers = {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers}
+        return response.status_code, recorded_headers, response.content
+
+    def reply(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, store, mode="replay", host="127.0.0.1", port=8765, latency_ms=0, jitter_ms=0,
+                 rate_limit=None, burst=None, error_rate=0.0, error_status=503, seed=None, timeout=100):
+        super().__init__((host, port), ReplayHandler)
+        self.store = FixtureStore(store)
+        self.mode = mode
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.bucket = TokenBucket(rate_limit, burst) if rate_limit else None
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {name: 0 for name in ("requests", "hits", "misses", "recorded", "not_recorded", "throttled", "injected_errors")}
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_port}"
+
+    def random(self):
+        with self._lock:
+            return self._random.random()
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def stats_snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+def redirect_endpoints(mapping):
+    """Send requests made with `requests` or `httpx` to other URLs instead (also used by ../structures/benchmark_structure_coverage.py).
+
+    Args:
+        mapping: dict of URL prefix -> base URL to replace it with (prefixes are tried in order, so more specific
+            prefixes must come first), or a function returning the URL to use for a URL
+    """
+    import requests.adapters
+    import httpx
+
+    def rewrite(url):
+        if callable(mapping):
+            return mapping(url)
+        for prefix, target in mapping.items():
+            if url.startswith(prefix):
+                return target + url[len(prefix):]
+        return url
+
+    requests_send = requests.adapters.HTTPAdapter.send
+
+    def send(self, request, *args, **kwargs):
+        request.url = rewrite(request.url)
+        return requests_send(self, request, *args, **kwargs)
+
+    httpx_handle = httpx.HTTPTransport.handle_request
+    httpx_handle_async = httpx.AsyncHTTPTransport.handle_async_request
+
+    def handle_request(self, request):
+        request.url = httpx.URL(rewrite(str(request.url)))
+        return httpx_handle(self, request)
+
+    async def handle_async_request(self, request):
+        request.url = httpx.URL(rewrite(str(request.url)))
+        return await httpx_handle_async(self, request)
+
+    requests.adapters.HTTPAdapter.send = send
+    httpx.HTTPTransport.handle_request = handle_request
+    httpx.AsyncHTTPTransport.handle_async_request = handle_async_request
+
+
+def redirect_to(server_url):
+    """Redirect all requests made to *.rcsb.org with `requests` or `httpx` to a replay server."""
+    server_url = server_url.rstrip("/")
+    redirect_endpoints(lambda url: RCSB_URL_RE.sub(lambda m: f"{server_url}/{m.group(1).lower()}", url, count=1))
+
+
+def exec_script(server_url, argv):
+    """Run a Python script as `__main__` with its RCSB.org requests redirected to `server_url`."""
+    redirect_to(server_url)
+    script = os.path.abspath(argv[0])
+    sys.argv = [script] + list(argv[1:])
+    sys.path.insert(0, os.path.dirname(script))
+    runpy.run_path(script, run_name="__main__")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record and replay RCSB.org API traffic with a local HTTP server.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve = subparsers.add_parser("serve", help="Run the record/replay server")
+    serve.add_argument("--store", default="rcsb-fixtures", help="Fixture store directory (default: %(default)s)")
+    serve.add_argument("--mode", choices=MODES, default="replay", help="Server mode (default: %(default)s)")
+    serve.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: %(default)s)")
+    serve.add_argument("--port", type=int, default=8765, help="Port to listen on (default: %(default)s)")
+    serve.add_argument("--latency-ms", type=float, default=0, help="Latency added to every response (default: %(default)s)")
+    serve.add_argument("--jitter-ms", type=float, default=0, help="Random extra latency of up to this many milliseconds (default: %(default)s)")
+    serve.add_argument("--rate-limit", type=float, default=None, help="Answer with HTTP 429 above this many requests per second")
+    serve.add_argument("--burst", type=int, default=None, help="Number of requests allowed in a burst above the rate limit (default: the rate limit)")
+    serve.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a server error (default: %(default)s)")
+    serve.add_argument("--error-status", type=int, default=503, help="HTTP status of injected errors (default: %(default)s)")
+    serve.add_argument("--seed", type=int, default=None, help="Random seed for latency jitter and injected errors")
+    serve.add_argument("-v", "--verbose", action="store_true", help="Log every request")
+
+    run = subparsers.add_parser("exec", help="Run a Python script with its RCSB.org requests sent to the server")
+    run.add_argument("--server", default=os.environ.get("RCSB_REPLAY_SERVER", "http://127.0.0.1:8765"), help="Replay server URL (default: $RCSB_REPLAY_SERVER or %(default)s)")
+    run.add_argument("script", nargs=argparse.REMAINDER, help="Script path and its arguments (after '--')")
+
+    args = parser.parse_args()
+
+    if args.command == "exec":
+        script_argv = args.script[1:] if args.script[:1] == ["--"] else args.script
+        if not script_argv:
+            run.error("a script to run is required")
+        exec_script(args.server, script_argv)
+    else:
+        logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(asctime)s [%(levelname)s]: %(message)s")
+        server = ReplayServer(
+            args.store, mode=args.mode, host=args.host, port=args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+            rate_limit=args.rate_limit, burst=args.burst, error_rate=args.error_rate, error_status=args.error_status, seed=args.seed,
+        )
+        logger.info("Serving %s mode on %s (fixture store: %s)", args.mode, server.url, os.path.abspath(args.store))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
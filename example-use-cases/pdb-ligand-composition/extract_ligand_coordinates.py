@@ -6,6 +6,11 @@ Note that this script is only intended to be used on a selective basis (e.g., on
 at a time), as it relies on intensive API queries. This should NOT be used not for large-scale analysis, as
 trying to do so will require a significant amount of time and likely fail.
 
+With --use-structure-cache, ligands are extracted from full entry files kept in the shared structure cache instead
+of querying the Model API, so that extracting several ligands from the same entries (or re-running the script)
+downloads each entry only once. This option requires the structure_cache.py module of example-use-cases/structures
+to be importable: add that folder to PYTHONPATH (as in the example below) or copy the file next to this script.
+
 
 Requirements:
     pip install "rcsb-api>=1.4.0"
@@ -25,6 +30,9 @@ Usage:
     # Extract the CPT ligand coordinates from all PDB entries that contain it
         python3 extract_ligand_coordinates.py -c CPT
 
+    # Extract the HEM and PO4 ligand coordinates from full entry files, downloaded once to the structure cache
+        PYTHONPATH=../structures python3 extract_ligand_coordinates.py -c HEM PO4 -n 10 --use-structure-cache
+
 Output:
     output/<CID>-coordinates.cif  # one file per CID
 """
@@ -44,34 +52,73 @@ logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s]:
 logger = logging.getLogger(__name__)
 
 
+def load_structure_cache():
+    """Return the shared structure cache (requires structure_cache.py, see the module docstring)."""
+    try:
+        from structure_cache import get_default_cache
+    except ImportError as e:
+        raise ImportError(
+            "--use-structure-cache requires structure_cache.py from example-use-cases/structures: "
+            "add that folder to PYTHONPATH or copy the file next to this script"
+        ) from e
+    return get_default_cache()
+
+
 class LigandCoordinatesExtract:
     """
     This class provides methods to download and clean mmCIF data for specific ligands in PDB entries.
     It retains only the "chem_comp" and "atom_site" categories.
     """
 
-    def __init__(self):
+    def __init__(self, use_structure_cache=False):
         self.model_query = ModelQuery()
+        self.structure_cache = None
+        if use_structure_cache:
+            self.structure_cache = load_structure_cache()
         self.data_container_list = []
 
+    def read_cached(self, ccd_id: str, pdb_id: str):
+        """
+        Read the "chem_comp" and "atom_site" rows of a ligand from the entry file in the structure cache.
+        """
+        temp_data_container = []
+        with open(self.structure_cache.path(pdb_id, "cif")) as f:
+            PdbxReader(f).read(temp_data_container, ["chem_comp", "atom_site"])
+        for dc in temp_data_container:
+            for cat_name, attribute in (("chem_comp", "id"), ("atom_site", "label_comp_id")):
+                if dc.exists(cat_name):
+                    cat = dc.getObj(cat_name)
+                    index = cat.getAttributeIndex(attribute)
+                    cat.setRowList([row for row in cat.getRowList() if row[index] == ccd_id])
+        if not any(dc.exists("atom_site") and dc.getObj("atom_site").getRowCount() for dc in temp_data_container):
+            return []
+        return temp_data_container
+
     def process_one(self, ccd_id: str, pdb_id: str):
         """
         Retrieve and cleans mmCIF data for a specific ligand in a given PDB entry.
         """
         try:
-            # Query the API for atoms related to the ligand in the specified entry
-            result = self.model_query.get_atoms(entry_id=pdb_id, label_comp_id=ccd_id)
-            if not result:
-                logger.warning(f"No data found for {ccd_id} in {pdb_id}")
-                return None
-
-            # Read the result into a file-like object
-            file_like = io.StringIO(result)
-            pR = PdbxReader(file_like)
+            if self.structure_cache is not None:
+                # Read the atoms of the ligand from the full entry file
+                temp_data_container = self.read_cached(ccd_id, pdb_id)
+                if not temp_data_container:
+                    logger.warning(f"No data found for {ccd_id} in {pdb_id}")
+                    return None
+            else:
+                # Query the API for atoms related to the ligand in the specified entry
+                result = self.model_query.get_atoms(entry_id=pdb_id, label_comp_id=ccd_id)
+                if not result:
+                    logger.warning(f"No data found for {ccd_id} in {pdb_id}")
+                    return None
+
+                # Read the result into a file-like object
+                file_like = io.StringIO(result)
+                pR = PdbxReader(file_like)
+                temp_data_container = []
+                pR.read(temp_data_container, ["chem_comp", "atom_site"])
 
             # update data container header
-            temp_data_container = []
-            pR.read(temp_data_container, ["chem_comp", "atom_site"])
             for dc in temp_data_container:
                 dc.setName(dc.getName() + "_" + ccd_id.upper())
 
@@ -182,7 +229,7 @@ def search_pdb_by_ccid(ccd_id, pdbid_limit_list=None, pdb_limit_num=None):
     return l_ccd_pdbids
 
 
-def extract_ligand_coordinates(ccid_list: list, pdbid_limit_list: list, pdb_limit_num: int, output_dir: str, write_interval: int = 10):
+def extract_ligand_coordinates(ccid_list: list, pdbid_limit_list: list, pdb_limit_num: int, output_dir: str, write_interval: int = 10, use_structure_cache: bool = False):
     """Extract ligand coordinates from PDB entries for provided list of CCD IDs and specified limits.
 
     Args:
@@ -191,6 +238,8 @@ def extract_ligand_coordinates(ccid_list: list, pdbid_limit_list: list, pdb_limi
         pdb_limit_num (int): max number of PDB IDs to extract the ligand from
         output_dir (str): output directory to write extracted ligand coordinate files to
         write_interval (int): how many sets of coordinates to write out at once (and clear internal memory)
+        use_structure_cache (bool): read all entries from full entry files in the structure cache (downloading them
+            if needed) instead of querying the Model API
     """
     # Create the output directory if it doesn't exist
     Path(output_dir).mkdir(parents=True, exist_ok=True)
@@ -202,7 +251,7 @@ def extract_ligand_coordinates(ccid_list: list, pdbid_limit_list: list, pdb_limi
         if ccd_pdbid_list:
             if len(ccd_pdbid_list) >= 25:
                 logger.warning(f"Warning: Extracting coordinate data for {len(ccd_pdbid_list)} ligands - process may take a while to finish.")
-            ligand_extractor = LigandCoordinatesExtract()
+            ligand_extractor = LigandCoordinatesExtract(use_structure_cache)
             ligand_extractor.process_all(ccd_id, ccd_pdbid_list, fp_out, write_interval=write_interval)
         else:
             logger.error(f"Failed to find PDB entries with CCD ID {ccd_id}")
@@ -219,8 +268,14 @@ if __name__ == "__main__":
     limit_extraction = parser.add_mutually_exclusive_group(required=False)
     limit_extraction.add_argument("-p", "--pdbids", nargs="+", default=None, help="Space-separated list of PDB IDs to limit the extraction on")
     limit_extraction.add_argument("-n", "--max-num-ids", default=None, help="Limit extraction to the specified number of PDB entries")
+    parser.add_argument("--use-structure-cache", action="store_true", help="Download full entry files to the shared structure cache and extract the ligands from them, instead of querying the Model API")
 
     args = parser.parse_args()
+    if args.use_structure_cache:
+        try:
+            load_structure_cache()
+        except ImportError as e:
+            parser.error(str(e))
 
     input_ccid_list = [ccid.upper() for ccid in args.ccids]
     input_pdbid_list = [pdbid.upper() for pdbid in args.pdbids] if args.pdbids else None
@@ -229,6 +284,6 @@ if __name__ == "__main__":
     print(f"List of CCD IDs for which to extract ligand coordinates: {','.join(input_ccid_list)}")
 
     start = time.time()
-    extract_ligand_coordinates(input_ccid_list, input_pdbid_list, n_pdb_limit, output_dir)
+    extract_ligand_coordinates(input_ccid_list, input_pdbid_list, n_pdb_limit, output_dir, use_structure_cache=args.use_structure_cache)
     end = time.time()
     print(f"Processing completed in {end - start:.2f} seconds.")
@@ -4,6 +4,10 @@ This script is designed to simplify the use of the RCSB.org Alignment API and ma
 This service allows for the alignment of two individual structural chains and computes the RMSD and TM score (when available)
 using one of multiple alignment algorithm options. Support for aligning multimeric assemblies is not yet available.
 
+Requirements:
+
+    pip install requests httpx
+
 For help and a list of all possible options/flags, run:
 
     python alignment_api.py --help
@@ -30,16 +34,93 @@ EXAMPLE USAGE:
 
     python alignment_api.py 5QU3 A 10GS A --csv results.csv
 
+BATCH MODE:
+
+Many alignments can be run in one process. Jobs are submitted concurrently (at most --workers at a time) over one
+pooled HTTP session, all tickets are polled from one event loop with exponential backoff (giving up on a job after
+--timeout seconds, and on the whole batch after --deadline seconds), and a CSV row is written for each pair as soon
+as its result arrives. Input files list one structure per line as "<PDB ID or file> <chain>" (chain lists) or two
+per line as "<input1> <chain1> <input2> <chain2>" (pair lists); fields can be separated by whitespace or commas,
+and lines starting with "#" are ignored.
+
+Local mmCIF files (plain or .gz) are uploaded as plain mmCIF trimmed to the atom_site rows of the selected chain.
+With --compress, the trimmed file is sent gzip-compressed instead (as "<name>.cif.gz", application/gzip, still declared
+as "mmcif"); this relies on the service detecting the compression of uploaded files, which is not documented, so it is
+off by default. The prepared upload is re-used for every pair a file takes part in.
+
+Results are cached on disk (in --cache-dir), keyed by both structures, their chains, the method and its
+parameters; local files are identified by a hash of their content. Aligning a pair again returns the stored result
+without submitting a job. Use --no-cache to always submit new jobs.
+
+6) Align all pairs listed in a file:
+
+    python alignment_api.py --pairs pairs.txt --csv results.csv --workers 16
+
+7) Align all chains in a list against each other (all-vs-all):
+
+    python alignment_api.py --all-vs-all chains.txt --csv results.csv
+
+8) Align one chain against all chains in a list (one-vs-many):
+
+    python alignment_api.py 5QU3 A --against chains.txt --csv results.csv
+
+In batch mode, --prefilter MIN_SCORE first scores every pair locally from the Cα coordinates of both chains (length
+ratio, Cα distance histogram and a quick superposition, see alignment_prefilter.py; requires numpy) and only
+submits pairs scoring at least MIN_SCORE (between 0 and 1). PDB entries are read from the shared structure cache
+(see structure_cache.py), so each entry is downloaded once for all scripts.
+
+9) Align all chains in a list against each other, skipping pairs that are clearly dissimilar:
+
+    python alignment_api.py --all-vs-all chains.txt --csv results.csv --prefilter 0.4
+
+Only the scores are printed (use --print-json to print the full response of a single alignment). With --store, the
+scores, aligned residue ranges and rotation/translation of every aligned block are added to an .npz file as typed
+arrays (see alignment_store.py; requires numpy), for superposition or clustering without re-running jobs.
+
+10) Keep the transformations of an all-vs-all run:
+
+    python alignment_api.py --all-vs-all chains.txt --csv results.csv --store alignments.npz
+
 """
 
 import requests
+import httpx
+import asyncio
 import json
 import time
 import argparse
 import os
 import csv
+import itertools
+import random
+import threading
+import hashlib
+import functools
+import gzip
+import re
+from concurrent.futures import ThreadPoolExecutor
+from cache_budget import CacheBudget
 
 SUBMIT_URL = "https://alignment.rcsb.org/api/v1/structures/submit"
+RESULTS_URL = "https://alignment.rcsb.org/api/v1/structures/results"
+
+# Polling of job results: exponential backoff from POLL_INITIAL_DELAY up to POLL_MAX_DELAY seconds between polls
+# of a ticket, giving up after POLL_TICKET_TIMEOUT seconds
+POLL_INITIAL_DELAY = 1
+POLL_MAX_DELAY = 30
+POLL_TICKET_TIMEOUT = 900
+# Maximum number of concurrent poll requests in batch mode
+MAX_CONCURRENT_POLLS = 16
+FAILED_STATUSES = ("ERROR", "FAILED", "FAILURE")
+
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "rcsb-alignment")
+DEFAULT_CACHE_MAX_MB = 1024
+
+# Status codes for which a job submission is retried (after the delay requested by the service, if any)
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+MAX_SUBMIT_RETRIES = 5
+
+BATCH_CSV_FIELDS = ["input1", "chain1", "input2", "chain2", "ticket", "method", "rmsd", "tm_score", "error"]
 
 METHOD_DEFAULTS = {
     "fatcat-rigid": {
@@ -91,14 +172,100 @@ def resolve_input(user_input):
         return {"type": "pdb_id", "value": user_input}
 
 
+@functools.lru_cache(maxsize=None)
+def _file_digest(path, size, mtime):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def structure_identity(resolved):
+    """Identify a structure by its PDB ID, or by the SHA-256 of its content for local files (not by its path)."""
+    if resolved["type"] == "pdb_id":
+        return f"pdb:{resolved['value'].upper()}"
+    stat = os.stat(resolved["value"])
+    return f"sha256:{_file_digest(os.path.abspath(resolved['value']), stat.st_size, stat.st_mtime_ns)}"
+
+
+class AlignmentCache:
+    """On-disk cache of alignment results, keyed by the content of the request rather than by ticket.
+
+    The key covers the identity of both structures (see `structure_identity`), their chains, the method and the
+    complete method parameters (including defaults), so a local file that is moved or renamed still hits the
+    cache, while an edited file does not. When the cache grows beyond `max_bytes`, the least recently used results
+    are removed (the size of the cache is tracked as results are added, see cache_budget.py).
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_MB * 2**20):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.budget = CacheBudget(self.cache_dir, ".json", max_bytes)
+
+    def key(self, pdb1, pdb2, chain1, chain2, method, user_params):
+        request = {
+            "structures": [[structure_identity(pdb1), chain1], [structure_identity(pdb2), chain2]],
+            "method": method,
+            "parameters": build_method_parameters(method, user_params),
+        }
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """Return the cached entry ({"ticket", "rmsd", "tm_score", "results"}) or None."""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # The modification time of an entry records when it was last used
+        os.utime(path)
+        return entry
+
+    def put(self, key, ticket, results):
+        rmsd, tmscore = extract_scores(results)
+        entry = {"ticket": ticket, "rmsd": rmsd, "tm_score": tmscore, "results": results}
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        self.budget.add(path)
+
+    def evict(self):
+        self.budget.evict()
+
+
 def parse_arguments():
     p = argparse.ArgumentParser(description="Run RCSB pairwise alignment")
-    p.add_argument("input1", help="PDB ID or path to local PDB file")
-    p.add_argument("chain1", help="Chian ID for first structure")
-    p.add_argument("input2", help="PDB ID or path to local PDB file")
-    p.add_argument("chain2", help="Chain ID for second structure")
+    p.add_argument("input1", nargs="?", help="PDB ID or path to local PDB file")
+    p.add_argument("chain1", nargs="?", help="Chian ID for first structure")
+    p.add_argument("input2", nargs="?", help="PDB ID or path to local PDB file")
+    p.add_argument("chain2", nargs="?", help="Chain ID for second structure")
     p.add_argument("--csv", help="Optional output CSV file to save summary results")
 
+    batch = p.add_mutually_exclusive_group()
+    batch.add_argument("--pairs", help="Batch mode: file listing the pairs to align")
+    batch.add_argument("--all-vs-all", help="Batch mode: file listing chains to align against each other")
+    batch.add_argument("--against", help="Batch mode: file listing chains to align input1/chain1 against")
+    p.add_argument("--workers", type=int, default=8, help="Batch mode: number of concurrent alignment jobs (default: 8)")
+    p.add_argument("--timeout", type=float, default=POLL_TICKET_TIMEOUT, help=f"Seconds to wait for each job (default: {POLL_TICKET_TIMEOUT})")
+    p.add_argument("--deadline", type=float, help="Batch mode: seconds after which remaining jobs are given up")
+    p.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help=f"Directory of cached alignment results (default: {DEFAULT_CACHE_DIR})")
+    p.add_argument("--cache-max-mb", type=float, default=DEFAULT_CACHE_MAX_MB, help=f"Maximum size of the result cache in MB (default: {DEFAULT_CACHE_MAX_MB})")
+    p.add_argument("--no-cache", action="store_true", help="Always submit new jobs, without reading or writing cached results")
+    p.add_argument("--compress", action="store_true", help="Upload local files gzip-compressed instead of as plain mmCIF (the service must accept gzipped mmCIF)")
+    p.add_argument("--store", help="Add the scores, aligned regions and transformations of each alignment to this .npz file (requires numpy)")
+    p.add_argument("--print-json", action="store_true", help="Print the full JSON response of a single alignment")
+    p.add_argument("--prefilter", type=float, metavar="MIN_SCORE", help="Batch mode: only submit pairs with a local prefilter score of at least MIN_SCORE (0-1)")
+    p.add_argument("--prefilter-length-ratio", type=float, default=0.5, help="Batch mode: minimum ratio of the shorter to the longer chain length for the prefilter (default: 0.5)")
+    p.add_argument("--structure-cache", help="Directory of the structure cache used by the prefilter (default: RCSB_STRUCTURE_CACHE or ~/.cache/rcsb-structures)")
+
     p.add_argument(
         "--method",
         choices=[
@@ -164,7 +331,125 @@ def build_structure_json(resolved, chain):
         }
 
 
-def submit_alignment_job(pdb1, pdb2, chain1, chain2, method, user_params):
+CIF_TOKEN_RE = re.compile(r"""'(?:[^']|'(?=\S))*'|"(?:[^"]|"(?=\S))*"|\S+""")
+
+
+def trim_mmcif(text, chain):
+    """Keep only the atom_site rows of one chain (by label_asym_id) and drop atom_site_anisotrop.
+
+    All other categories are kept as they are. If the atom_site loop cannot be parsed one row per line, the text is
+    returned unchanged.
+    """
+    lines = text.splitlines(keepends=True)
+    out = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.strip() != "loop_" or i + 1 >= len(lines):
+            out.append(line)
+            i += 1
+            continue
+
+        # Read the item names of the loop
+        j = i + 1
+        items = []
+        while j < len(lines) and lines[j].lstrip().startswith("_"):
+            items.append(lines[j].strip())
+            j += 1
+        category = items[0].split(".", 1)[0] if items else ""
+
+        # Read the rows of the loop (up to the next loop, category or comment)
+        k = j
+        while k < len(lines) and not lines[k].lstrip().startswith(("_", "#", "loop_", "data_")):
+            k += 1
+        rows = lines[j:k]
+
+        if category == "_atom_site_anisotrop":
+            pass
+        elif category == "_atom_site" and "_atom_site.label_asym_id" in items:
+            column = items.index("_atom_site.label_asym_id")
+            kept = []
+            for row in rows:
+                tokens = CIF_TOKEN_RE.findall(row)
+                if not tokens:
+                    continue
+                if len(tokens) != len(items):
+                    return text
+                if tokens[column] == chain:
+                    kept.append(row)
+            out.extend(lines[i:j] + kept)
+        else:
+            out.extend(lines[i:k])
+        i = k
+    return "".join(out)
+
+
+@functools.lru_cache(maxsize=64)
+def _prepared_upload(identity, path, chain, compress):
+    with open(path, "rb") as f:
+        content = f.read()
+    filename = os.path.basename(path)
+    if filename.endswith(".gz"):
+        content = gzip.decompress(content)
+        filename = filename[:-3]
+    content = trim_mmcif(content.decode("utf-8", errors="replace"), chain).encode()
+    if compress:
+        return f"{filename}.gz", gzip.compress(content, compresslevel=6, mtime=0), "application/gzip"
+    return filename, content, "chemical/x-mmcif"
+
+
+def prepare_upload(resolved, chain, compress=False):
+    """Return the multipart file tuple for a local structure file, trimmed to `chain` (and gzip-compressed if `compress`).
+
+    Payloads are memoised by file content, so a file that takes part in many pairs of a batch is only read,
+    trimmed and compressed once.
+    """
+    return _prepared_upload(structure_identity(resolved), os.path.abspath(resolved["value"]), chain, compress)
+
+
+def read_structure_list(path, fields_per_line):
+    """Read lines of whitespace- or comma-separated fields, skipping blank lines and "#" comments."""
+    rows = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.split("#", 1)[0].replace(",", " ").split()
+            if not line:
+                continue
+            if len(line) != fields_per_line:
+                raise ValueError(f"{path}, line {line_number}: expected {fields_per_line} fields, found {len(line)}")
+            rows.append(tuple(line))
+    return rows
+
+
+def build_pairs(args):
+    """Return the list of (input1, chain1, input2, chain2) to align, from the command line arguments."""
+    if args.pairs:
+        return read_structure_list(args.pairs, 4)
+
+    if args.all_vs_all:
+        chains = list(dict.fromkeys(read_structure_list(args.all_vs_all, 2)))
+        return [first + second for first, second in itertools.combinations(chains, 2)]
+
+    if args.against:
+        if not (args.input1 and args.chain1):
+            raise ValueError("--against requires input1 and chain1")
+        query = (args.input1, args.chain1)
+        return [query + target for target in dict.fromkeys(read_structure_list(args.against, 2)) if target != query]
+
+    if not all([args.input1, args.chain1, args.input2, args.chain2]):
+        raise ValueError("Specify input1 chain1 input2 chain2, or one of --pairs, --all-vs-all, --against")
+    return [(args.input1, args.chain1, args.input2, args.chain2)]
+
+
+def create_session(pool_size):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def submit_alignment_job(pdb1, pdb2, chain1, chain2, method, user_params, session=None, verbose=True, compress=False):
 
     structure1 = build_structure_json(pdb1, chain1)
     structure2 = build_structure_json(pdb2, chain2)
@@ -186,117 +471,274 @@ def submit_alignment_job(pdb1, pdb2, chain1, chain2, method, user_params):
 
     if pdb1["type"] == "file":
         files.append(
-            (f"files", ("filename", open(pdb1["value"], "r"))),
+            (f"files", prepare_upload(pdb1, chain1, compress)),
         )
 
     if pdb2["type"] == "file":
         files.append(
-            (f"files", ("filename", open(pdb2["value"], "r"))),
+            (f"files", prepare_upload(pdb2, chain2, compress)),
         )
 
-    response = requests.post(SUBMIT_URL, data=data, files=files)
+    for attempt in range(MAX_SUBMIT_RETRIES + 1):
+        response = (session or requests).post(SUBMIT_URL, data=data, files=files)
+        if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_SUBMIT_RETRIES:
+            break
+        # Back off when the service is busy or rate limiting
+        retry_after = response.headers.get("Retry-After", "")
+        time.sleep(float(retry_after) if retry_after.isdigit() else 2 ** attempt)
 
     if response.status_code != 200:
         raise Exception(f"Job submission failed with {response.status_code}: {response.text}")
 
     ticket = response.text.strip()
-    print(f"Submitted job → Ticket: {ticket}")
+    if verbose:
+        print(f"Submitted job → Ticket: {ticket}")
 
     return ticket
 
 
-def get_alignment_results(ticket):
+class AlignmentJobError(Exception):
+    """An alignment job that did not produce a result.
 
-    RESULTS_URL = f"https://alignment.rcsb.org/api/v1/structures/results?uuid={ticket}"
+    Attributes:
+        ticket (str): job ticket (None if the job was never submitted)
+        reason (str): "failed" (reported by the service), "timeout" (per-ticket timeout), "deadline" (global
+            deadline) or "submit" (submission failed)
+        status (str): last job status reported by the service, if any
+        detail (str): additional information, e.g. the message of the service
+    """
 
-    while True:
-        response = requests.get(RESULTS_URL)
+    def __init__(self, ticket, reason, status=None, detail=None):
+        self.ticket = ticket
+        self.reason = reason
+        self.status = status
+        self.detail = detail
+        super().__init__(f"{reason}: ticket {ticket}, status {status}" + (f" ({detail})" if detail else ""))
 
-        if response.status_code != 200:
-            print("Waiting for job to finish...")
-            time.sleep(2)
-            continue
 
-        try:
-            js = response.json()
-        except:
-            print("Not ready yet...")
-            time.sleep(1)
-            continue
+def backoff_delay(attempt, initial_delay=POLL_INITIAL_DELAY, max_delay=POLL_MAX_DELAY):
+    """Exponential backoff with jitter: a random delay between half and all of min(max_delay, initial_delay * 2^attempt)."""
+    delay = min(max_delay, initial_delay * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
 
-        status = None
+async def poll_ticket(client, ticket, ticket_timeout=POLL_TICKET_TIMEOUT, deadline=None, semaphore=None, on_status=None):
+    """Poll one ticket until its job completes, with exponential backoff between polls.
 
-        if "info" in js:
-            status = js["info"].get("status", "").upper()
+    Args:
+        client (httpx.AsyncClient): client shared by all pollers
+        ticket (str): job ticket
+        ticket_timeout (float): seconds after which the job is given up
+        deadline (float, optional): `time.monotonic()` time after which no more polls are made
+        semaphore (asyncio.Semaphore, optional): limits the number of concurrent poll requests
+        on_status (callable, optional): called with the new status whenever it changes
 
-        print(f"Job status: {status}")
+    Returns:
+        dict: alignment results
+
+    Raises:
+        AlignmentJobError: if the job fails or times out
+    """
+    start = time.monotonic()
+    status = None
+    attempt = 0
+
+    while True:
+        try:
+            if semaphore:
+                async with semaphore:
+                    response = await client.get(RESULTS_URL, params={"uuid": ticket})
+            else:
+                response = await client.get(RESULTS_URL, params={"uuid": ticket})
+            # Anything other than a JSON body with a status (e.g., a busy or rate-limited service) is retried
+            js = response.json() if response.status_code == 200 else {}
+        except (httpx.HTTPError, ValueError):
+            js = {}
+
+        new_status = (js.get("info") or {}).get("status", "").upper() or status
+        if new_status != status and on_status:
+            on_status(new_status)
+        status = new_status
 
         if status == "COMPLETE":
             return js
+        if status in FAILED_STATUSES:
+            raise AlignmentJobError(ticket, "failed", status, (js.get("info") or {}).get("message"))
 
-        time.sleep(1)
-        print("Results:")
-        print(response.text)
+        now = time.monotonic()
+        if now - start >= ticket_timeout:
+            raise AlignmentJobError(ticket, "timeout", status, f"no result after {now - start:.0f} s")
+        if deadline is not None and now >= deadline:
+            raise AlignmentJobError(ticket, "deadline", status)
+        # The last poll is made when the time is up, rather than giving up while time remains
+        delay = min(backoff_delay(attempt), start + ticket_timeout - now)
+        if deadline is not None:
+            delay = min(delay, deadline - now)
+        attempt += 1
+        await asyncio.sleep(delay)
 
 
-def extract_summary(results, method):
-    print(json.dumps(results, indent=2))
+def get_alignment_results(ticket, verbose=True, ticket_timeout=POLL_TICKET_TIMEOUT):
 
-    try:
-        if isinstance(results.get("results"), list) and len(results["results"]) > 0:
-            result_obj = results["results"][0]
-        else:
-            print("Results array is missing or empty.")
-            return
+    def print_status(status):
+        if verbose:
+            print(f"Job status: {status}")
 
-        summary = result_obj.get("summary", {})
-        scores = summary.get("scores", [])
+    async def poll():
+        async with httpx.AsyncClient(timeout=60) as client:
+            return await poll_ticket(client, ticket, ticket_timeout=ticket_timeout, on_status=print_status)
 
-        rmsd = "N/A"
-        tmscore = "N/A"
+    return asyncio.run(poll())
 
-        for s in scores:
-            if not isinstance(s, dict):
-                continue
-            t = s.get("type", "").lower()
-            if t == "rmsd":
-                rmsd = s.get("value", "N/A")
-            elif t in ("tm-score", "tmscore", "tm_score"):
-                tmscore = s.get("value", "N/A")
-
-        print("\n===== SUMMARY =====")
-        print(f"You used {method} for alignment")
-        print(f"RMSD: {rmsd}")
-        print(f"TM-score: {tmscore}")
-        print("===================")
 
-    except Exception as e:
-        print("Could not extract summary:", e)
+def extract_summary(results, method, print_json=False):
+    if print_json:
+        print(json.dumps(results, indent=2))
 
+    if not (isinstance(results.get("results"), list) and len(results["results"]) > 0):
+        print("Results array is missing or empty.")
+        return
+
+    rmsd, tmscore = extract_scores(results)
+
+    print("\n===== SUMMARY =====")
+    print(f"You used {method} for alignment")
+    print(f"RMSD: {rmsd}")
+    print(f"TM-score: {tmscore}")
+    print("===================")
+
+
+def extract_scores(results):
+    """Return the RMSD and TM-score of an alignment result ("N/A" if missing)."""
+    rmsd = "N/A"
+    tmscore = "N/A"
+
+    if not (isinstance(results.get("results"), list) and len(results["results"]) > 0):
+        return rmsd, tmscore
+
+    for s in results["results"][0].get("summary", {}).get("scores", []):
+        if not isinstance(s, dict):
+            continue
+        t = s.get("type", "").lower()
+        if t == "rmsd":
+            rmsd = s.get("value", "N/A")
+        elif t in ("tm-score", "tmscore", "tm_score"):
+            tmscore = s.get("value", "N/A")
+
+    return rmsd, tmscore
+
+
+async def align_pairs(pairs, method, user_params, on_result, workers=8, ticket_timeout=POLL_TICKET_TIMEOUT, deadline=None, cache=None, compress=False):
+    """Align many pairs, with at most `workers` jobs in flight.
+
+    Jobs are submitted from a thread pool over one pooled session, and all tickets are polled from one event loop
+    over one pooled client, each with its own backoff. `on_result(pair, ticket, results, error)` is called as each
+    pair completes, with either the results or an `AlignmentJobError`.
+
+    Args:
+        deadline (float, optional): seconds after which no more jobs are submitted or polled
+        cache (AlignmentCache, optional): pairs found in the cache are not submitted, and new results are added
+    """
+    loop = asyncio.get_running_loop()
+    deadline = time.monotonic() + deadline if deadline else None
+    jobs = asyncio.Semaphore(workers)
+    polls = asyncio.Semaphore(MAX_CONCURRENT_POLLS)
+    session = create_session(workers)
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def align(pair):
+        input1, chain1, input2, chain2 = pair
+        ticket = None
+        if cache:
+            try:
+                key = await loop.run_in_executor(executor, cache.key, resolve_input(input1), resolve_input(input2), chain1, chain2, method, user_params)
+                cached = await loop.run_in_executor(executor, cache.get, key)
+            except OSError as e:
+                on_result(pair, None, None, AlignmentJobError(None, "submit", detail=str(e)))
+                return
+            if cached:
+                on_result(pair, cached["ticket"], cached["results"], None)
+                return
+        async with jobs:
+            try:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise AlignmentJobError(None, "deadline")
+                try:
+                    ticket = await loop.run_in_executor(
+                        executor, lambda: submit_alignment_job(resolve_input(input1), resolve_input(input2), chain1, chain2, method, user_params, session=session, verbose=False, compress=compress)
+                    )
+                except Exception as e:
+                    raise AlignmentJobError(None, "submit", detail=str(e))
+                results = await poll_ticket(client, ticket, ticket_timeout=ticket_timeout, deadline=deadline, semaphore=polls)
+            except AlignmentJobError as e:
+                on_result(pair, ticket, None, e)
+                return
+        if cache:
+            await loop.run_in_executor(executor, cache.put, key, ticket, results)
+        on_result(pair, ticket, results, None)
 
-def write_csv_summary(csv_path, ticket, method, results):
     try:
-        if isinstance(results.get("results"), list) and len(results["results"]) > 0:
-            result_obj = results["results"][0]
+        async with httpx.AsyncClient(timeout=60, limits=httpx.Limits(max_connections=MAX_CONCURRENT_POLLS)) as client:
+            await asyncio.gather(*(align(pair) for pair in pairs))
+    finally:
+        executor.shutdown()
+        session.close()
+
+
+def run_batch(pairs, method, user_params, csv_path=None, workers=8, ticket_timeout=POLL_TICKET_TIMEOUT, deadline=None, cache=None, compress=False, store=None):
+    """Align many pairs concurrently, writing one CSV row per pair as soon as it completes.
+
+    Successful alignments are also added to `store` (an `AlignmentStore`), if given.
+
+    Returns:
+        tuple: numbers of successful and failed alignments
+    """
+    # Check the method parameters once, rather than failing every job
+    build_method_parameters(method, user_params)
+
+    counts = {"succeeded": 0, "failed": 0}
+    handle = None
+    writer = None
+    if csv_path:
+        file_exists = os.path.isfile(csv_path)
+        handle = open(csv_path, mode="a", newline="")
+        writer = csv.DictWriter(handle, fieldnames=BATCH_CSV_FIELDS)
+        if not file_exists:
+            writer.writeheader()
+
+    # Called from the event loop thread only, so rows are never written concurrently
+    def write_result(pair, ticket, results, error):
+        row = dict(zip(["input1", "chain1", "input2", "chain2"], pair), method=method, ticket=ticket or "", rmsd="N/A", tm_score="N/A", error="")
+        if error:
+            row["error"] = str(error)
+            counts["failed"] += 1
         else:
-            print("No results to write to CSV.")
-            return
+            row["rmsd"], row["tm_score"] = extract_scores(results)
+            counts["succeeded"] += 1
+            if store is not None:
+                store.add(pair, method, ticket, results, (row["rmsd"], row["tm_score"]))
+        print(f"[{counts['succeeded'] + counts['failed']}/{len(pairs)}] {' '.join(pair)}: RMSD {row['rmsd']}, TM-score {row['tm_score']}{' ERROR ' + row['error'] if row['error'] else ''}")
+        if writer:
+            writer.writerow(row)
+            handle.flush()
+
+    try:
+        asyncio.run(align_pairs(pairs, method, user_params, write_result, workers=workers, ticket_timeout=ticket_timeout, deadline=deadline, cache=cache, compress=compress))
+    finally:
+        if handle:
+            handle.close()
 
-        summary = result_obj.get("summary", {})
-        scores = summary.get("scores", [])
+    return counts["succeeded"], counts["failed"]
 
-        rmsd = "N/A"
-        tmscore = "N/A"
 
-        for s in scores:
-            if not isinstance(s, dict):
-                continue
-            t = s.get("type", "").lower()
-            if t == "rmsd":
-                rmsd = s.get("value", "N/A")
-            elif t in ("tm-score", "tmscore", "tm_score"):
-                tmscore = s.get("value", "N/A")
+def write_csv_summary(csv_path, ticket, method, results):
+    if not (isinstance(results.get("results"), list) and len(results["results"]) > 0):
+        print("No results to write to CSV.")
+        return
 
+    rmsd, tmscore = extract_scores(results)
+
+    try:
         file_exists = os.path.isfile(csv_path)
 
         with open(csv_path, mode="a", newline="") as f:
@@ -317,20 +759,65 @@ def main():
 
     args = parse_arguments()
 
+    try:
+        pairs = build_pairs(args)
+    except ValueError as e:
+        raise SystemExit(f"Error: {e}")
+
+    cache = None if args.no_cache else AlignmentCache(args.cache_dir, max_bytes=args.cache_max_mb * 2**20)
+
+    store = None
+    if args.store:
+        from alignment_store import AlignmentStore
+        store = AlignmentStore.load(args.store)
+
+    if args.pairs or args.all_vs_all or args.against:
+        if args.prefilter is not None:
+            from alignment_prefilter import prefilter_pairs
+            from structure_cache import StructureCache, get_default_cache
+            total = len(pairs)
+            structure_cache = StructureCache(args.structure_cache) if args.structure_cache else get_default_cache()
+            pairs, _ = prefilter_pairs(pairs, min_score=args.prefilter, min_length_ratio=args.prefilter_length_ratio, cache=structure_cache)
+            print(f"Prefilter kept {len(pairs)} of {total} pairs (minimum score {args.prefilter})")
+        print(f"Aligning {len(pairs)} pairs with {args.method} ({args.workers} concurrent jobs)")
+        try:
+            succeeded, failed = run_batch(pairs, args.method, args.params, csv_path=args.csv, workers=args.workers, ticket_timeout=args.timeout, deadline=args.deadline, cache=cache, compress=args.compress, store=store)
+        finally:
+            if store is not None:
+                store.save(args.store)
+        print(f"Completed {succeeded} alignments, {failed} failed")
+        return
+
     pdb1 = resolve_input(args.input1)
     pdb2 = resolve_input(args.input2)
 
     chain1 = args.chain1
     chain2 = args.chain2
 
-    ticket = submit_alignment_job(pdb1, pdb2, chain1, chain2, args.method, args.params) 
-    results = get_alignment_results(ticket)
+    key = cache.key(pdb1, pdb2, chain1, chain2, args.method, args.params) if cache else None
+    cached = cache.get(key) if cache else None
+    if cached:
+        ticket, results = cached["ticket"], cached["results"]
+        print(f"Using cached result of ticket {ticket}")
+    else:
+        ticket = submit_alignment_job(pdb1, pdb2, chain1, chain2, args.method, args.params, compress=args.compress)
+        try:
+            results = get_alignment_results(ticket, ticket_timeout=args.timeout)
+        except AlignmentJobError as e:
+            raise SystemExit(f"Alignment failed: {e}")
+        if cache:
+            cache.put(key, ticket, results)
 
-    extract_summary(results, args.method)
+    extract_summary(results, args.method, print_json=args.print_json)
 
     if args.csv:
         write_csv_summary(args.csv, ticket, args.method, results)
 
+    if store is not None:
+        store.add((args.input1, chain1, args.input2, chain2), args.method, ticket, results, extract_scores(results))
+        store.save(args.store)
+        print(f"Alignment added to {args.store}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,191 @@
+"""
+Local pre-screen of structure pairs before submitting them to the RCSB.org Alignment API.
+
+In all-vs-all surveys most pairs are obviously dissimilar. This module scores every pair with cheap descriptors
+computed from the Cα coordinates of each chain, so that only promising pairs are aligned remotely:
+
+    - length ratio: pairs whose shorter chain has less than `min_length_ratio` of the residues of the longer chain
+      are dropped outright
+    - shape signature: similarity of the normalised histograms of all Cα-Cα distances (1 - half the L1 distance),
+      which also reflects the radius of gyration; distances beyond 60 Å are counted in a final open bin, so every
+      pair of residues contributes, whatever the size of the chain
+    - superposition score: both Cα traces are resampled to the same number of points along the chain and
+      superimposed (Kabsch), and the RMSD is turned into a TM-score-like value in [0, 1]
+
+The prefilter score of a pair is the mean of the shape signature and superposition scores. All pairwise work is
+done in NumPy on blocks of pairs. Cα coordinates are read with cif_columns.py from local mmCIF or BCIF files, or
+from mmCIF files of PDB entries in the shared structure cache (see structure_cache.py), so each entry is downloaded
+once.
+
+Example:
+    from alignment_prefilter import prefilter_pairs
+
+    kept, scores = prefilter_pairs(pairs, min_score=0.4)
+
+Requirements:
+    pip install requests numpy
+    pip install msgpack  # only needed to read local BCIF files
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from cif_columns import read_cif
+from structure_cache import get_default_cache
+
+# Distance histogram bins (Å; 2 Å wide up to 60 Å, then one open bin) and number of points of the resampled Cα traces
+HISTOGRAM_BINS = np.append(np.arange(0, 62, 2.0), np.inf)
+TRACE_POINTS = 64
+# Number of pairs scored at a time
+BLOCK_SIZE = 4096
+# Number of Cα-Cα distances computed at a time for the histogram of a chain
+DISTANCE_BLOCK_SIZE = 2**20
+# Fields of atom_site used to select Cα atoms
+ATOM_SITE_FIELDS = ("label_atom_id", "label_asym_id", "label_seq_id", "Cartn_x", "Cartn_y", "Cartn_z")
+
+
+def read_atom_site(value, cache=None):
+    """Return the atom_site category of a local mmCIF/BCIF file (plain or .gz) or of a PDB entry (from the shared
+    structure cache), as a `cif_columns.CifCategory`.
+    """
+    path = (cache or get_default_cache()).resolve(value, "cif")
+    blocks = read_cif(path, categories={"atom_site"})
+    if not blocks or "atom_site" not in blocks[0]:
+        raise ValueError(f"No atom_site category in {path}")
+    atom_site = blocks[0]["atom_site"]
+    missing = [field for field in ATOM_SITE_FIELDS if field not in atom_site]
+    if missing:
+        raise ValueError(f"No {', '.join(missing)} in the atom_site category of {path}")
+    return atom_site
+
+
+def ca_coordinates(atom_site, chain):
+    """Return the Cα coordinates (n x 3 array) of a chain (by label_asym_id) in the first model of an atom_site category."""
+    selection = (atom_site.column("label_atom_id", dtype=str) == "CA") & (atom_site.column("label_asym_id", dtype=str) == chain)
+    if "pdbx_PDB_model_num" in atom_site and len(atom_site):
+        models = atom_site.column("pdbx_PDB_model_num", dtype=str)
+        selection &= models == models[0]
+    rows = np.flatnonzero(selection)
+    # Keep the first alternative location of each residue
+    _, first = np.unique(atom_site.column("label_seq_id", dtype=str)[rows], return_index=True)
+    rows = rows[np.sort(first)]
+    return np.stack([atom_site.column(axis, dtype=float)[rows] for axis in ("Cartn_x", "Cartn_y", "Cartn_z")], axis=1)
+
+
+def chain_descriptors(coordinates):
+    """Return the length, normalised distance histogram and centred, resampled Cα trace of a chain.
+
+    The histogram holds the fraction of all Cα pairs in each distance bin. For a 2000-residue extended chain
+    (3.8 Å between consecutive Cα atoms), the pairs more than 60 Å apart are counted in the last bin:
+
+    >>> n, histogram, trace = chain_descriptors(np.arange(2000)[:, None] * np.array([[3.8, 0.0, 0.0]]))
+    >>> n, float(histogram.sum().round(6)), float(histogram[-1].round(3)), trace.shape
+    (2000, 1.0, 0.985, (64, 3))
+    """
+    n = len(coordinates)
+    if n < 3:
+        raise ValueError("Chain has fewer than 3 Cα atoms")
+    # Distances of blocks of rows to the following atoms (upper triangle), so memory does not grow with n x n
+    histogram = np.zeros(len(HISTOGRAM_BINS) - 1, dtype=np.int64)
+    rows = max(1, DISTANCE_BLOCK_SIZE // n)
+    for start in range(0, n - 1, rows):
+        block = coordinates[start:start + rows]
+        distances = np.sqrt(((block[:, None, :] - coordinates[None, start:, :]) ** 2).sum(-1))
+        upper = np.arange(n - start)[None, :] > np.arange(len(block))[:, None]
+        histogram += np.histogram(distances[upper], bins=HISTOGRAM_BINS)[0]
+    histogram = histogram / max(histogram.sum(), 1)
+
+    # Resample the trace to TRACE_POINTS points, evenly spaced along the residue index
+    positions = np.linspace(0, n - 1, TRACE_POINTS)
+    trace = np.stack([np.interp(positions, np.arange(n), coordinates[:, axis]) for axis in range(3)], axis=1)
+    return n, histogram, trace - trace.mean(axis=0)
+
+
+def _superposition_rmsd(traces_a, traces_b):
+    """RMSD after optimal superposition of pairs of centred traces (m x k x 3 arrays), via batched Kabsch."""
+    covariance = np.einsum("mki,mkj->mij", traces_a, traces_b)
+    u, singular_values, vt = np.linalg.svd(covariance)
+    # Correct for reflections
+    sign = np.sign(np.linalg.det(np.matmul(u, vt)))
+    singular_values[:, -1] *= sign
+    squared = (traces_a ** 2).sum(axis=(1, 2)) + (traces_b ** 2).sum(axis=(1, 2)) - 2 * singular_values.sum(axis=1)
+    return np.sqrt(np.maximum(squared, 0) / traces_a.shape[1])
+
+
+def score_pairs(descriptors, index_pairs, min_length_ratio=0.5):
+    """Return the prefilter score of each pair of chains (0 for pairs failing the length ratio).
+
+    Args:
+        descriptors (list): `chain_descriptors` of each chain
+        index_pairs (np.ndarray): m x 2 array of indices into `descriptors`
+        min_length_ratio (float): minimum ratio of the shorter to the longer chain length
+    """
+    lengths = np.array([d[0] for d in descriptors], dtype=float)
+    histograms = np.stack([d[1] for d in descriptors])
+    traces = np.stack([d[2] for d in descriptors])
+
+    scores = np.zeros(len(index_pairs))
+    for start in range(0, len(index_pairs), BLOCK_SIZE):
+        block = index_pairs[start:start + BLOCK_SIZE]
+        a, b = block[:, 0], block[:, 1]
+        shorter = np.minimum(lengths[a], lengths[b])
+        ratio = shorter / np.maximum(lengths[a], lengths[b])
+
+        shape = 1 - 0.5 * np.abs(histograms[a] - histograms[b]).sum(axis=1)
+        rmsd = _superposition_rmsd(traces[a], traces[b])
+        # Distance scale of the TM-score for the shorter chain
+        d0 = np.maximum(1.24 * np.cbrt(np.maximum(shorter - 15, 1)) - 1.8, 0.5)
+        superposition = 1 / (1 + (rmsd / d0) ** 2)
+
+        scores[start:start + len(block)] = np.where(ratio >= min_length_ratio, (shape + superposition) / 2, 0)
+    return scores
+
+
+def prefilter_pairs(pairs, min_score=0.4, min_length_ratio=0.5, cache=None, max_workers=8):
+    """Keep only the pairs whose prefilter score is at least `min_score`.
+
+    Pairs involving a chain whose coordinates cannot be read are kept (and get a score of None), so that the
+    remote alignment reports the problem.
+
+    Args:
+        pairs (list): (input1, chain1, input2, chain2) tuples, where inputs are PDB IDs or local mmCIF files
+        cache (StructureCache, optional): cache of PDB entry files (by default the shared cache of structure_cache.py)
+
+    Returns:
+        tuple: kept pairs, and dict of pair -> prefilter score
+    """
+    chains = list(dict.fromkeys(chain for pair in pairs for chain in (pair[:2], pair[2:])))
+    inputs = list(dict.fromkeys(value for value, _ in chains))
+    cache = cache or get_default_cache()
+
+    def load(value):
+        try:
+            return value, read_atom_site(value, cache)
+        except (OSError, ValueError, requests.RequestException):
+            return value, None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        atom_sites = dict(executor.map(load, inputs))
+
+    index = {}
+    descriptors = []
+    for value, chain in chains:
+        if atom_sites[value] is None:
+            continue
+        try:
+            descriptors.append(chain_descriptors(ca_coordinates(atom_sites[value], chain)))
+        except ValueError:
+            continue
+        index[(value, chain)] = len(descriptors) - 1
+    # The atom_site columns are no longer needed once the descriptors are computed
+    atom_sites.clear()
+
+    scored = [pair for pair in pairs if pair[:2] in index and pair[2:] in index]
+    scores = {pair: None for pair in pairs}
+    if scored:
+        index_pairs = np.array([(index[pair[:2]], index[pair[2:]]) for pair in scored], dtype=np.int64)
+        for pair, score in zip(scored, score_pairs(descriptors, index_pairs, min_length_ratio)):
+            scores[pair] = float(score)
+
+    kept = [pair for pair in pairs if scores[pair] is None or scores[pair] >= min_score]
+    return kept, scores
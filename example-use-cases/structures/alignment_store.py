@@ -0,0 +1,208 @@
+"""
+Store RCSB.org Alignment API results as typed NumPy arrays in an .npz file.
+
+Each alignment response holds, besides its RMSD and TM-score, the aligned residue ranges and the transformation
+(rotation and translation) that superimposes each structure, for every aligned block (rigid alignments have one
+block, flexible alignments can have several). `AlignmentStore` keeps these in three tables of columns:
+
+    - alignments: input1, chain1, input2, chain2, method, ticket, rmsd, tm_score, n_aln_residue_pairs
+    - blocks: alignment (row in the alignments table), rotation (2 x 3 x 3, one per structure) and
+      translation (2 x 3)
+    - regions: block (row in the blocks table), structure (0 or 1), asym_id, beg_seq_id, beg_index, length
+
+Missing scores are stored as NaN and missing counts as -1. Adding to an existing store file appends to it, so
+superposition or clustering of many alignments can read the stored transforms without re-running jobs.
+
+Example:
+    from alignment_store import AlignmentStore
+
+    store = AlignmentStore.load("alignments.npz")
+    rows = store.lookup("5QU3", "A", "10GS", "A")
+    rotation, translation = store.transform(store.blocks_of(rows[0])[0], structure=1)
+    superimposed = coordinates @ rotation.T + translation
+
+Requirements:
+    pip install numpy
+"""
+
+import os
+import numpy as np
+
+ALIGNMENT_TEXT_FIELDS = ("input1", "chain1", "input2", "chain2", "method", "ticket")
+
+
+def _number(value, default=np.nan):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def transformation_matrix(values):
+    """Return a flattened 4 x 4 transformation as a matrix acting on column vectors.
+
+    The Alignment API (like Mol*, which displays its results) gives transformations in column-major order, with the
+    translation at indices 12-14. Row-major matrices (translation at indices 3, 7 and 11) are recognised by their
+    non-zero last column and zero last row; matrices without translation are read as column-major.
+
+    >>> column_major = [0, 1, 0, 0, -1, 0, 0, 0, 0, 0, 1, 0, 1, 2, 3, 1]  # 90 degrees about z, then (1, 2, 3)
+    >>> matrix = transformation_matrix(column_major)
+    >>> matrix[:3, :3] @ [1, 0, 0] + matrix[:3, 3]
+    array([1., 3., 3.])
+    >>> np.array_equal(transformation_matrix(matrix.ravel()), matrix)
+    True
+    """
+    matrix = np.asarray(values, dtype=float).reshape(4, 4)
+    if np.any(matrix[:3, 3]) and not np.any(matrix[3, :3]):
+        return matrix
+    return matrix.T
+
+
+def parse_blocks(results):
+    """Return the blocks of an alignment response as (rotations, translations, regions).
+
+    Rotations (2 x 3 x 3) and translations (2 x 3) are given per structure; a missing transformation is the
+    identity. Regions are (structure, asym_id, beg_seq_id, beg_index, length) tuples.
+
+    >>> response = {"results": [{"blocks": [{"transformations": [
+    ...     [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1], [0, 1, 0, 0, -1, 0, 0, 0, 0, 0, 1, 0, 1, 2, 3, 1]
+    ... ]}]}]}
+    >>> rotations, translations, regions = parse_blocks(response)[0]
+    >>> rotations[1]
+    array([[ 0., -1.,  0.],
+           [ 1.,  0.,  0.],
+           [ 0.,  0.,  1.]])
+    >>> translations[1]
+    array([1., 2., 3.])
+    """
+    if not (isinstance(results.get("results"), list) and len(results["results"]) > 0):
+        return []
+    blocks = []
+    for block in results["results"][0].get("blocks", []) or []:
+        rotations = np.tile(np.eye(3), (2, 1, 1))
+        translations = np.zeros((2, 3))
+        for structure, matrix in enumerate((block.get("transformations") or [])[:2]):
+            matrix = transformation_matrix(matrix)
+            rotations[structure] = matrix[:3, :3]
+            translations[structure] = matrix[:3, 3]
+        regions = [
+            (structure, region.get("asym_id", ""), region.get("beg_seq_id", -1), region.get("beg_index", -1), region.get("length", 0))
+            for structure, structure_regions in enumerate((block.get("regions") or [])[:2])
+            for region in structure_regions
+        ]
+        blocks.append((rotations, translations, regions))
+    return blocks
+
+
+class AlignmentStore:
+    """Columns of many alignment results (see the module docstring for the tables)."""
+
+    def __init__(self, arrays=None):
+        self._arrays = arrays or {}
+        self._pending = []
+
+    @classmethod
+    def load(cls, path):
+        """Load a store file, or return an empty store if it does not exist."""
+        if not os.path.exists(path):
+            return cls()
+        with np.load(path) as arrays:
+            return cls({key: arrays[key] for key in arrays.files})
+
+    def add(self, pair, method, ticket, results, scores):
+        """Add one alignment.
+
+        Args:
+            pair (tuple): (input1, chain1, input2, chain2)
+            scores (tuple): (rmsd, tm_score), see `extract_scores` in align_structures.py
+        """
+        summary = {}
+        if isinstance(results.get("results"), list) and len(results["results"]) > 0:
+            summary = results["results"][0].get("summary", {}) or {}
+        self._pending.append((
+            tuple(pair) + (method, ticket or ""),
+            (_number(scores[0]), _number(scores[1])),
+            int(_number(summary.get("n_aln_residue_pairs"), -1)),
+            parse_blocks(results)
+        ))
+
+    def _flush(self):
+        """Append the pending alignments to the arrays."""
+        if not self._pending:
+            return
+        n_alignments = len(self._arrays.get("rmsd", ()))
+        n_blocks = len(self._arrays.get("block_alignment", ()))
+        new = {key: [] for key in (
+            *ALIGNMENT_TEXT_FIELDS, "rmsd", "tm_score", "n_aln_residue_pairs",
+            "block_alignment", "rotation", "translation",
+            "region_block", "region_structure", "region_asym_id", "region_beg_seq_id", "region_beg_index", "region_length"
+        )}
+        for i, (text, (rmsd, tm_score), n_pairs, blocks) in enumerate(self._pending):
+            for key, value in zip(ALIGNMENT_TEXT_FIELDS, text):
+                new[key].append(value)
+            new["rmsd"].append(rmsd)
+            new["tm_score"].append(tm_score)
+            new["n_aln_residue_pairs"].append(n_pairs)
+            for rotations, translations, regions in blocks:
+                new["block_alignment"].append(n_alignments + i)
+                new["rotation"].append(rotations)
+                new["translation"].append(translations)
+                for structure, asym_id, beg_seq_id, beg_index, length in regions:
+                    new["region_block"].append(n_blocks)
+                    new["region_structure"].append(structure)
+                    new["region_asym_id"].append(asym_id)
+                    new["region_beg_seq_id"].append(beg_seq_id)
+                    new["region_beg_index"].append(beg_index)
+                    new["region_length"].append(length)
+                n_blocks += 1
+
+        dtypes = {"rmsd": float, "tm_score": float, "rotation": float, "translation": float, "region_asym_id": str}
+        # Shapes of empty columns, so they can be concatenated with later additions
+        shapes = {"rotation": (0, 2, 3, 3), "translation": (0, 2, 3)}
+        for key, values in new.items():
+            dtype = str if key in ALIGNMENT_TEXT_FIELDS else dtypes.get(key, np.int64)
+            values = np.asarray(values, dtype=dtype) if values else np.empty(shapes.get(key, (0,)), dtype=dtype)
+            if key in self._arrays:
+                values = np.concatenate([self._arrays[key], values])
+            self._arrays[key] = values
+        self._pending = []
+
+    def save(self, path):
+        """Write the store atomically to an .npz file."""
+        self._flush()
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(tmp_path, **self._arrays)
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self._arrays.get("rmsd", ())) + len(self._pending)
+
+    def __getitem__(self, key):
+        """Return a column (e.g. store["tm_score"] or store["rotation"])."""
+        self._flush()
+        return self._arrays[key]
+
+    def lookup(self, input1, chain1, input2, chain2):
+        """Return the rows of the alignments of a pair (in either order)."""
+        self._flush()
+        if not self._arrays:
+            return []
+        a = (self._arrays["input1"] == input1) & (self._arrays["chain1"] == chain1)
+        b = (self._arrays["input2"] == input2) & (self._arrays["chain2"] == chain2)
+        a_reverse = (self._arrays["input1"] == input2) & (self._arrays["chain1"] == chain2)
+        b_reverse = (self._arrays["input2"] == input1) & (self._arrays["chain2"] == chain1)
+        return np.flatnonzero((a & b) | (a_reverse & b_reverse)).tolist()
+
+    def blocks_of(self, row):
+        """Return the rows in the blocks table of an alignment."""
+        return np.flatnonzero(self["block_alignment"] == row).tolist()
+
+    def regions_of(self, block):
+        """Return the aligned regions of a block as a list of dicts."""
+        rows = np.flatnonzero(self["region_block"] == block)
+        fields = ("structure", "asym_id", "beg_seq_id", "beg_index", "length")
+        return [{field: self[f"region_{field}"][i].item() for field in fields} for i in rows]
+
+    def transform(self, block, structure=1):
+        """Return the rotation (3 x 3) and translation (3) of one structure of a block."""
+        return self["rotation"][block, structure], self["translation"][block, structure]
@@ -0,0 +1,367 @@
+"""
+Benchmark the alternative code paths of incomplete_structure_coverage.py against a local stand-in server.
+
+`incomplete_structure_coverage.py` implements each step twice: with raw HTTP requests (`exec_search`,
+`exec_data`) and with the `rcsb-api` package (`exec_search_library`, `exec_data_library`), plus a pipelined
+mode (`exec_pipelined`) that overlaps both steps. In the library path, both steps are executed by `rcsb-api`
+(its search requests the pages of hits one after the other), while the raw and pipelined paths page the search
+with search_pagination.py, which prefetches the next page; the search cache is not used by any path.
+This script runs each path against a local HTTP server that
+replays recorded Search and Data API responses, for every combination of the given batch sizes and
+concurrency levels, and reports per-stage metrics as JSON:
+
+    wall_s         elapsed time of the stage
+    requests       number of requests received by the stand-in server for the stage
+    bytes_sent     request bytes sent to the server
+    bytes_received response bytes returned by the server
+    parse_s        time spent decoding JSON responses and parsing the returned data
+    peak_rss_kb    peak resident memory of the benchmark process at the end of the stage
+
+Every case runs in a fresh Python process, so memory and connection state do not leak between cases. Requests are
+sent to the stand-in server with the redirect helper of the replay tool (`redirect_endpoints` in
+../api-replay/rcsb_replay.py), which must be kept next to this folder.
+
+The stand-in server answers from a fixture file holding the search hits and the Data API record of each
+polymer instance, so responses can be assembled for any batch size. Record a fixture from the live APIs
+once (or generate a synthetic one for offline use), then compare runs across `rcsb-api` versions:
+
+    # Record the search hits and data records from search.rcsb.org and data.rcsb.org
+        python3 benchmark_structure_coverage.py --record coverage-fixture.json
+
+    # Or generate a synthetic fixture with 200,000 polymer instances
+        python3 benchmark_structure_coverage.py --synthetic 200000 coverage-fixture.json
+
+    # Run all paths with 3 batch sizes and 3 concurrency levels, adding 50 ms latency per request
+        python3 benchmark_structure_coverage.py --fixture coverage-fixture.json \\
+            --batch-sizes 1000 5000 10000 --concurrency 1 4 8 --latency-ms 50 -o results.json
+
+The raw and pipelined paths run fully offline. Importing `rcsb-api` (only done by the library path) downloads the
+API schemas: to run the library path offline too, record them once with the replay server in ../api-replay and pass
+`--replay-server`; all other requests to search.rcsb.org and data.rcsb.org are then sent to that server:
+
+        python3 ../api-replay/rcsb_replay.py serve --store fixtures
+        python3 benchmark_structure_coverage.py --fixture coverage-fixture.json --replay-server http://127.0.0.1:8765
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib.metadata import PackageNotFoundError, version
+
+SEARCH_API_URL = "https://search.rcsb.org/rcsbsearch/v2/query"
+DATA_API_URL = "https://data.rcsb.org/graphql"
+
+PATHS = ["raw", "library", "pipelined"]
+
+# rcsb-api inlines the ID list into the GraphQL query instead of passing it as a variable
+INLINE_IDS_RE = re.compile(r"instance_ids\s*:\s*(\[[^\]]*\])")
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serve Search and Data API requests from the fixture attached to the server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        stage = "search" if self.path.startswith("/search") else "data"
+        try:
+            payload = json.loads(body)
+            if stage == "search":
+                response = self.server.search_response(payload)
+            else:
+                response = self.server.data_response(payload)
+            status = 200
+        except (ValueError, KeyError) as e:
+            response = {"error": str(e)}
+            status = 400
+        out = json.dumps(response).encode()
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+        self.server.count(stage, len(body) + len(self.path), len(out))
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fixture, latency_ms=0, port=0):
+        super().__init__(("127.0.0.1", port), StandInHandler)
+        self.search_ids = fixture["search"]
+        self.records = fixture["data"]
+        self.latency = latency_ms / 1000
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def reset(self):
+        with self._lock:
+            self.stats = {stage: {"requests": 0, "bytes_sent": 0, "bytes_received": 0} for stage in ("search", "data")}
+
+    def count(self, stage, bytes_sent, bytes_received):
+        with self._lock:
+            self.stats[stage]["requests"] += 1
+            self.stats[stage]["bytes_sent"] += bytes_sent
+            self.stats[stage]["bytes_received"] += bytes_received
+
+    def search_response(self, payload):
+        request_options = payload.get("request_options", {})
+        if request_options.get("return_all_hits"):
+            result_set = self.search_ids
+        else:
+            paginate = request_options.get("paginate", {"start": 0, "rows": 10})
+            result_set = self.search_ids[paginate["start"]:paginate["start"] + paginate["rows"]]
+        return {"total_count": len(self.search_ids), "result_set": result_set}
+
+    def data_response(self, payload):
+        ids = (payload.get("variables") or {}).get("ids")
+        if ids is None:
+            ids = json.loads(INLINE_IDS_RE.search(payload["query"]).group(1))
+        records = [self.records[i] for i in ids if i in self.records]
+        return {"data": {"polymer_entity_instances": records}}
+
+
+class ParseTimer:
+    """Accumulate the time spent in `json.loads` and in a wrapped parsing function."""
+
+    def __init__(self):
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+        json.loads = self.wrap(json.loads)
+
+    def wrap(self, func):
+        def timed(*args, **kwargs):
+            s_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.elapsed += time.perf_counter() - s_time
+        return timed
+
+    def take(self):
+        with self._lock:
+            elapsed, self.elapsed = self.elapsed, 0.0
+        return elapsed
+
+
+def peak_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def run_case(case):
+    """Run one benchmark case in this process (called in a child process) and return the per-stage metrics."""
+    # requests and httpx are redirected by the helper of the replay tool
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "api-replay"))
+    from rcsb_replay import redirect_endpoints
+
+    endpoints = {SEARCH_API_URL: case["server"] + "/search", DATA_API_URL: case["server"] + "/graphql"}
+    if case.get("replay_server"):
+        for host in ("search.rcsb.org", "data.rcsb.org"):
+            endpoints[f"https://{host}"] = f"{case['replay_server'].rstrip('/')}/{host}"
+    redirect_endpoints(endpoints)
+    timer = ParseTimer()
+
+    import incomplete_structure_coverage as coverage
+    coverage.parse_data = timer.wrap(coverage.parse_data)
+
+    batch_size = case["batch_size"]
+    stages = {}
+    s_time = time.time()
+    timer.take()
+
+    if case["path"] == "pipelined":
+        final_chains, hit_count, search_e_time = coverage.exec_pipelined(batch_size=batch_size, max_workers=case["concurrency"])
+        stages["search"] = {"wall_s": search_e_time - s_time}
+        # Parsing overlaps with the search in this mode, so it is all attributed to the data stage
+        stages["data"] = {"wall_s": time.time() - search_e_time, "parse_s": timer.take(), "peak_rss_kb": peak_rss_kb()}
+    else:
+        if case["path"] == "library":
+            from rcsbapi.config import config
+            config.DATA_API_BATCH_ID_SIZE = min(batch_size, 1000)
+            config.DATA_API_MAX_CONCURRENT_REQUESTS = case["concurrency"]
+            chain_ids = list(coverage.exec_search_library())
+        else:
+            chain_ids = list(coverage.exec_search())
+        search_e_time = time.time()
+        hit_count = len(chain_ids)
+        stages["search"] = {"wall_s": search_e_time - s_time, "parse_s": timer.take(), "peak_rss_kb": peak_rss_kb()}
+
+        batches = [chain_ids[i:i + batch_size] for i in range(0, len(chain_ids), batch_size)]
+        if case["path"] == "library":
+            final_chains = coverage.exec_data_library(batches)
+        else:
+            final_chains = coverage.exec_data(batches)
+        stages["data"] = {"wall_s": time.time() - search_e_time, "parse_s": timer.take(), "peak_rss_kb": peak_rss_kb()}
+
+    stages["search"].setdefault("parse_s", 0.0)
+    stages["search"].setdefault("peak_rss_kb", stages["data"]["peak_rss_kb"])
+    return {
+        "total_wall_s": time.time() - s_time,
+        "search_hits": hit_count,
+        "selected_chains": len(final_chains),
+        "stages": stages,
+    }
+
+
+def spawn_case(server, case):
+    """Run a case in a fresh interpreter and merge the server-side request counters into its metrics."""
+    server.reset()
+    child = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    if child.returncode != 0:
+        return dict(case, error=child.stderr.strip().splitlines()[-1] if child.stderr.strip() else "failed")
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    for stage, counters in server.stats.items():
+        result["stages"][stage].update(counters)
+    return dict(case, **result)
+
+
+def build_cases(paths, batch_sizes, concurrency_levels):
+    cases = []
+    for path in paths:
+        for batch_size in batch_sizes:
+            # The raw HTTP path runs its Data API batches sequentially
+            for concurrency in ([1] if path == "raw" else concurrency_levels):
+                cases.append({"path": path, "batch_size": batch_size, "concurrency": concurrency})
+    return cases
+
+
+def record_fixture():
+    """Record the search hits and the Data API record of each hit from the live APIs."""
+    from python_graphql_client import GraphqlClient
+    import incomplete_structure_coverage as coverage
+
+    chain_ids = list(coverage.exec_search())
+    client = GraphqlClient(endpoint=DATA_API_URL)
+    records = {}
+    for i in range(0, len(chain_ids), 5_000):
+        data = client.execute(query=coverage.DATA_QUERY, variables={"ids": chain_ids[i:i + 5_000]}, timeout=60)
+        for d in data["data"]["polymer_entity_instances"]:
+            records[d["rcsb_id"]] = d
+    return {"search": chain_ids, "data": records}
+
+
+def synthetic_entry_id(n):
+    digits = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    entry_id = ""
+    for _ in range(4):
+        n, d = divmod(n, len(digits))
+        entry_id = digits[d] + entry_id
+    return entry_id
+
+
+def synthetic_fixture(n, seed=0):
+    """Generate a fixture of `n` polymer instances with random unobserved residue ranges."""
+    rng = random.Random(seed)
+    chain_ids = []
+    records = {}
+    for i in range(n):
+        instance_id = synthetic_entry_id(i // 4) + "." + "ABCD"[i % 4]
+        length = rng.randint(21, 800)
+        positions = []
+        for _ in range(rng.randint(1, 4)):
+            beg = rng.randint(1, length)
+            positions.append({"beg_seq_id": beg, "end_seq_id": min(length, beg + rng.randint(0, 20))})
+        chain_ids.append(instance_id)
+        records[instance_id] = {
+            "rcsb_id": instance_id,
+            "polymer_entity": {"entity_poly": {"rcsb_sample_sequence_length": length}},
+            "rcsb_polymer_instance_feature": [{"type": "UNOBSERVED_RESIDUE_XYZ", "feature_positions": positions}],
+        }
+    return {"search": chain_ids, "data": records}
+
+
+def package_version(name):
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the raw HTTP and rcsb-api code paths of incomplete_structure_coverage.py.",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("--fixture", help="Fixture file with recorded search hits and data records")
+    parser.add_argument("--record", metavar="FIXTURE", help="Record a fixture from the live APIs and exit")
+    parser.add_argument("--synthetic", nargs=2, metavar=("N", "FIXTURE"), help="Generate a synthetic fixture with N instances and exit")
+    parser.add_argument("--paths", nargs="+", choices=PATHS, default=PATHS, help="Code paths to benchmark (default: %(default)s)")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[5_000], help="Data API batch sizes (default: %(default)s)")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[4], help="Data API concurrency levels (default: %(default)s)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Latency added by the stand-in server to every response (default: %(default)s)")
+    parser.add_argument("--replay-server", help="Replay server (see ../api-replay) for all other search.rcsb.org and data.rcsb.org requests")
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        sys.exit()
+
+    if args.record or args.synthetic:
+        fixture = record_fixture() if args.record else synthetic_fixture(int(args.synthetic[0]))
+        fp_out = args.record or args.synthetic[1]
+        with open(fp_out, "w") as f:
+            json.dump(fixture, f)
+        print(f"Wrote fixture with {len(fixture['search'])} search hits to {fp_out}")
+        sys.exit()
+
+    if not args.fixture:
+        parser.error("one of --fixture, --record or --synthetic is required")
+
+    with open(args.fixture) as f:
+        server = StandInServer(json.load(f), latency_ms=args.latency_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = []
+    for case in build_cases(args.paths, args.batch_sizes, args.concurrency):
+        case["server"] = server.url
+        case["replay_server"] = args.replay_server
+        print(f"Running {case['path']} (batch size {case['batch_size']}, concurrency {case['concurrency']})", file=sys.stderr)
+        result = spawn_case(server, case)
+        result.pop("server")
+        result.pop("replay_server")
+        results.append(result)
+    server.shutdown()
+
+    report = {
+        "python": platform.python_version(),
+        "rcsb_api_version": package_version("rcsb-api"),
+        "fixture": os.path.abspath(args.fixture),
+        "latency_ms": args.latency_ms,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote benchmark report to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,108 @@
+"""
+Size limits of an on-disk cache directory, shared by the caches of the example scripts (see search_cache.py and
+AlignmentCache in align_structures.py).
+
+A cache that enforced its limits by listing and stat-ing its whole directory after every write would do work
+proportional to the number of entries for each entry written, i.e. quadratic work for a batch. `CacheBudget`
+instead keeps a running total of the size and number of entries: the directory is scanned once when the first
+entry is added, and again only when the running total crosses a limit. The least recently used entries (by
+modification time) are then removed until the cache is below `low_water` times its limits, so that the next
+scan is only needed after that much has been written again.
+
+Entries written by other processes sharing the directory are not counted until the next scan, so the limits are
+enforced approximately when several processes write to one cache.
+
+Example:
+    from cache_budget import CacheBudget
+
+    budget = CacheBudget(cache_dir, suffix=".json", max_bytes=512 * 2**20)
+    ...write an entry to path...
+    budget.add(path)
+"""
+
+import os
+import threading
+
+
+class CacheBudget:
+    """Running size and entry count of the files ending with `suffix` in a directory (hidden files excluded).
+
+    >>> import tempfile
+    >>> cache_dir = tempfile.mkdtemp()
+    >>> budget = CacheBudget(cache_dir, suffix=".json", max_bytes=250, low_water=0.5)
+    >>> for i in range(5):
+    ...     path = os.path.join(cache_dir, f"{i}.json")
+    ...     with open(path, "w") as f:
+    ...         _ = f.write("x" * 100)
+    ...     os.utime(path, (i, i))
+    ...     budget.add(path)
+    >>> sorted(os.listdir(cache_dir)), budget.total, budget.count
+    (['4.json'], 100, 1)
+    """
+
+    def __init__(self, directory, suffix, max_bytes, max_entries=None, low_water=0.9):
+        self.directory = directory
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.low_water = low_water
+        # Unknown until the directory is scanned
+        self.total = None
+        self.count = None
+        self._lock = threading.Lock()
+
+    def _over(self, total, count, fraction=1.0):
+        return total > fraction * self.max_bytes or (self.max_entries is not None and count > fraction * self.max_entries)
+
+    def add(self, path):
+        """Count a file written to the cache, and evict entries if the cache has grown beyond its limits."""
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            # Evicted by another process already
+            return
+        with self._lock:
+            if self.total is not None:
+                # An overwritten entry is counted twice until the next scan, which only makes the scan come sooner
+                self.total += size
+                self.count += 1
+                if not self._over(self.total, self.count):
+                    return
+            self._evict()
+
+    def evict(self):
+        """Scan the directory and remove the least recently used entries if the cache is beyond its limits."""
+        with self._lock:
+            self._evict()
+
+    def reset(self):
+        """Forget the running totals (e.g. after the directory was cleared); the next `add` scans it again."""
+        with self._lock:
+            self.total = None
+            self.count = None
+
+    def _evict(self):
+        entries = []
+        for item in os.scandir(self.directory):
+            if item.name.endswith(self.suffix) and not item.name.startswith("."):
+                try:
+                    stat = item.stat()
+                except FileNotFoundError:
+                    # Evicted by another process during the scan
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, item.path))
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        if self._over(total, count):
+            entries.sort()
+            for _, size, path in entries:
+                if not self._over(total, count, self.low_water):
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                count -= 1
+        self.total = total
+        self.count = count
@@ -1,13 +1,62 @@
-import requests
+"""
+Find protein chains with missing coordinates in two or more non-terminal, non-contiguous regions.
+
+General workflow:
+    1. First, use the search API to find all protein chains with unobserved residues
+    2. Then, use the data API to fetch the unobserved residue ranges for those chains (in batches of IDs)
+    3. Next, keep only the chains with 2 or more unobserved regions that are not at the chain termini
+
+By default the two steps run one after the other. With '--pipelined', each page of search hits is queued up as
+Data API batches as soon as it arrives, and the batches are executed concurrently while later pages are still
+being fetched, so that search and data latency overlap.
+
+Search result pages are cached on disk (see search_cache.py), so repeated runs only re-execute the data step
+until the next weekly PDB release. Use '--no-cache' to always query the Search API.
+
+The `rcsb-api` versions of both steps (`exec_search_library`, `exec_data_library`) run the same queries through
+the package instead; they use neither the prefetching paginator nor the cache.
+
+To run:
+    python3 incomplete_structure_coverage.py
+    python3 incomplete_structure_coverage.py --pipelined --batch-size 5000 --workers 4
+
+"""
+
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from python_graphql_client import GraphqlClient
-import json
-from urllib.parse import quote
-from rcsbapi.search import AttributeQuery
-from rcsbapi.data import DataQuery as Query
+from search_cache import get_default_cache
+from search_pagination import iter_search_ids, iter_search_pages
 import time
 
+DATA_API_URL = 'https://data.rcsb.org/graphql'
+
+DATA_QUERY = """
+query chains_with_missing_coords ($ids: [String!]!) {
+  polymer_entity_instances(instance_ids:$ids){
+        rcsb_id
+        polymer_entity {
+          entity_poly {
+            rcsb_sample_sequence_length
+          }
+        }
+        rcsb_polymer_instance_feature {
+          type
+          feature_positions {
+            beg_seq_id
+            end_seq_id
+          }
+        }
+    }
+}
+"""
+
+
+def exec_search_library(max_hits=None):
+    # Importing rcsbapi downloads the API schemas, so only the library code paths import it
+    from rcsbapi.search import AttributeQuery
 
-def exec_search_library():
     q1 = AttributeQuery(
         attribute="rcsb_polymer_instance_feature_summary.type",
         operator="exact_match",
@@ -34,22 +83,14 @@ def exec_search_library():
 
     query = (q1 & q2) & q3 & q4
 
-    result_set = []
-    i = 0
-    for result in query(return_type="polymer_instance", results_verbosity="compact", rows=1000):
-        result_set.append(result)
-        i += 1
-        if i == 1000:
-            break
-    # result_set = list(query(
-    #     return_type="polymer_instance",
-    #     results_verbosity="compact"
-    # ))
-    return result_set
-
-
-def exec_search():
-    search_query = {
+    # The query is executed by rcsb-api, which requests the pages of hits one after the other as the results are
+    # iterated (without prefetching or caching them), so iteration can stop after `max_hits`
+    results = query(return_type="polymer_instance", results_verbosity="compact")
+    return itertools.islice(results, max_hits)
+
+
+def coverage_search_request():
+    return {
         "query": {
             "type": "group",
             "logical_operator": "and",
@@ -102,29 +143,20 @@ def exec_search():
         "return_type": "polymer_instance",
         "request_options": {
             # Every search hit is returned as a simple string, e.g. "4HHB.A", with no additional metadata
-            "results_verbosity": "compact",
-            "return_all_hits": True,
-            # "paginate": {
-            #     "start": 0,
-            #     "rows": 1000
-            # }
+            "results_verbosity": "compact"
         }
     }
 
-    json_string = json.dumps(search_query)
-    encoded_query = quote(json_string)
 
-    base_url = 'https://search.rcsb.org/rcsbsearch/v2/query'
-    url = base_url + '?json=' + encoded_query
-    response = requests.get(url)
-
-    if response.status_code == 200:
-        return response.json()['result_set']
-    else:
-        print(f"Request failed with status code: {response.status_code}")
+def exec_search(max_hits=None, cache=None):
+    # Instead of "return_all_hits", pages of hits are requested (via POST) and yielded lazily; the next page is
+    # fetched while the current one is consumed, so the first IDs are available immediately
+    return iter_search_ids(coverage_search_request(), max_hits=max_hits, cache=cache)
 
 
 def exec_data_library(id_batches):
+    from rcsbapi.data import DataQuery as Query
+
     selected_chain_ids = []
     for batch in id_batches:
         data_query = Query(
@@ -144,37 +176,53 @@ def exec_data_library(id_batches):
 
 
 def exec_data(id_batches):
-    base_url = 'https://data.rcsb.org/graphql'
-    client = GraphqlClient(endpoint=base_url)
-    query_method = """
-    query chains_with_missing_coords ($ids: [String!]!) {
-      polymer_entity_instances(instance_ids:$ids){
-            rcsb_id
-            polymer_entity {
-              entity_poly {
-                rcsb_sample_sequence_length
-              }
-            }
-            rcsb_polymer_instance_feature {
-              type
-              feature_positions {
-                beg_seq_id
-                end_seq_id
-              }
-            }
-        }
-    }
-    """
-
+    client = GraphqlClient(endpoint=DATA_API_URL)
     selected_chain_ids = []
     for batch in id_batches:
-        query_variables = {"ids": batch}
-        # Execute the query with a timeout (in seconds)
-        data = client.execute(query=query_method, variables=query_variables, timeout=60)
-        parse_data(data, selected_chain_ids)
+        selected_chain_ids.extend(fetch_data_batch(client, batch))
     return selected_chain_ids
 
 
+def fetch_data_batch(client, batch):
+    query_variables = {"ids": batch}
+    # Execute the query with a timeout (in seconds)
+    data = client.execute(query=DATA_QUERY, variables=query_variables, timeout=60)
+    selected_chain_ids = []
+    parse_data(data, selected_chain_ids)
+    return selected_chain_ids
+
+
+def exec_pipelined(batch_size=5_000, max_workers=4, max_hits=None, cache=None):
+    """Run the search and data steps concurrently.
+
+    Each page of search hits is added to a pending batch of IDs. Whenever the batch is full, it is handed to a
+    pool of Data API workers, while the following search pages are still being fetched.
+
+    Returns:
+        tuple: selected chain IDs, number of search hits, and the time at which the last search page arrived
+    """
+    client = GraphqlClient(endpoint=DATA_API_URL)
+    futures = []
+    batch = []
+    hit_count = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for page in iter_search_pages(coverage_search_request(), max_hits=max_hits, cache=cache):
+            hit_count += len(page)
+            batch.extend(page)
+            while len(batch) >= batch_size:
+                futures.append(executor.submit(fetch_data_batch, client, batch[:batch_size]))
+                batch = batch[batch_size:]
+        if batch:
+            futures.append(executor.submit(fetch_data_batch, client, batch))
+        search_e_time = time.time()
+
+        # Collect in submission order so the output does not depend on which batch finishes first
+        selected_chain_ids = []
+        for future in futures:
+            selected_chain_ids.extend(future.result())
+    return selected_chain_ids, hit_count, search_e_time
+
+
 def parse_data(data, ids):
     for d in data['data']['polymer_entity_instances']:
         pdb_id = d['rcsb_id']
@@ -192,24 +240,40 @@ def parse_data(data, ids):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find protein chains with missing coordinates in non-terminal, non-contiguous regions.")
+    parser.add_argument("--pipelined", action="store_true", help="Overlap the search and data steps instead of running them one after the other")
+    parser.add_argument("--batch-size", type=int, default=5_000, help="Number of chain IDs per Data API request (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=4, help="Number of concurrent Data API requests in pipelined mode (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the on-disk search cache")
+    args = parser.parse_args()
+    cache = None if args.no_cache else get_default_cache()
+
     s_time = time.time()
 
-    # Find all protein chains with missing coordinates
-    search_s_time = time.time()
-    chain_ids = exec_search()
-    # chain_ids = exec_search_library()
-    search_e_time = time.time()
-    print(f"Search execution time: {search_e_time - search_s_time:.4f} seconds. Retrieved {len(chain_ids)} IDs")
-
-    # Fetch data for missing coordinates sequence ranges and select chains with non-terminal, non-contiguous regions
-    data_s_time = time.time()
-    size = 5_000
-    batches = [chain_ids[i:i + size] for i in range(0, len(chain_ids), size)]
-    final_chains = exec_data(batches)
-    # final_chains = exec_data_library(batches)
+    if args.pipelined:
+        # Search and fetch data concurrently; the data time reported is the part that did not overlap with the search
+        final_chains, hit_count, search_e_time = exec_pipelined(batch_size=args.batch_size, max_workers=args.workers, cache=cache)
+        print(f"Search execution time: {search_e_time - s_time:.4f} seconds. Retrieved {hit_count} IDs")
+        data_e_time = time.time()
+        print(f"Data execution time (after search completed): {data_e_time - search_e_time:.4f} seconds")
+    else:
+        # Find all protein chains with missing coordinates
+        search_s_time = time.time()
+        chain_ids = list(exec_search(cache=cache))
+        # chain_ids = list(exec_search_library(max_hits=1000))
+        search_e_time = time.time()
+        print(f"Search execution time: {search_e_time - search_s_time:.4f} seconds. Retrieved {len(chain_ids)} IDs")
+
+        # Fetch data for missing coordinates sequence ranges and select chains with non-terminal, non-contiguous regions
+        data_s_time = time.time()
+        size = args.batch_size
+        batches = [chain_ids[i:i + size] for i in range(0, len(chain_ids), size)]
+        final_chains = exec_data(batches)
+        # final_chains = exec_data_library(batches)
+        data_e_time = time.time()
+        print(f"Data execution time: {data_e_time - data_s_time:.4f} seconds")
+
     final_structures = list(set([s.split('.')[0] for s in final_chains]))
-    data_e_time = time.time()
-    print(f"Data execution time: {data_e_time - data_s_time:.4f} seconds")
 
     e_time = time.time()
     print(f"Total execution time: {e_time - s_time:.4f} seconds")
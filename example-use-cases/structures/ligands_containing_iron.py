@@ -8,13 +8,28 @@ General workflow:
     3. Next, remove sequences that share at least 95% identity and return sequences from structures with the
        highest resolution
 
+Search results are cached on disk (see search_cache.py); set RCSB_SEARCH_CACHE=off to disable the cache.
+
+With '--local-grouping', step 3 is done locally instead (see local_grouping.py): the ungrouped hits are fetched
+once together with their sequence identity clusters and ranking attributes, and saved to '--table', so that other
+cutoffs and ranking criteria can be tried without new searches.
+
 To run:
     python3 ligands_containing_iron.py
+    python3 ligands_containing_iron.py --local-grouping --table iron_targets.npz --cutoff 50 --sort-by refine.ls_R_factor_R_free
 
 """
 
+import argparse
 import time
+from local_grouping import DEFAULT_RANKING_ATTRIBUTES, IDENTITY_CUTOFFS, load_cluster_table
 from rcsbapi.search import AttributeQuery, ChemSimilarityQuery, GroupBy, RankingCriteriaType
+from search_cache import cached_search, get_default_cache
+from search_pagination import build_search_request
+from sharded_search import sharded_search
+
+# Maximum number of chemical component IDs per query
+SHARD_SIZE = 5_000
 
 
 def search_iron_containing_ccd():
@@ -23,10 +38,10 @@ def search_iron_containing_ccd():
         query_type="formula",
         match_subset=True
     )
-    return list(chem_query(return_type="mol_definition", results_verbosity="compact"))
+    return cached_search(chem_query, return_type="mol_definition")
 
 
-def search_sequence_targets(ligands):
+def sequence_targets_request(ligands, cutoff=95, sort_by="rcsb_entry_info.resolution_combined", direction="asc"):
 
     q1 = AttributeQuery(
         attribute="rcsb_ligand_neighbors.ligand_comp_id",
@@ -48,25 +63,56 @@ def search_sequence_targets(ligands):
 
     group_by = GroupBy(
         aggregation_method="sequence_identity",
-        similarity_cutoff=95,
+        similarity_cutoff=cutoff,
         ranking_criteria_type=RankingCriteriaType(
-            sort_by="rcsb_entry_info.resolution_combined",
-            direction="asc"
+            sort_by=sort_by,
+            direction=direction
         )
     )
 
     query = q1 & q2 & q3
-    return list(query(
+
+    return build_search_request(
+        query,
         return_type="polymer_entity",
-        group_by=group_by,
+        group_by=group_by.to_dict(),
         group_by_return_type="representatives"
-    ))
+    )
+
+
+def search_sequence_targets(ligands, cutoff=95, sort_by="rcsb_entry_info.resolution_combined", direction="asc"):
+    # Long lists of ligands are split into shards that run concurrently (see sharded_search.py)
+    search_request = sequence_targets_request(ligands, cutoff, sort_by, direction)
+    return sharded_search(search_request, shard_size=SHARD_SIZE, cache=get_default_cache())
+
+
+def group_sequence_targets_locally(ligands, cutoff=95, sort_by="rcsb_entry_info.resolution_combined", direction="asc", table_path=None):
+    ranking_attributes = tuple(dict.fromkeys(DEFAULT_RANKING_ATTRIBUTES + (sort_by,)))
+    table = load_cluster_table(
+        sequence_targets_request(ligands),
+        table_path=table_path,
+        ranking_attributes=ranking_attributes,
+        shard_size=SHARD_SIZE,
+        cache=get_default_cache()
+    )
+    return table.representatives(cutoff=cutoff, sort_by=sort_by, direction=direction)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find non-redundant protein sequences that bind iron-containing ligands.")
+    parser.add_argument("--cutoff", type=int, choices=IDENTITY_CUTOFFS, default=95, help="Sequence identity cutoff in %% (default: %(default)s)")
+    parser.add_argument("--sort-by", default="rcsb_entry_info.resolution_combined", help="Attribute used to select representatives (default: %(default)s)")
+    parser.add_argument("--direction", choices=["asc", "desc"], default="asc", help="Sort direction of --sort-by (default: %(default)s)")
+    parser.add_argument("--local-grouping", action="store_true", help="Select representatives locally from the ungrouped hits")
+    parser.add_argument("--table", help="With --local-grouping, .npz file to read the cluster table from (or save it to)")
+    args = parser.parse_args()
+
     s_time = time.time()
     ccd_ids = search_iron_containing_ccd()
-    final_sequences = search_sequence_targets(ccd_ids)
+    if args.local_grouping:
+        final_sequences = group_sequence_targets_locally(ccd_ids, args.cutoff, args.sort_by, args.direction, args.table)
+    else:
+        final_sequences = search_sequence_targets(ccd_ids, args.cutoff, args.sort_by, args.direction)
     print(f"Total number of results: {len(final_sequences)}")
     print(f"List of results: {final_sequences}")
     e_time = time.time()
@@ -0,0 +1,209 @@
+"""
+Select sequence identity representatives locally, instead of running a new grouped search for every cutoff and
+ranking criterion.
+
+The Search API can group polymer entities by sequence identity (`group_by` with `aggregation_method`
+"sequence_identity") and return the best-ranked member of each group. Each combination of similarity cutoff and
+ranking attribute is a separate server-side search, though. The functions below run the search once without
+grouping, fetch the cluster membership of every hit (`rcsb_cluster_membership`, with clusters at 30, 50, 70, 90, 95
+and 100% identity) together with the ranking attributes from the Data API, and then select representatives with
+NumPy for any cutoff and sort order. The fetched table can be saved to an .npz file and re-used across runs; the
+file records a hash of the search request (see search_cache.request_hash), so a table saved for another search is
+fetched again rather than re-used.
+
+Entities that are not part of a cluster at the requested cutoff form a group of their own. Ranking follows the
+Search API: list-valued attributes are reduced to their smallest value for ascending order and their largest value
+for descending order, hits without a value rank last and ties are broken by ID.
+
+Example:
+    from local_grouping import load_cluster_table
+
+    table = load_cluster_table(search_request, table_path="targets.npz")
+    best_resolution = table.representatives(cutoff=95, sort_by="rcsb_entry_info.resolution_combined")
+    latest = table.representatives(cutoff=50, sort_by="rcsb_accession_info.initial_release_date", direction="desc")
+
+Requirements:
+    pip install requests numpy
+"""
+
+import copy
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from search_cache import request_hash
+from sharded_search import DATA_API_URL, DEFAULT_SHARD_SIZE, ENTITY_CATEGORY_PREFIXES, _extract, sharded_search
+
+IDENTITY_CUTOFFS = (30, 50, 70, 90, 95, 100)
+
+DEFAULT_RANKING_ATTRIBUTES = (
+    "rcsb_entry_info.resolution_combined",
+    "rcsb_accession_info.initial_release_date",
+    "refine.ls_R_factor_R_free",
+)
+
+
+def ungrouped_request(search_request):
+    """Return a copy of a grouped search request with the grouping removed."""
+    request = copy.deepcopy(search_request)
+    request_options = request.get("request_options", {})
+    for option in ("group_by", "group_by_return_type"):
+        request_options.pop(option, None)
+    return request
+
+
+def _entity_path(attribute):
+    path = attribute.split(".")
+    if not path[0].startswith(ENTITY_CATEGORY_PREFIXES):
+        path = ["entry"] + path
+    return path
+
+
+def _selection(paths):
+    """Build a GraphQL selection set from a list of field paths."""
+    tree = {}
+    for path in paths:
+        node = tree
+        for field in path:
+            node = node.setdefault(field, {})
+
+    def render(node):
+        return " ".join(f"{field} {{ {render(children)} }}" if children else field for field, children in node.items())
+    return render(tree)
+
+
+def _to_number(value):
+    if isinstance(value, str):
+        # dates, e.g. "2012-03-07T00:00:00+0000"
+        return np.datetime64(value[:19], "s").astype(np.int64).astype(float)
+    return float(value)
+
+
+class ClusterTable:
+    """Cluster membership and ranking attributes of a set of polymer entities, as NumPy arrays.
+
+    Attributes:
+        ids (np.ndarray): polymer entity IDs
+        clusters (dict): identity cutoff -> cluster ID of each entity (-1 if not clustered at that cutoff)
+        minimum (dict): ranking attribute -> smallest value of each entity (NaN if missing)
+        maximum (dict): ranking attribute -> largest value of each entity (NaN if missing)
+        request_hash (str): hash of the search request that selected the entities (None if unknown)
+    """
+
+    def __init__(self, ids, clusters, minimum, maximum, request_hash=None):
+        self.ids = np.asarray(ids, dtype=str)
+        self.clusters = clusters
+        self.minimum = minimum
+        self.maximum = maximum
+        self.request_hash = request_hash
+
+    @classmethod
+    def fetch(cls, entity_ids, ranking_attributes=DEFAULT_RANKING_ATTRIBUTES, data_api_url=DATA_API_URL, max_workers=4, batch_size=1_000):
+        """Fetch cluster membership and ranking attributes with concurrent Data API requests."""
+        paths = [_entity_path(attribute) for attribute in ranking_attributes]
+        selection = _selection([["rcsb_id"], ["rcsb_cluster_membership", "cluster_id"], ["rcsb_cluster_membership", "identity"]] + paths)
+        query = f"query clusters($ids: [String!]!) {{ polymer_entities(entity_ids: $ids) {{ {selection} }} }}"
+        session = requests.Session()
+
+        def fetch_batch(batch):
+            response = session.post(data_api_url, json={"query": query, "variables": {"ids": batch}}, timeout=100)
+            response.raise_for_status()
+            return response.json()["data"]["polymer_entities"] or []
+
+        ids = list(dict.fromkeys(entity_ids))
+        index = {entity_id: i for i, entity_id in enumerate(ids)}
+        clusters = {cutoff: np.full(len(ids), -1, dtype=np.int64) for cutoff in IDENTITY_CUTOFFS}
+        minimum = {attribute: np.full(len(ids), np.nan) for attribute in ranking_attributes}
+        maximum = {attribute: np.full(len(ids), np.nan) for attribute in ranking_attributes}
+
+        batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for records in executor.map(fetch_batch, batches):
+                for record in records:
+                    i = index.get(record["rcsb_id"])
+                    if i is None:
+                        continue
+                    for membership in record.get("rcsb_cluster_membership") or []:
+                        if membership["identity"] in clusters:
+                            clusters[membership["identity"]][i] = membership["cluster_id"]
+                    for attribute, path in zip(ranking_attributes, paths):
+                        values = [_to_number(value) for value in _extract(record, path)]
+                        if values:
+                            minimum[attribute][i] = min(values)
+                            maximum[attribute][i] = max(values)
+        session.close()
+        return cls(ids, clusters, minimum, maximum)
+
+    def save(self, path):
+        arrays = {"ids": self.ids}
+        if self.request_hash:
+            arrays["request_hash"] = np.array(self.request_hash)
+        arrays.update({f"cluster:{cutoff}": values for cutoff, values in self.clusters.items()})
+        arrays.update({f"min:{attribute}": values for attribute, values in self.minimum.items()})
+        arrays.update({f"max:{attribute}": values for attribute, values in self.maximum.items()})
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            clusters = {int(key.split(":", 1)[1]): arrays[key] for key in arrays.files if key.startswith("cluster:")}
+            minimum = {key.split(":", 1)[1]: arrays[key] for key in arrays.files if key.startswith("min:")}
+            maximum = {key.split(":", 1)[1]: arrays[key] for key in arrays.files if key.startswith("max:")}
+            # Tables saved without a request hash are never matched to a search request
+            saved_hash = str(arrays["request_hash"]) if "request_hash" in arrays.files else None
+            return cls(arrays["ids"], clusters, minimum, maximum, request_hash=saved_hash)
+
+    def _group_order(self, cutoff, sort_by, direction):
+        """Return the group of each entity and the order that sorts entities by group, then by rank."""
+        if cutoff not in self.clusters:
+            raise ValueError(f"Unsupported identity cutoff {cutoff} (expected one of {sorted(self.clusters)})")
+        if sort_by not in self.minimum:
+            raise ValueError(f"Ranking attribute '{sort_by}' was not fetched (available: {sorted(self.minimum)})")
+        if direction not in ("asc", "desc"):
+            raise ValueError(f"Unsupported direction '{direction}'")
+
+        n = len(self.ids)
+        # Unclustered entities get a group of their own (negative IDs do not collide with cluster IDs)
+        groups = np.where(self.clusters[cutoff] >= 0, self.clusters[cutoff], -1 - np.arange(n))
+        key = self.minimum[sort_by] if direction == "asc" else -self.maximum[sort_by]
+        key = np.where(np.isnan(key), np.inf, key)
+        id_rank = np.argsort(np.argsort(self.ids, kind="stable"), kind="stable")
+        order = np.lexsort((id_rank, key, groups))
+        return groups, key, id_rank, order
+
+    def representatives(self, cutoff=95, sort_by="rcsb_entry_info.resolution_combined", direction="asc"):
+        """Return the best-ranked entity of each group, ordered from the best to the worst representative."""
+        groups, key, id_rank, order = self._group_order(cutoff, sort_by, direction)
+        sorted_groups = groups[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = sorted_groups[1:] != sorted_groups[:-1]
+        best = order[first]
+        best = best[np.lexsort((id_rank[best], key[best]))]
+        return self.ids[best].tolist()
+
+    def groups(self, cutoff=95, sort_by="rcsb_entry_info.resolution_combined", direction="asc"):
+        """Return all groups as lists of entity IDs, ranked within each group (like "groups" results)."""
+        groups, _, _, order = self._group_order(cutoff, sort_by, direction)
+        sorted_groups = groups[order]
+        boundaries = np.flatnonzero(sorted_groups[1:] != sorted_groups[:-1]) + 1
+        return [self.ids[members].tolist() for members in np.split(order, boundaries)]
+
+
+def load_cluster_table(search_request, table_path=None, ranking_attributes=DEFAULT_RANKING_ATTRIBUTES, shard_size=DEFAULT_SHARD_SIZE, cache=None):
+    """Run a (grouped) search without grouping and fetch the cluster table of its hits.
+
+    If `table_path` is given, the table is read from that file when it exists and was saved for the same search
+    request (grouping options aside) with all ranking attributes; otherwise it is fetched and saved to that file.
+    """
+    request = ungrouped_request(search_request)
+    search_hash = request_hash(request)
+    if table_path and os.path.exists(table_path):
+        table = ClusterTable.load(table_path)
+        if table.request_hash == search_hash and set(ranking_attributes) <= set(table.minimum):
+            return table
+    hits = sharded_search(request, shard_size=shard_size, cache=cache)
+    table = ClusterTable.fetch(hits, ranking_attributes=ranking_attributes)
+    table.request_hash = search_hash
+    if table_path:
+        table.save(table_path)
+    return table
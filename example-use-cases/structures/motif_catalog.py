@@ -0,0 +1,94 @@
+"""
+Run a catalog of structural motif searches concurrently and write one pair of CSV files per motif.
+
+The catalog is a JSON file with a list of motifs (see motif_catalog.json), each with:
+    - "name": used for the output file names ("<name>.csv" and "<name>-dedup-uniprot.csv")
+    - "entry_id": entry containing the motif
+    - "residues": list of residues, each with the arguments of `StructMotifResidue`
+      (e.g., {"struct_oper_id": "1", "chain_id": "A", "label_seq_id": 41})
+    - "atom_pairing_scheme" (optional, default "ALL") and "rmsd_cutoff" (optional, default 2)
+
+General workflow:
+    1. Run up to '--workers' motif searches at the same time (see motif_pipeline.py for the steps of each search)
+    2. Fetch chain metadata through one persistent cache shared by all motifs, so chains matched by several
+       motifs, or in an earlier run, are only fetched once per weekly PDB release
+    3. Print a summary of the run (a motif that fails is reported and does not stop the others)
+
+Requirements:
+    pip install rcsb-api
+
+Usage:
+    python motif_catalog.py motif_catalog.json --workers 8 --output-dir motif_results
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from motif_pipeline import DEFAULT_ANNOTATION_CACHE, EntityAnnotationCache, run_motif
+
+
+def load_catalog(path):
+    with open(path) as handle:
+        catalog = json.load(handle)
+    names = [motif["name"] for motif in catalog]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate motif names in {path}: {', '.join(duplicates)}")
+    return catalog
+
+
+def run_catalog(catalog, max_workers=4, output_dir=".", annotation_cache=None, stream=False):
+    """Run all motifs of a catalog concurrently (with `stream`, search results are decoded incrementally).
+
+    Returns:
+        tuple: list of run summaries (see `run_motif`), and dict of motif name -> error for failed motifs
+    """
+    annotation_cache = annotation_cache or EntityAnnotationCache()
+    os.makedirs(output_dir, exist_ok=True)
+    summaries = []
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                run_motif,
+                motif["name"],
+                motif["entry_id"],
+                motif["residues"],
+                atom_pairing_scheme=motif.get("atom_pairing_scheme", "ALL"),
+                rmsd_cutoff=motif.get("rmsd_cutoff", 2),
+                annotation_cache=annotation_cache,
+                output_dir=output_dir,
+                stream=stream
+            ): motif["name"]
+            for motif in catalog
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                summaries.append(future.result())
+            except Exception as error:
+                errors[name] = error
+                print(f"[{name}] Failed: {error}")
+    return summaries, errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a catalog of structural motif searches concurrently.")
+    parser.add_argument("catalog", help="JSON file with the motifs to search")
+    parser.add_argument("--workers", type=int, default=4, help="Number of motif searches to run concurrently (default: %(default)s)")
+    parser.add_argument("--output-dir", default=".", help="Directory for the CSV files (default: current directory)")
+    parser.add_argument("--annotation-cache", default=DEFAULT_ANNOTATION_CACHE, help="SQLite file of cached entity annotations, or ':memory:' (default: %(default)s)")
+    parser.add_argument("--stream", action="store_true", help="Decode the verbose search results as they arrive, to bound memory use for motifs with many matches")
+    args = parser.parse_args()
+
+    s_time = time.time()
+    catalog = load_catalog(args.catalog)
+    annotation_cache = EntityAnnotationCache(args.annotation_cache)
+    summaries, errors = run_catalog(catalog, max_workers=args.workers, output_dir=args.output_dir, annotation_cache=annotation_cache, stream=args.stream)
+
+    print(f"Searched {len(catalog)} motifs: {len(summaries)} succeeded, {len(errors)} failed")
+    print(f"Total number of rows: {sum(summary['rows'] for summary in summaries)}")
+    print(f"Chain annotations fetched from the Data API: {annotation_cache.requested}")
+    print(f"Total execution time: {time.time() - s_time:.4f} seconds")
@@ -0,0 +1,510 @@
+"""
+Shared pipeline for structural motif searches annotated with polymer entity metadata.
+
+For a motif (a set of residues in a query entry), the pipeline:
+    1. Searches for assemblies containing the motif with `StructMotifQuery` (verbose results, so that the
+       matching residues and RMSD of every match are returned)
+    2. Collects the unique (entry, chain) pairs of all matches and fetches their polymer entity metadata
+       (UniProt IDs, description, EC numbers) with batched, concurrent Data API queries
+    3. Keeps the lowest RMSD match per (entry, entity) and writes it to a CSV file, plus a second CSV file with
+       one row per set of UniProt IDs
+
+For motifs with many matches, `run_motif(..., stream=True)` decodes the verbose search response incrementally
+instead of loading it as a whole, and reduces each hit as soon as it arrives.
+
+Metadata is looked up through an `EntityAnnotationCache`, which is stored on disk (by default in
+~/.cache/rcsb-motif, or in the file given by the RCSB_ANNOTATION_CACHE environment variable) and can be shared
+by several motif searches (see motif_catalog.py). Chains matched by more than one motif, or in an earlier run, are
+only fetched once per weekly PDB release.
+
+Example:
+    from motif_pipeline import run_motif
+
+    residues = [{"struct_oper_id": "1", "chain_id": "A", "label_seq_id": seq_id} for seq_id in (100, 103, 115, 119)]
+    run_motif("C2HC-zinc-binding-proteins", "5DKA", residues, atom_pairing_scheme="SIDE_CHAIN", rmsd_cutoff=2)
+
+Requirements:
+    pip install rcsb-api
+"""
+
+import codecs
+import csv
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from rcsbapi.search import StructMotifQuery, StructMotifResidue
+from rcsbapi.data import DataQuery
+from search_cache import current_release
+from search_pagination import MAX_ROWS, SEARCH_API_URL, build_search_request
+
+EC_CLASS_MAP = {
+    "1": "Oxidoreductase",
+    "2": "Transferase",
+    "3": "Hydrolase",
+    "4": "Lyase",
+    "5": "Isomerase",
+    "6": "Ligase",
+    "7": "Translocase",
+}
+
+CSV_FIELDS = ["PDB ID", "Entity ID", "Chain ID(s)", "UniProt ID(s)", "Protein(s)", "EC Class", "EC Number(s)", "RMSD"]
+
+DEFAULT_ANNOTATION_CACHE = os.environ.get(
+    "RCSB_ANNOTATION_CACHE", os.path.join("~", ".cache", "rcsb-motif", "entity_annotations.sqlite")
+)
+
+# Size of the text chunks in which streamed search responses are decoded
+STREAM_CHUNK_SIZE = 1 << 16
+
+# Data API batching of the chain metadata lookups
+METADATA_BATCH_SIZE = 1000
+METADATA_MAX_CONCURRENCY = 8
+
+
+# Pick EC numbers, preferring UniProt
+def pick_ec(ec_data, ec_list):
+    if not ec_data:
+        return
+
+    uniprot_ecs = []
+    fallback_ecs = []
+
+    for item in ec_data:
+        ec = item.get("ec")
+        if not ec:
+            continue
+        if item.get("provenance_source") == "UniProt":
+            uniprot_ecs.append(ec)
+        else:
+            fallback_ecs.append(ec)
+
+    if uniprot_ecs:
+        ec_list.update(uniprot_ecs)
+    else:
+        ec_list.update(fallback_ecs)
+
+
+# Convert EC numbers to unique enzyme class names
+def ec_to_classes(ec_list):
+    classes = set()
+
+    for ec in ec_list:
+        if not ec:
+            continue
+        first_digit = ec.split(".", 1)[0]
+        enzyme_class = EC_CLASS_MAP.get(first_digit)
+        if enzyme_class:
+            classes.add(enzyme_class)
+
+    return sorted(classes)
+
+
+# Fetch polymer entity metadata for a list of instance IDs (e.g. "4HHB.A") with batched, concurrent queries
+def fetch_instance_metadata(instance_ids):
+    if not instance_ids:
+        return {}
+    data_query = DataQuery(
+        input_type="polymer_entity_instances",
+        input_ids=instance_ids,
+        return_data_list=[
+            "rcsb_id",
+            "polymer_entity.rcsb_polymer_entity_container_identifiers.entity_id",
+            "polymer_entity.rcsb_polymer_entity_container_identifiers.uniprot_ids",
+            "polymer_entity.rcsb_polymer_entity.pdbx_description",
+            "polymer_entity.rcsb_polymer_entity.rcsb_enzyme_class_combined.ec",
+            "polymer_entity.rcsb_polymer_entity.rcsb_enzyme_class_combined.provenance_source"
+        ]
+    )
+    data = data_query.exec(batch_size=METADATA_BATCH_SIZE, max_concurrency=METADATA_MAX_CONCURRENCY)
+    return {
+        instance['rcsb_id'].upper(): instance['polymer_entity']
+        for instance in data['data']['polymer_entity_instances'] or []
+    }
+
+
+class EntityAnnotationCache:
+    """Persistent cache of polymer entity annotations, safe to share between threads.
+
+    Annotations (UniProt IDs, description and EC numbers) are stored once per entity, keyed by entry ID and
+    entity ID, together with a mapping from the instance IDs (entry ID and asym ID) that were looked up to their
+    entity. Entries are stamped with the weekly PDB release they were fetched in and refetched after the next
+    release. When the cache holds more than `max_entities` entities, the least recently used ones are evicted.
+
+    Args:
+        path (str): SQLite database file (":memory:" for a cache that only lasts for the current run)
+        max_entities (int): maximum number of cached entities
+        release_aware (bool): refetch annotations fetched before the current PDB release
+    """
+
+    def __init__(self, path=DEFAULT_ANNOTATION_CACHE, max_entities=1_000_000, release_aware=True):
+        if path != ":memory:":
+            path = os.path.expanduser(path)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS entities (
+                entity_key TEXT PRIMARY KEY, annotation TEXT NOT NULL, release TEXT NOT NULL, last_used REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS instances (
+                instance_id TEXT PRIMARY KEY, entity_key TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entities_last_used ON entities (last_used);
+        """)
+        self._lock = threading.Lock()
+        self.max_entities = max_entities
+        self.release_aware = release_aware
+        # Number of instance IDs fetched from the Data API
+        self.requested = 0
+
+    def _lookup(self, instance_ids):
+        release = current_release()
+        found = {}
+        for i in range(0, len(instance_ids), 500):
+            batch = instance_ids[i:i + 500]
+            rows = self._connection.execute(
+                f"SELECT i.instance_id, e.entity_key, e.annotation, e.release FROM instances i "
+                f"JOIN entities e ON e.entity_key = i.entity_key WHERE i.instance_id IN ({','.join('?' * len(batch))})",
+                batch
+            ).fetchall()
+            for instance_id, entity_key, annotation, entity_release in rows:
+                if not self.release_aware or entity_release == release:
+                    found[instance_id] = (entity_key, json.loads(annotation))
+        now = time.time()
+        self._connection.executemany(
+            "UPDATE entities SET last_used = ? WHERE entity_key = ?",
+            [(now, entity_key) for entity_key, _ in found.values()]
+        )
+        return {instance_id: annotation for instance_id, (_, annotation) in found.items()}
+
+    def _store(self, fetched):
+        release = current_release()
+        now = time.time()
+        for instance_id, entity in fetched.items():
+            entry_id = instance_id.split(".", 1)[0]
+            entity_key = f"{entry_id}_{entity['rcsb_polymer_entity_container_identifiers']['entity_id']}"
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?)",
+                (entity_key, json.dumps(entity), release, now)
+            )
+            self._connection.execute("INSERT OR REPLACE INTO instances VALUES (?, ?)", (instance_id, entity_key))
+        self._evict()
+        self._connection.commit()
+
+    def _evict(self):
+        count = self._connection.execute("SELECT COUNT(*) FROM entities").fetchone()[0]
+        if count <= self.max_entities:
+            return
+        self._connection.execute(
+            "DELETE FROM entities WHERE entity_key IN (SELECT entity_key FROM entities ORDER BY last_used LIMIT ?)",
+            (count - self.max_entities,)
+        )
+        self._connection.execute("DELETE FROM instances WHERE entity_key NOT IN (SELECT entity_key FROM entities)")
+
+    def resolve(self, instance_ids):
+        """Return the annotations of the given instance IDs (e.g. "4HHB.A"), fetching the ones that are not cached."""
+        instance_ids = sorted(set(instance_ids))
+        with self._lock:
+            cached = self._lookup(instance_ids)
+            self._connection.commit()
+        missing = [instance_id for instance_id in instance_ids if instance_id not in cached]
+        if missing:
+            fetched = fetch_instance_metadata(missing)
+            with self._lock:
+                self._store(fetched)
+                self.requested += len(missing)
+            cached.update(fetched)
+        return cached
+
+    def close(self):
+        self._connection.close()
+
+
+def motif_query(entry_id, residues, atom_pairing_scheme="ALL", rmsd_cutoff=2):
+    """Build a structural motif query.
+
+    Args:
+        entry_id (str): entry containing the motif
+        residues (list): residues of the motif, as `StructMotifResidue` objects or dicts of their arguments
+        atom_pairing_scheme (str): atoms used to superimpose the residues (e.g., "ALL", "SIDE_CHAIN")
+        rmsd_cutoff (float): maximum RMSD of a match
+    """
+    residues = [StructMotifResidue(**residue) if isinstance(residue, dict) else residue for residue in residues]
+    return StructMotifQuery(
+        entry_id=entry_id,
+        residue_ids=residues,
+        atom_pairing_scheme=atom_pairing_scheme,
+        rmsd_cutoff=rmsd_cutoff
+    )
+
+
+def search_motif(entry_id, residues, atom_pairing_scheme="ALL", rmsd_cutoff=2):
+    """Run a structural motif search and return the verbose assembly results (see `motif_query` for arguments)."""
+    search_query = motif_query(entry_id, residues, atom_pairing_scheme, rmsd_cutoff)
+    return list(search_query(
+        results_verbosity="verbose",
+        return_type="assembly"
+    ))
+
+
+def iter_json_array(chunks, key, info):
+    """Incrementally decode the items of the array `key` of a JSON object that arrives in text chunks.
+
+    Only the item being decoded is held in memory. The top-level "total_count" (found before or after the array)
+    is stored in `info`.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        match = start.search(buffer)
+        if match:
+            _parse_total_count(buffer[:match.start()], info)
+            buffer = buffer[match.end():]
+            break
+    else:
+        _parse_total_count(buffer, info)
+        return
+
+    exhausted = False
+    while True:
+        buffer = buffer.lstrip(" \t\r\n,")
+        if buffer.startswith("]"):
+            _parse_total_count(buffer + "".join(chunks), info)
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            # The item is incomplete: read more of the response
+            if exhausted:
+                raise
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+            else:
+                buffer += chunk
+            continue
+        buffer = buffer[end:]
+        yield item
+
+
+def _parse_total_count(text, info):
+    match = re.search(r'"total_count"\s*:\s*(\d+)', text)
+    if match:
+        info["total_count"] = int(match.group(1))
+
+
+def stream_motif_results(entry_id, residues, atom_pairing_scheme="ALL", rmsd_cutoff=2, rows=MAX_ROWS, session=None, url=None):
+    """Yield the verbose assembly results of a structural motif search one at a time, as the response arrives.
+
+    Unlike `search_motif`, the response is never held in memory as a whole: pages of results are requested from
+    the Search API directly and decoded incrementally (see `motif_query` for the motif arguments).
+    """
+    search_request = build_search_request(
+        motif_query(entry_id, residues, atom_pairing_scheme, rmsd_cutoff),
+        return_type="assembly",
+        results_verbosity="verbose"
+    )
+    own_session = session is None
+    session = session or requests.Session()
+    try:
+        start = 0
+        while True:
+            search_request["request_options"]["paginate"] = {"start": start, "rows": rows}
+            with session.post(url or SEARCH_API_URL, json=search_request, stream=True, timeout=300) as response:
+                response.raise_for_status()
+                if response.status_code == 204:
+                    return
+                info = {}
+                page_count = 0
+                text_decoder = codecs.getincrementaldecoder("utf-8")()
+                chunks = (text_decoder.decode(chunk) for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE))
+                for result in iter_json_array(chunks, "result_set", info):
+                    page_count += 1
+                    yield result
+            start += page_count
+            if page_count == 0 or start >= info.get("total_count", 0):
+                return
+    finally:
+        if own_session:
+            session.close()
+
+
+def collect_matches(results, query_entry_id):
+    """Return (entry ID, chain IDs, RMSD) of every match context, excluding matches in the query entry."""
+    matches = []
+    for result in results:
+        entry_id = result['identifier'].split("-")[0].lower()
+        if entry_id == query_entry_id.lower():
+            continue
+        for c in result['services'][0]['nodes'][0]['match_context']:
+            # unique chain IDs
+            label_asym_ids = sorted({r['label_asym_id'] for r in c['residue_ids']})
+            matches.append((entry_id, label_asym_ids, c['score']))
+    return matches
+
+
+def reduce_streamed_matches(results, query_entry_id, annotation_cache, on_result=None):
+    """Reduce streamed results to at most two matches per (entry, set of chains) while they arrive.
+
+    Chain annotations are resolved in the background in batches of METADATA_BATCH_SIZE new chains, so that the
+    Data API requests overlap with the search response.
+
+    Returns:
+        tuple: reduced matches (`build_rows` gives the same rows for them as for all matches), annotations, and
+            the number of matches before reduction
+    """
+    best = {}
+    pending = set()
+    seen = set()
+    futures = []
+    match_count = 0
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for result in results:
+            for entry_id, label_asym_ids, score in collect_matches([result], query_entry_id):
+                key = (entry_id, tuple(label_asym_ids))
+                # Keep the first match and the (first) lowest score match of each set of chains, with their
+                # positions among all matches: `build_rows` only depends on these
+                if key not in best:
+                    best[key] = {"first": (match_count, score), "best": (match_count, score)}
+                elif score < best[key]["best"][1]:
+                    best[key]["best"] = (match_count, score)
+                match_count += 1
+                new_ids = {f"{entry_id.upper()}.{asym_id}" for asym_id in label_asym_ids} - seen
+                seen.update(new_ids)
+                pending.update(new_ids)
+            if on_result:
+                on_result(result)
+            if len(pending) >= METADATA_BATCH_SIZE:
+                futures.append(executor.submit(annotation_cache.resolve, sorted(pending)))
+                pending = set()
+        if pending:
+            futures.append(executor.submit(annotation_cache.resolve, sorted(pending)))
+        annotations = {}
+        for future in futures:
+            annotations.update(future.result())
+
+    kept = sorted({
+        (index, entry_id, label_asym_ids, score)
+        for (entry_id, label_asym_ids), occurrences in best.items()
+        for index, score in occurrences.values()
+    })
+    matches = [(entry_id, list(label_asym_ids), score) for _, entry_id, label_asym_ids, score in kept]
+    return matches, annotations, match_count
+
+
+def instance_ids_of(matches):
+    return sorted({f"{entry_id.upper()}.{asym_id}" for entry_id, label_asym_ids, _ in matches for asym_id in label_asym_ids})
+
+
+def build_rows(matches, metadata):
+    """Join the chain metadata onto the matches and keep the lowest RMSD row per (entry, entity)."""
+    best_rows = {}
+
+    for entry_id, label_asym_ids, score in matches:
+        # Prepare sets
+        protein = set()
+        ec = set()
+
+        # Join the metadata of each chain
+        for asym_id in label_asym_ids:
+            entity = metadata[f"{entry_id.upper()}.{asym_id}"]
+
+            entity_id = entity['rcsb_polymer_entity_container_identifiers']['entity_id']
+            uniprot_ids = entity['rcsb_polymer_entity_container_identifiers']['uniprot_ids']
+            rcsb_polymer_entity = entity['rcsb_polymer_entity']
+
+            if rcsb_polymer_entity.get('pdbx_description'):
+                protein.add(rcsb_polymer_entity['pdbx_description'])
+
+            if rcsb_polymer_entity.get('rcsb_enzyme_class_combined'):
+                pick_ec(rcsb_polymer_entity['rcsb_enzyme_class_combined'], ec)
+
+        key = (entry_id, entity_id)
+        if key in best_rows and best_rows[key]["RMSD"] <= score:
+            continue
+        best_rows[key] = {
+            "PDB ID": f"pdb_{entry_id.zfill(8)}",
+            "Entity ID": entity_id,
+            "Chain ID(s)": ",".join(label_asym_ids),
+            "UniProt ID(s)": ", ".join(sorted(uniprot_ids)) if uniprot_ids else "",
+            "Protein(s)": ", ".join(sorted(protein)) if protein else "",
+            "EC Class": ", ".join(ec_to_classes(ec)) if ec else "",
+            "EC Number(s)": ", ".join(sorted(ec)) if ec else "",
+            "RMSD": score
+        }
+
+    return list(best_rows.values())
+
+
+def dedup_by_uniprot(rows):
+    """Keep the lowest RMSD row per set of UniProt IDs."""
+    dedup_uniprot = {}
+    for row in rows:
+        uniprot_key = row["UniProt ID(s)"]
+        if uniprot_key not in dedup_uniprot or row["RMSD"] < dedup_uniprot[uniprot_key]["RMSD"]:
+            dedup_uniprot[uniprot_key] = row
+    return list(dedup_uniprot.values())
+
+
+def write_csv(rows, path):
+    with open(path, "w") as handle:
+        writer = csv.DictWriter(handle, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run_motif(name, entry_id, residues, atom_pairing_scheme="ALL", rmsd_cutoff=2, annotation_cache=None, output_dir=".", verbose=True, stream=False):
+    """Search a motif, annotate the matches and write "<name>.csv" and "<name>-dedup-uniprot.csv".
+
+    With `stream`, the search results are decoded as they arrive and reduced to the best match per set of chains
+    right away (see `stream_motif_results`), so memory use does not grow with the size of the verbose response.
+
+    Returns:
+        dict: summary of the run (numbers of assemblies, matches and CSV rows)
+    """
+    annotation_cache = annotation_cache or EntityAnnotationCache()
+    if stream:
+        assembly_count = 0
+
+        def count_assembly(result):
+            nonlocal assembly_count
+            assembly_count += 1
+
+        results = stream_motif_results(entry_id, residues, atom_pairing_scheme, rmsd_cutoff)
+        matches, metadata, match_count = reduce_streamed_matches(results, entry_id, annotation_cache, on_result=count_assembly)
+        if verbose:
+            print(f"[{name}] Total number of assemblies: {assembly_count}")
+    else:
+        results = search_motif(entry_id, residues, atom_pairing_scheme, rmsd_cutoff)
+        assembly_count = len(results)
+        if verbose:
+            print(f"[{name}] Total number of assemblies: {assembly_count}")
+
+        # Collect the matches first, so that chain metadata can be fetched in a few batched queries
+        matches = collect_matches(results, entry_id)
+        match_count = len(matches)
+        metadata = annotation_cache.resolve(instance_ids_of(matches))
+    if verbose:
+        print(f"[{name}] Annotated {len(metadata)} chains")
+
+    final_rows = build_rows(matches, metadata)
+    csv_path = os.path.join(output_dir, f"{name}.csv")
+    write_csv(final_rows, csv_path)
+    if verbose:
+        print(f"[{name}] Wrote {len(final_rows)} rows of data to {csv_path}")
+
+    # Write de-duplicated CSV by UniProt ID(s)
+    dedup_rows = dedup_by_uniprot(final_rows)
+    dedup_path = os.path.join(output_dir, f"{name}-dedup-uniprot.csv")
+    write_csv(dedup_rows, dedup_path)
+    if verbose:
+        print(f"[{name}] Wrote {len(dedup_rows)} rows of non-UniProt-redundant data to {dedup_path}")
+
+    return {"name": name, "assemblies": assembly_count, "matches": match_count, "rows": len(final_rows), "dedup_rows": len(dedup_rows)}
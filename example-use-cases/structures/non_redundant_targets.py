@@ -7,24 +7,36 @@ General workflow:
     3. Next, remove sequences that share at least 95% identity and return sequences from structures with the
        highest resolution
 
+The list of chemical components from step 1 is very long, so the query in step 2 is split into shards of
+at most SHARD_SIZE components that run concurrently (see sharded_search.py). The representatives of each
+sequence identity group are then selected again across shards by resolution.
+
+Search results are cached on disk (see search_cache.py), so re-running the script does not repeat the searches
+until the next weekly PDB release. Set RCSB_SEARCH_CACHE=off to disable the cache.
+
+With '--local-grouping', step 3 is done locally instead (see local_grouping.py): the ungrouped hits are fetched
+once together with their sequence identity clusters and ranking attributes, and saved to '--table', so that other
+cutoffs and ranking criteria can be tried without new searches.
+
 To run:
     python3 non_redundant_targets.py
+    python3 non_redundant_targets.py --local-grouping --table targets.npz --cutoff 70 --sort-by rcsb_accession_info.initial_release_date --direction desc
 
 """
 
 
-import requests
+import argparse
 import time
+from local_grouping import DEFAULT_RANKING_ATTRIBUTES, IDENTITY_CUTOFFS, load_cluster_table
+from search_cache import cached_search, get_default_cache
+from sharded_search import sharded_search
 
+# Maximum number of chemical component IDs per query
+SHARD_SIZE = 5_000
 
-def exec_search(query):
-    base_url = 'https://search.rcsb.org/rcsbsearch/v2/query'
-    response = requests.post(base_url, json=query)
 
-    if response.status_code == 200:
-        return response.json()['result_set']
-    else:
-        print(f"Request failed with status code: {response.status_code}")
+def exec_search(query):
+    return cached_search(query)
 
 
 def search_ccd():
@@ -50,9 +62,9 @@ def search_ccd():
     return exec_search(ccd_search_query)
 
 
-def search_sequence_targets(ligands):
+def sequence_targets_request(ligands, cutoff=95, sort_by="rcsb_entry_info.resolution_combined", direction="asc"):
 
-    targets_search_query = {
+    return {
         "query": {
             "type": "group",
             "logical_operator": "and",
@@ -101,24 +113,50 @@ def search_sequence_targets(ligands):
             "return_all_hits": True,
             "group_by": {
                 "aggregation_method": "sequence_identity",
-                "similarity_cutoff": 95,
+                "similarity_cutoff": cutoff,
                 "ranking_criteria_type": {
-                    "sort_by": "rcsb_entry_info.resolution_combined",
-                    "direction": "asc"
+                    "sort_by": sort_by,
+                    "direction": direction
                 }
             },
             "group_by_return_type": "representatives"
         }
     }
 
-    return exec_search(targets_search_query)
+
+def search_sequence_targets(ligands, cutoff=95, sort_by="rcsb_entry_info.resolution_combined", direction="asc"):
+    targets_search_query = sequence_targets_request(ligands, cutoff, sort_by, direction)
+    return sharded_search(targets_search_query, shard_size=SHARD_SIZE, cache=get_default_cache())
+
+
+def group_sequence_targets_locally(ligands, cutoff=95, sort_by="rcsb_entry_info.resolution_combined", direction="asc", table_path=None):
+    ranking_attributes = tuple(dict.fromkeys(DEFAULT_RANKING_ATTRIBUTES + (sort_by,)))
+    table = load_cluster_table(
+        sequence_targets_request(ligands),
+        table_path=table_path,
+        ranking_attributes=ranking_attributes,
+        shard_size=SHARD_SIZE,
+        cache=get_default_cache()
+    )
+    return table.representatives(cutoff=cutoff, sort_by=sort_by, direction=direction)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find non-redundant protein sequences that bind ligands heavier than 180 Da.")
+    parser.add_argument("--cutoff", type=int, choices=IDENTITY_CUTOFFS, default=95, help="Sequence identity cutoff in %% (default: %(default)s)")
+    parser.add_argument("--sort-by", default="rcsb_entry_info.resolution_combined", help="Attribute used to select representatives (default: %(default)s)")
+    parser.add_argument("--direction", choices=["asc", "desc"], default="asc", help="Sort direction of --sort-by (default: %(default)s)")
+    parser.add_argument("--local-grouping", action="store_true", help="Select representatives locally from the ungrouped hits")
+    parser.add_argument("--table", help="With --local-grouping, .npz file to read the cluster table from (or save it to)")
+    args = parser.parse_args()
+
     s_time = time.time()
     ccd_ids = search_ccd()
     print(f"Total number of CCD IDs: {len(ccd_ids)}")
-    final_sequences = search_sequence_targets(ccd_ids)
+    if args.local_grouping:
+        final_sequences = group_sequence_targets_locally(ccd_ids, args.cutoff, args.sort_by, args.direction, args.table)
+    else:
+        final_sequences = search_sequence_targets(ccd_ids, args.cutoff, args.sort_by, args.direction)
     print(f"Total number of results: {len(final_sequences)}")
     print(f"List of results: {final_sequences}")
     e_time = time.time()
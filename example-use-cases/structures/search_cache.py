@@ -0,0 +1,170 @@
+"""
+On-disk cache of Search API responses, so that re-running a script does not repeat its searches.
+
+Responses are stored per request (i.e., per page of results) under a hash of the canonical form of the request:
+keys are sorted, operators are lower-cased, the values of `in` queries are sorted, the nodes of "and"/"or" groups
+are sorted, and node IDs and the random `request_info` are dropped. Two requests that only differ in these respects
+share a cache entry. Nested groups are kept as they are (even with the same operator as their parent), since a group
+may be a nested-attribute query, whose conditions must hold within a single nested object (e.g. the same ligand).
+
+Entries expire after `ttl` seconds, and (by default) when a new weekly PDB release comes out (Wednesdays at
+00:00 UTC), since search results may change with every release. The cache is kept below `max_bytes` and
+`max_entries` by evicting the least recently used entries.
+
+The cache directory defaults to ~/.cache/rcsb-search and can be changed with the RCSB_SEARCH_CACHE environment
+variable (set it to "off" to disable caching).
+
+Example:
+    from search_cache import cached_search
+
+    # Works with rcsbapi.search query objects and with request bodies copied from the Search API query editor
+    pdb_ids = cached_search(query, return_type="entry")
+
+Requirements:
+    pip install requests
+"""
+
+import copy
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from cache_budget import CacheBudget
+from search_pagination import build_search_request, iter_search_ids
+
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "rcsb-search")
+
+
+def current_release(now=None):
+    """Date of the most recent weekly PDB release (released every Wednesday at 00:00 UTC)."""
+    now = now or datetime.now(timezone.utc)
+    days_since_release = (now.weekday() - 2) % 7
+    return (now - timedelta(days=days_since_release)).date().isoformat()
+
+
+def canonical_request(search_request):
+    """Return a canonical copy of a Search API request (see module docstring).
+
+    >>> a, b, c = ({"type": "terminal", "service": "text", "parameters": {"attribute": name, "operator": "exists"}} for name in "abc")
+    >>> nested = {"type": "group", "logical_operator": "and", "label": "nested-attribute", "nodes": [a, b]}
+    >>> nested_query = {"query": {"type": "group", "logical_operator": "and", "nodes": [c, nested]}}
+    >>> flat_query = {"query": {"type": "group", "logical_operator": "and", "nodes": [c, a, b]}}
+    >>> request_hash(nested_query) == request_hash(flat_query)
+    False
+    >>> reordered_query = {"query": {"type": "group", "logical_operator": "AND", "nodes": [b, a, c], "node_id": 0}}
+    >>> request_hash(reordered_query) == request_hash(flat_query)
+    True
+    """
+    request = copy.deepcopy(search_request)
+    request.pop("request_info", None)
+    if "query" in request:
+        request["query"] = _canonical_node(request["query"])
+    return request
+
+
+def _sort_key(value):
+    return json.dumps(value, sort_keys=True)
+
+
+def _canonical_node(node):
+    node = {key: value for key, value in node.items() if key != "node_id"}
+    if node.get("type") == "group":
+        # Child groups are not merged into their parent: (a and (b and c)) differs from (a and b and c) when the
+        # inner group is a nested-attribute query, which rcsbapi (NestedAttributeQuery) sends without a label
+        node["logical_operator"] = node.get("logical_operator", "and").lower()
+        node["nodes"] = sorted(map(_canonical_node, node.get("nodes", [])), key=_sort_key)
+    elif "parameters" in node:
+        parameters = dict(node["parameters"])
+        if isinstance(parameters.get("operator"), str):
+            parameters["operator"] = parameters["operator"].lower()
+        if parameters.get("operator") == "in" and isinstance(parameters.get("value"), list):
+            parameters["value"] = sorted(set(map(_sort_key, parameters["value"])))
+            parameters["value"] = [json.loads(value) for value in parameters["value"]]
+        if not parameters.get("negation"):
+            parameters.pop("negation", None)
+        node["parameters"] = parameters
+    return node
+
+
+def request_hash(search_request):
+    canonical = json.dumps(canonical_request(search_request), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class SearchCache:
+    """Cache of Search API responses, stored as one JSON file per request."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=7 * 24 * 3600, max_bytes=512 * 2**20, max_entries=10_000, release_aware=True):
+        self.cache_dir = Path(os.path.expanduser(cache_dir))
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.release_aware = release_aware
+        self.budget = CacheBudget(str(self.cache_dir), ".json", max_bytes, max_entries=max_entries)
+
+    def _path(self, search_request):
+        return self.cache_dir / f"{request_hash(search_request)}.json"
+
+    def get(self, search_request):
+        """Return the cached response for a request (None for queries without hits).
+
+        Raises:
+            KeyError: if the request is not cached or its entry has expired
+        """
+        path = self._path(search_request)
+        try:
+            entry = json.loads(path.read_text())
+        except (OSError, ValueError):
+            raise KeyError(path.stem)
+        if time.time() - entry["created"] > self.ttl or (self.release_aware and entry["release"] != current_release()):
+            path.unlink(missing_ok=True)
+            raise KeyError(path.stem)
+        # The modification time of an entry records when it was last used
+        os.utime(path)
+        return entry["response"]
+
+    def put(self, search_request, response):
+        path = self._path(search_request)
+        entry = {"created": time.time(), "release": current_release(), "request": search_request, "response": response}
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{id(entry)}")
+        tmp_path.write_text(json.dumps(entry))
+        os.replace(tmp_path, path)
+        self.budget.add(path)
+
+    def evict(self):
+        """Remove the least recently used entries if the cache is beyond its size limits (see cache_budget.py)."""
+        self.budget.evict()
+
+    def clear(self):
+        for path in self.cache_dir.glob("*.json"):
+            path.unlink(missing_ok=True)
+        self.budget.reset()
+
+
+def get_default_cache():
+    """Return the cache configured by the RCSB_SEARCH_CACHE environment variable (None if disabled)."""
+    cache_dir = os.environ.get("RCSB_SEARCH_CACHE", DEFAULT_CACHE_DIR)
+    if cache_dir.lower() in ("", "0", "off", "false", "none"):
+        return None
+    return SearchCache(cache_dir)
+
+
+def cached_search(query, return_type="entry", cache=None, max_hits=None, **request_options):
+    """Execute a search through the cache and return all result IDs.
+
+    Args:
+        query: `rcsbapi.search` query object, query node or complete request body (see `build_search_request`)
+        return_type (str): Search API return type
+        cache (SearchCache, optional): cache to use (defaults to `get_default_cache()`)
+        max_hits (int, optional): stop after this many hits
+        **request_options: additional request options (e.g., group_by, sort)
+
+    Returns:
+        list: result IDs
+    """
+    cache = cache or get_default_cache()
+    search_request = build_search_request(query, return_type=return_type, **request_options)
+    return list(iter_search_ids(search_request, max_hits=max_hits, cache=cache))
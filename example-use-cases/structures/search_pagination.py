@@ -0,0 +1,158 @@
+"""
+Helpers for streaming Search API results one page at a time.
+
+Requesting `return_all_hits` makes the Search API build the complete result set in a single response, which
+then has to be held in memory before the first ID can be used. The functions below page through the results
+instead: each page is requested with `paginate`, and the next page is fetched in a background thread while the
+caller is still consuming the current one. Iteration can be stopped at any point (or capped with `max_hits`),
+in which case no further pages are requested. Pages can also be served from a `search_cache.SearchCache`.
+
+Example:
+    from search_pagination import build_search_request, iter_search_ids
+
+    request = build_search_request(query, return_type="polymer_instance")
+    for instance_id in iter_search_ids(request, max_hits=50_000):
+        ...
+
+Requirements:
+    pip install requests
+    pip install rcsb-api  # only needed to pass `rcsbapi.search` query objects
+"""
+
+import copy
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+SEARCH_API_URL = "https://search.rcsb.org/rcsbsearch/v2/query"
+
+# Largest page size accepted by the Search API
+MAX_ROWS = 10_000
+
+
+def build_search_request(query, return_type="entry", **request_options):
+    """Build a Search API request body.
+
+    Args:
+        query: either an `rcsbapi.search` query object, a query node (dict with a "type" key) or a complete
+            request body (dict with a "query" key, returned as a copy with `request_options` merged in)
+        return_type (str): Search API return type (ignored if `query` is already a complete request body)
+        **request_options: additional request options (e.g., group_by, sort)
+
+    Returns:
+        dict: request body
+    """
+    if hasattr(query, "to_dict"):
+        query = query.to_dict()
+    if "query" in query:
+        request = copy.deepcopy(query)
+    else:
+        request = {"query": query, "return_type": return_type}
+    request.setdefault("request_options", {}).update(request_options)
+    return request
+
+
+def fetch_search_page(search_request, start, rows, session=None, url=None, timeout=60, cache=None):
+    """Fetch a single page of results (from `cache` if it is given and holds the page).
+
+    Returns:
+        dict: the parsed JSON response, or None if the query has no hits
+    """
+    request = copy.deepcopy(search_request)
+    request_options = request.setdefault("request_options", {})
+    request_options.pop("return_all_hits", None)
+    request_options["paginate"] = {"start": start, "rows": rows}
+    request_options.setdefault("results_verbosity", "compact")
+
+    if cache is not None:
+        try:
+            return cache.get(request)
+        except KeyError:
+            pass
+
+    response = (session or requests).post(url or SEARCH_API_URL, json=request, timeout=timeout)
+    response.raise_for_status()
+    result = None if response.status_code == 204 else response.json()
+    if cache is not None:
+        cache.put(request, result)
+    return result
+
+
+def _page_results(response):
+    if response is None:
+        return []
+    if "result_set" in response:
+        return response["result_set"]
+    return response.get("group_set", [])
+
+
+def _page_total(search_request, response):
+    if response is None:
+        return 0
+    # When results are grouped, pagination applies to groups rather than to individual hits
+    if "group_by" in search_request.get("request_options", {}):
+        return response.get("group_by_count", response["total_count"])
+    return response["total_count"]
+
+
+def iter_search_pages(search_request, rows=MAX_ROWS, max_hits=None, prefetch=True, session=None, url=None, cache=None):
+    """Lazily iterate over pages of search results, fetching the next page in the background.
+
+    Args:
+        search_request (dict): Search API request body (see `build_search_request`)
+        rows (int): page size (at most 10,000)
+        max_hits (int, optional): stop after this many hits
+        prefetch (bool): request the next page while the current one is being consumed
+        session (requests.Session, optional): session to re-use for all page requests
+        url (str, optional): Search API endpoint (defaults to `SEARCH_API_URL`)
+        cache (search_cache.SearchCache, optional): cache of page responses
+
+    Yields:
+        list: the results of each page (IDs, for compact verbosity)
+    """
+    if max_hits is not None and max_hits <= 0:
+        return
+    rows = min(rows, MAX_ROWS)
+    own_session = session is None
+    session = session or requests.Session()
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    pending = None
+
+    def page_rows(start):
+        return rows if max_hits is None else min(rows, max_hits - start)
+
+    def request_page(start):
+        if executor:
+            return executor.submit(fetch_search_page, search_request, start, page_rows(start), session, url, cache=cache)
+        return fetch_search_page(search_request, start, page_rows(start), session, url, cache=cache)
+
+    try:
+        start = 0
+        total = None
+        pending = request_page(start)
+        while pending is not None:
+            response = pending.result() if executor else pending
+            pending = None
+            if total is None:
+                total = _page_total(search_request, response)
+                if max_hits is not None:
+                    total = min(total, max_hits)
+            results = _page_results(response)
+            start += len(results)
+            if results and start < total:
+                pending = request_page(start)
+            if results:
+                yield results
+    finally:
+        if executor:
+            if pending is not None:
+                pending.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+        if own_session:
+            session.close()
+
+
+def iter_search_ids(search_request, rows=MAX_ROWS, max_hits=None, prefetch=True, session=None, url=None, cache=None):
+    """Lazily iterate over individual search results (see `iter_search_pages` for arguments)."""
+    pages = iter_search_pages(search_request, rows=rows, max_hits=max_hits, prefetch=prefetch, session=session, url=url, cache=cache)
+    for page in pages:
+        yield from page
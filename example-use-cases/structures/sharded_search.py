@@ -0,0 +1,251 @@
+"""
+Execute Search API queries whose `in` value lists are too large to send as one request.
+
+An attribute query such as `rcsb_ligand_neighbors.ligand_comp_id in [...]` with tens of thousands of values is
+slow to evaluate and may be rejected because of the payload size. `sharded_search` splits such value lists into
+shards, runs one query per shard concurrently and merges the results:
+
+    - Without grouping, the result is the union of the shard results.
+    - With `group_by`, hits are requested per group from every shard, the groups are merged by group ID and the
+      representative of each group is selected again across shards, using the `ranking_criteria_type` of the
+      request (e.g., the best `rcsb_entry_info.resolution_combined`). The ranking values of the shard
+      representatives are looked up with the Data API. Search scores are not comparable between shards, so
+      representatives ranked by score (the default without `ranking_criteria_type`) cannot be selected again:
+      such requests raise ValueError when they need more than one shard (requests returning full groups are
+      merged, with the hits of each group in shard order).
+
+The merged result contains the same IDs as the single query (their order may differ).
+
+Example:
+    from sharded_search import sharded_search
+
+    representatives = sharded_search(targets_search_query, shard_size=5_000)
+
+Requirements:
+    pip install requests
+"""
+
+import copy
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from search_pagination import iter_search_ids
+
+DATA_API_URL = "https://data.rcsb.org/graphql"
+
+DEFAULT_SHARD_SIZE = 5_000
+
+# Top-level attribute categories of polymer entities (all other categories are looked up on the entry)
+ENTITY_CATEGORY_PREFIXES = ("entity_", "rcsb_polymer_entity", "rcsb_entity_", "rcsb_cluster_", "pdbx_entity_")
+
+
+def _walk_terminals(node):
+    if node.get("type") == "terminal":
+        yield node
+    for child in node.get("nodes", []):
+        yield from _walk_terminals(child)
+
+
+def shard_request(search_request, shard_size=DEFAULT_SHARD_SIZE):
+    """Split the `in` value lists of a request that are longer than `shard_size`.
+
+    Returns:
+        list: one request per combination of shards (just a copy of `search_request` if nothing needs sharding)
+    """
+    oversized = [
+        i for i, node in enumerate(_walk_terminals(search_request["query"]))
+        if node.get("parameters", {}).get("operator") == "in" and len(node["parameters"].get("value", [])) > shard_size
+    ]
+    if not oversized:
+        return [copy.deepcopy(search_request)]
+
+    index = oversized[0]
+    terminal = list(_walk_terminals(search_request["query"]))[index]
+    if terminal["parameters"].get("negation"):
+        # NOT (x in A or B) is not the union of NOT (x in A) and NOT (x in B)
+        raise ValueError(f"Cannot shard negated 'in' query on {terminal['parameters'].get('attribute')}")
+
+    values = terminal["parameters"]["value"]
+    shards = []
+    for i in range(0, len(values), shard_size):
+        shard = copy.deepcopy(search_request)
+        list(_walk_terminals(shard["query"]))[index]["parameters"]["value"] = values[i:i + shard_size]
+        # Shard any other oversized lists as well
+        shards.extend(shard_request(shard, shard_size))
+    return shards
+
+
+def sharded_search(search_request, shard_size=DEFAULT_SHARD_SIZE, max_workers=4, url=None, data_api_url=DATA_API_URL, cache=None):
+    """Execute a search, splitting oversized `in` value lists into shards that run concurrently.
+
+    Args:
+        search_request (dict): Search API request body
+        shard_size (int): maximum number of values per `in` list
+        max_workers (int): number of shards to run concurrently
+        url (str, optional): Search API endpoint
+        data_api_url (str): Data API endpoint, used to look up ranking values of grouped results
+        cache (search_cache.SearchCache, optional): cache of search responses (shards are cached individually)
+
+    Returns:
+        list: result identifiers, or group dicts (with "identifier" and "result_set") if
+            `group_by_return_type` is "groups"
+
+    Raises:
+        ValueError: if the request cannot be sharded (a negated `in` list, or group representatives ranked by
+            score, size or count)
+    """
+    shards = shard_request(search_request, shard_size)
+    request_options = search_request.get("request_options", {})
+    group_by = request_options.get("group_by")
+    if len(shards) == 1:
+        return list(iter_search_ids(shards[0], url=url, cache=cache))
+
+    sort_by = ((group_by or {}).get("ranking_criteria_type") or {}).get("sort_by", "score")
+    if group_by and request_options.get("group_by_return_type") != "groups" and sort_by in ("score", "size", "count"):
+        # The representative of a group found by several shards would depend on which shard returned it first
+        raise ValueError(f"Cannot shard a grouped request whose representatives are ranked by {sort_by} (rank them by an attribute, or return groups)")
+
+    if group_by:
+        # Request the full groups from each shard, so that representatives can be selected again after merging
+        for shard in shards:
+            shard["request_options"]["group_by_return_type"] = "groups"
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        shard_results = list(executor.map(lambda shard: list(iter_search_ids(shard, url=url, cache=cache)), shards))
+
+    if not group_by:
+        return list(dict.fromkeys(hit for results in shard_results for hit in results))
+
+    groups = merge_groups(shard_results)
+    direction = (group_by.get("ranking_criteria_type") or {}).get("direction", "desc")
+    multi_shard_groups = {group_id: members for group_id, members in groups.items() if len(members) > 1}
+
+    if sort_by not in ("score", "size", "count") and multi_shard_groups:
+        if request_options.get("group_by_return_type") == "groups":
+            ids = [hit for members in multi_shard_groups.values() for shard_hits in members for hit in shard_hits]
+        else:
+            ids = [shard_hits[0] for members in multi_shard_groups.values() for shard_hits in members]
+        values = fetch_ranking_values(ids, sort_by, direction, search_request["return_type"], data_api_url, max_workers)
+        key = ranking_key(values, direction)
+    else:
+        # Scores are not comparable between shards; keep the order in which the shards returned the hits of a group
+        key = None
+
+    if request_options.get("group_by_return_type") == "groups":
+        merged = []
+        for group_id, members in groups.items():
+            hits = list(dict.fromkeys(hit for shard_hits in members for hit in shard_hits))
+            if key and len(members) > 1:
+                hits.sort(key=key)
+            merged.append({"identifier": group_id, "result_set": hits})
+        return merged
+
+    representatives = []
+    for members in groups.values():
+        candidates = [shard_hits[0] for shard_hits in members]
+        representatives.append(min(candidates, key=key) if key else candidates[0])
+    return representatives
+
+
+def merge_groups(shard_results):
+    """Merge the groups returned by each shard.
+
+    Returns:
+        dict: group ID -> list of the (ranked) hit IDs returned for that group by each shard
+    """
+    groups = {}
+    for results in shard_results:
+        for group in results:
+            hits = [hit if isinstance(hit, str) else hit["identifier"] for hit in group.get("result_set", [])]
+            if hits:
+                groups.setdefault(group["identifier"], []).append(hits)
+    return groups
+
+
+def ranking_key(values, direction):
+    """Sort key selecting the best hit first; hits without a value sort last and ties are broken by ID.
+
+    >>> values = {"1ABC": "2020-01-01", "2ABC": "2020-01-01T12:00:00", "3ABC": "2019-12-31", "4ABC": None}
+    >>> sorted(values, key=ranking_key(values, "desc"))
+    ['2ABC', '1ABC', '3ABC', '4ABC']
+    >>> sorted(values, key=ranking_key(values, "asc"))
+    ['3ABC', '1ABC', '2ABC', '4ABC']
+    """
+    def key(hit):
+        value = values.get(hit)
+        if value is None:
+            return (1, 0, hit)
+        return (0, value if direction == "asc" else _negate(value), hit)
+    return key
+
+
+def _negate(value):
+    if isinstance(value, str):
+        # e.g., dates: invert the characters so that later values sort first; the end of the string is marked with
+        # a value above any inverted character, so that a string sorts after the longer strings it is a prefix of
+        return tuple(-ord(c) for c in value) + (1,)
+    return -value
+
+
+def _graphql_selection(path):
+    selection = path[-1]
+    for field in reversed(path[:-1]):
+        selection = f"{field} {{ {selection} }}"
+    return selection
+
+
+def fetch_ranking_values(ids, attribute, direction, return_type, data_api_url=DATA_API_URL, max_workers=4, batch_size=1_000):
+    """Look up the value of a ranking attribute for entries or polymer entities with the Data API.
+
+    List-valued attributes are reduced like the Search API does when sorting: the smallest value for
+    ascending order and the largest value for descending order.
+
+    Returns:
+        dict: ID -> ranking value (None if missing)
+    """
+    path = attribute.split(".")
+    if return_type == "entry":
+        root, id_arg = "entries", "entry_ids"
+    elif return_type == "polymer_entity":
+        root, id_arg = "polymer_entities", "entity_ids"
+        if not path[0].startswith(ENTITY_CATEGORY_PREFIXES):
+            path = ["entry"] + path
+    else:
+        raise ValueError(f"Cannot look up ranking values for return type '{return_type}'")
+
+    query = f"query ranking($ids: [String!]!) {{ {root}({id_arg}: $ids) {{ rcsb_id {_graphql_selection(path)} }} }}"
+    session = requests.Session()
+
+    def fetch(batch):
+        response = session.post(data_api_url, json={"query": query, "variables": {"ids": batch}}, timeout=100)
+        response.raise_for_status()
+        return response.json()["data"][root] or []
+
+    unique_ids = list(dict.fromkeys(ids))
+    batches = [unique_ids[i:i + batch_size] for i in range(0, len(unique_ids), batch_size)]
+    values = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for records in executor.map(fetch, batches):
+            for record in records:
+                values[record["rcsb_id"]] = _reduce_value(_extract(record, path), direction)
+    session.close()
+    return values
+
+
+def _extract(record, path):
+    values = [record]
+    for field in path:
+        next_values = []
+        for value in values:
+            value = value.get(field) if isinstance(value, dict) else None
+            if isinstance(value, list):
+                next_values.extend(value)
+            elif value is not None:
+                next_values.append(value)
+        values = next_values
+    return values
+
+
+def _reduce_value(values, direction):
+    if not values:
+        return None
+    return min(values) if direction == "asc" else max(values)
@@ -0,0 +1,146 @@
+"""
+Shared on-disk cache of PDB structure files (mmCIF and BCIF by entry ID), so that scripts and notebooks that read
+the same entries download each file only once.
+
+Files are downloaded gzip-compressed, decompressed while they are being downloaded, and stored uncompressed (one
+file per entry and format). Reading a cached entry is then a memory-mapped read of a local file, served from the
+page cache when the file was used recently, without a download or a decompression. The cache is kept below
+`max_bytes` by evicting the least recently used files, and files are written atomically, so one cache directory
+can be shared by concurrent scripts.
+
+The cache directory defaults to ~/.cache/rcsb-structures and can be changed with the RCSB_STRUCTURE_CACHE
+environment variable; RCSB_STRUCTURE_CACHE_MB sets the size limit in MB (default 4096).
+
+Example:
+    from structure_cache import get_default_cache
+
+    cache = get_default_cache()
+    path = cache.path("4HHB", "bcif")          # e.g. for MarshalUtil().doImport(path, fmt="bcif")
+    with cache.open("4HHB", "cif") as content:  # read-only memory map of the mmCIF file
+        print(content[:40])
+
+Requirements:
+    pip install requests
+"""
+
+import contextlib
+import itertools
+import mmap
+import os
+import threading
+import zlib
+import requests
+
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "rcsb-structures")
+DEFAULT_CACHE_MAX_MB = 4096
+
+# Download URL of each format
+FORMAT_URLS = {
+    "cif": "https://files.rcsb.org/download/{}.cif.gz",
+    "bcif": "https://models.rcsb.org/{}.bcif.gz",
+}
+
+
+class StructureCache:
+    """Cache of decompressed mmCIF and BCIF files of PDB entries, stored as <ENTRY ID>.<format> files."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_MB * 2**20, session=None):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.session = session or requests.Session()
+
+    def _path(self, entry_id, fmt):
+        if fmt not in FORMAT_URLS:
+            raise ValueError(f"Unknown format '{fmt}' (available: {', '.join(FORMAT_URLS)})")
+        return os.path.join(self.cache_dir, f"{entry_id.upper()}.{fmt}")
+
+    def contains(self, entry_id, fmt="cif"):
+        return os.path.exists(self._path(entry_id, fmt))
+
+    def path(self, entry_id, fmt="cif"):
+        """Return the path of the decompressed file of an entry, downloading it if it is not cached.
+
+        Another process sharing the cache may evict the file before it is opened; `open` downloads it again then.
+        """
+        path = self._path(entry_id, fmt)
+        try:
+            # The modification time of a file records when it was last used
+            os.utime(path)
+        except FileNotFoundError:
+            self._download(FORMAT_URLS[fmt].format(entry_id.upper()), path)
+            self.evict(keep=path)
+        return path
+
+    def resolve(self, value, fmt="cif"):
+        """Return `value` if it is a local file, or else the cached file of the entry ID `value`."""
+        return value if os.path.isfile(value) else self.path(value, fmt)
+
+    @contextlib.contextmanager
+    def open(self, entry_id, fmt="cif"):
+        """Memory-map the file of an entry (read-only), downloading it if it is not cached."""
+        try:
+            f = open(self.path(entry_id, fmt), "rb")
+        except FileNotFoundError:
+            # Evicted by another process between path() and open(): download it again
+            f = open(self.path(entry_id, fmt), "rb")
+        with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            yield content
+
+    def _download(self, url, path):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with self.session.get(url, stream=True, timeout=120) as response:
+                response.raise_for_status()
+                chunks = response.iter_content(chunk_size=1 << 20)
+                first = next(chunks, b"")
+                # Files sent with Content-Encoding: gzip arrive already decompressed by requests
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if first[:2] == b"\x1f\x8b" else None
+                with open(tmp_path, "wb") as f:
+                    for chunk in itertools.chain([first], chunks):
+                        f.write(decompressor.decompress(chunk) if decompressor else chunk)
+                    if decompressor:
+                        f.write(decompressor.flush())
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def evict(self, keep=None):
+        """Remove the least recently used files (except `keep`) until the cache is within `max_bytes`."""
+        entries = []
+        total = 0
+        for item in os.scandir(self.cache_dir):
+            if item.name.endswith(tuple(f".{fmt}" for fmt in FORMAT_URLS)):
+                try:
+                    stat = item.stat()
+                except FileNotFoundError:
+                    # Evicted by another process during the scan
+                    continue
+                total += stat.st_size
+                if item.path != keep:
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                # Scripts that have the file memory-mapped keep reading it until they close it
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for item in os.scandir(self.cache_dir):
+            if item.name.endswith(tuple(f".{fmt}" for fmt in FORMAT_URLS)):
+                try:
+                    os.remove(item.path)
+                except FileNotFoundError:
+                    pass
+
+
+def get_default_cache():
+    """Return the cache configured by the RCSB_STRUCTURE_CACHE and RCSB_STRUCTURE_CACHE_MB environment variables."""
+    cache_dir = os.environ.get("RCSB_STRUCTURE_CACHE", DEFAULT_CACHE_DIR)
+    max_mb = float(os.environ.get("RCSB_STRUCTURE_CACHE_MB", DEFAULT_CACHE_MAX_MB))
+    return StructureCache(cache_dir, max_bytes=int(max_mb * 2**20))
@@ -0,0 +1,264 @@
+"""
+This script converts a directory tree of mmCIF files (e.g. an archive of in-house models) to gzipped BCIF files,
+using all CPU cores.
+
+General workflow:
+    - The input tree is walked lazily, and each mmCIF file (.cif, .mmcif, optionally gzipped) is mapped to an output
+      file with the same relative path under the output directory (<name>.bcif.gz, or <name>.bcif with --no-compress)
+    - Files whose output is up to date are skipped without being read (see "Up-to-date checks" below)
+    - The other files are converted by a pool of worker processes. Each worker loads the compiled DictionaryApi once
+      (from the cache of dictionary_cache.py in this folder, so that starting a worker takes milliseconds), parses
+      files with the C++ mmCIF parser (IoAdapterCore), encodes them with BinaryCifWriter and gzip-compresses the
+      result in the same task, before moving it into place atomically
+    - A manifest in the output directory (.bcif-manifest.tsv) records the SHA-256, size and modification time of each
+      converted input file, and an optional CSV report lists the time, input and output sizes and compression ratio
+      of every file
+
+Up-to-date checks (--check):
+    - mtime (default): an output newer than its input is up to date
+    - hash: an output is up to date if its input has the SHA-256 recorded in the manifest. Inputs with the same size
+      and modification time as recorded are not even read; the others are hashed by the workers, and only converted
+      if their content changed (e.g. files that were only touched or copied again are skipped)
+
+Requirements:
+    pip install mmcif requests
+
+Usage:
+    python convert_to_bcif.py models/ models_bcif/
+    python convert_to_bcif.py models/ models_bcif/ --workers 32 --check hash --report conversion.csv
+    python convert_to_bcif.py models/ models_bcif/ --no-dictionary   # rely on the type detection of mmcif >= 1.2
+Output:
+    BCIF files under the output directory, and a per-file CSV report (--report)
+
+"""
+
+import argparse
+import csv
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dictionary_cache import DICTIONARY_URLS, load_dictionary_api
+
+INPUT_SUFFIXES = (".cif", ".cif.gz", ".mmcif", ".mmcif.gz")
+MANIFEST_NAME = ".bcif-manifest.tsv"
+REPORT_FIELDS = ["input", "output", "status", "seconds", "cpu_seconds", "input_bytes", "output_bytes", "ratio", "error"]
+
+# State of each worker process, set up once by init_worker
+_worker = {}
+
+
+def output_path(input_path, input_dir, output_dir, compress=True):
+    """Return the output path of an input file: same relative path, with a .bcif(.gz) suffix."""
+    relative = os.path.relpath(input_path, input_dir)
+    for suffix in INPUT_SUFFIXES:
+        if relative.endswith(suffix):
+            relative = relative[:-len(suffix)]
+            break
+    return os.path.join(output_dir, relative + (".bcif.gz" if compress else ".bcif"))
+
+
+def iter_input_files(input_dir, output_dir):
+    """Lazily yield the mmCIF files of a directory tree (in sorted order, skipping the output directory)."""
+    output_dir = os.path.abspath(output_dir)
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != output_dir)
+        for name in sorted(files):
+            if name.endswith(INPUT_SUFFIXES):
+                yield os.path.join(root, name)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(path):
+    """Return the manifest as a dict of relative input path -> (sha256, size, mtime_ns); later lines win."""
+    manifest = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 4:
+                    manifest[fields[0]] = (fields[1], int(fields[2]), int(fields[3]))
+    except FileNotFoundError:
+        pass
+    return manifest
+
+
+def init_worker(dictionaries, compress_level, tmp_dir):
+    from mmcif.io.BinaryCifWriter import BinaryCifWriter
+    from mmcif.io.IoAdapterCore import IoAdapterCore
+
+    # The parent process compiled the dictionary, so this only loads the pickle (without checking for updates)
+    dictionary_api = load_dictionary_api(dictionaries, compact=True, check_interval=float("inf")) if dictionaries else None
+    _worker["reader"] = IoAdapterCore()
+    _worker["writer"] = BinaryCifWriter(dictionaryApi=dictionary_api)
+    # Scratch space of the C++ parser (decompressed inputs) and of the encoder, removed by the parent process
+    _worker["tmp_dir"] = tempfile.mkdtemp(dir=tmp_dir)
+    _worker["compress_level"] = compress_level
+
+
+def convert_file(input_path, out_path, expected_sha256=None):
+    """Convert one file in a worker process and return its report row (without the input/output paths)."""
+    s_time, s_cpu = time.time(), time.process_time()
+    row = {"status": "converted", "input_bytes": os.path.getsize(input_path), "output_bytes": None, "sha256": None, "error": ""}
+    tmp_out = None
+    try:
+        row["sha256"] = file_sha256(input_path)
+        if expected_sha256 is not None and row["sha256"] == expected_sha256 and os.path.exists(out_path):
+            row["status"] = "unchanged"
+            row["output_bytes"] = os.path.getsize(out_path)
+            return row
+
+        containers = _worker["reader"].readFile(input_path, outDirPath=_worker["tmp_dir"])
+        if not containers:
+            raise ValueError("no data blocks could be read")
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        tmp_out = f"{out_path}.{os.getpid()}.tmp"
+        if out_path.endswith(".gz"):
+            # BinaryCifWriter only writes to a path: encode to a scratch file, then stream it through gzip into place
+            bcif_path = os.path.join(_worker["tmp_dir"], "data.bcif")
+            if not _worker["writer"].serialize(bcif_path, containers):
+                raise ValueError("BCIF encoding failed")
+            with open(bcif_path, "rb") as f_in, gzip.GzipFile(tmp_out, "wb", compresslevel=_worker["compress_level"], mtime=0) as f_out:
+                shutil.copyfileobj(f_in, f_out, 1 << 20)
+            os.remove(bcif_path)
+        elif not _worker["writer"].serialize(tmp_out, containers):
+            raise ValueError("BCIF encoding failed")
+        os.replace(tmp_out, out_path)
+        row["output_bytes"] = os.path.getsize(out_path)
+    except Exception as e:
+        row["status"] = "failed"
+        row["error"] = str(e) or type(e).__name__
+        if tmp_out and os.path.exists(tmp_out):
+            os.remove(tmp_out)
+    finally:
+        row["seconds"] = round(time.time() - s_time, 4)
+        row["cpu_seconds"] = round(time.process_time() - s_cpu, 4)
+    return row
+
+
+def iter_tasks(input_dir, output_dir, compress, check, manifest, skipped):
+    """Yield (input path, output path, expected SHA-256) of the files to convert; count up-to-date files in `skipped`."""
+    for input_path in iter_input_files(input_dir, output_dir):
+        out_path = output_path(input_path, input_dir, output_dir, compress)
+        try:
+            out_stat = os.stat(out_path)
+        except FileNotFoundError:
+            yield input_path, out_path, None
+            continue
+        in_stat = os.stat(input_path)
+        if check == "mtime":
+            if out_stat.st_mtime_ns >= in_stat.st_mtime_ns:
+                skipped.append(input_path)
+                continue
+            yield input_path, out_path, None
+        else:
+            recorded = manifest.get(os.path.relpath(input_path, input_dir))
+            if recorded and recorded[1:] == (in_stat.st_size, in_stat.st_mtime_ns):
+                skipped.append(input_path)
+                continue
+            yield input_path, out_path, recorded[0] if recorded else None
+
+
+def convert_tree(input_dir, output_dir, workers=None, check="mtime", compress=True, compress_level=6, dictionaries=DICTIONARY_URLS, report_path=None, verbose=True):
+    """Convert all mmCIF files under `input_dir` and return counts of converted, unchanged, skipped and failed files."""
+    workers = workers or os.cpu_count()
+    os.makedirs(output_dir, exist_ok=True)
+    if dictionaries:
+        # Compile (or refresh) the dictionary once, so that every worker loads it from the cache
+        load_dictionary_api(dictionaries, compact=True)
+
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = read_manifest(manifest_path)
+    skipped = []
+    tasks = iter_tasks(input_dir, output_dir, compress, check, manifest, skipped)
+    stats = {"converted": 0, "unchanged": 0, "failed": 0, "input_bytes": 0, "output_bytes": 0, "cpu_seconds": 0.0}
+
+    report_file = open(report_path, "w", newline="") if report_path else None
+    report = csv.DictWriter(report_file, fieldnames=REPORT_FIELDS, extrasaction="ignore") if report_file else None
+    if report:
+        report.writeheader()
+    s_time = time.time()
+    try:
+        with tempfile.TemporaryDirectory(prefix="bcif-") as tmp_dir, open(manifest_path, "a") as manifest_file, \
+                ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(dictionaries, compress_level, tmp_dir)) as executor:
+            in_flight = {}
+
+            def submit_next():
+                task = next(tasks, None)
+                if task is not None:
+                    in_flight[executor.submit(convert_file, *task)] = task
+                return task is not None
+
+            # Keep a few tasks per worker queued, without listing the whole tree up front
+            while len(in_flight) < 4 * workers and submit_next():
+                pass
+            processed = 0
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    input_path, out_path, _ = in_flight.pop(future)
+                    row = future.result()
+                    row.update(input=input_path, output=out_path)
+                    stats[row["status"]] += 1
+                    stats["cpu_seconds"] += row["cpu_seconds"]
+                    if row["status"] == "failed":
+                        if verbose:
+                            print(f"failed: {input_path}: {row['error']}")
+                    else:
+                        in_stat = os.stat(input_path)
+                        manifest_file.write(f"{os.path.relpath(input_path, input_dir)}\t{row['sha256']}\t{in_stat.st_size}\t{in_stat.st_mtime_ns}\n")
+                        if row["status"] == "converted":
+                            stats["input_bytes"] += row["input_bytes"]
+                            stats["output_bytes"] += row["output_bytes"]
+                        row["ratio"] = round(row["output_bytes"] / row["input_bytes"], 4) if row["input_bytes"] else None
+                    if report:
+                        report.writerow(row)
+                    processed += 1
+                    if verbose and processed % 1000 == 0:
+                        print(f"{processed} files processed, {len(skipped)} up to date ({processed / (time.time() - s_time):.1f} files/s)")
+                    submit_next()
+    finally:
+        if report_file:
+            report_file.close()
+
+    stats["skipped"] = len(skipped)
+    stats["seconds"] = time.time() - s_time
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a directory tree of mmCIF files to BCIF in parallel.")
+    parser.add_argument("input_dir", help="Directory tree of mmCIF files (.cif, .mmcif, optionally gzipped)")
+    parser.add_argument("output_dir", help="Output directory (the input tree is mirrored)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: number of CPUs, %(default)s)")
+    parser.add_argument("--check", choices=("mtime", "hash"), default="mtime", help="How to detect up-to-date outputs (default: %(default)s)")
+    parser.add_argument("--no-compress", action="store_true", help="Write plain .bcif files instead of .bcif.gz")
+    parser.add_argument("--compress-level", type=int, default=6, help="gzip compression level (default: %(default)s)")
+    parser.add_argument("--dictionary", action="append", help="Dictionary file or URL (repeatable; default: PDBx/mmCIF and ModelCIF dictionaries)")
+    parser.add_argument("--no-dictionary", action="store_true", help="Do not load a dictionary, rely on the column type detection of mmcif >= 1.2")
+    parser.add_argument("--report", help="CSV file with the time, sizes and compression ratio of each file")
+    args = parser.parse_args()
+
+    dictionaries = None if args.no_dictionary else tuple(args.dictionary or DICTIONARY_URLS)
+    stats = convert_tree(
+        args.input_dir, args.output_dir, workers=args.workers, check=args.check, compress=not args.no_compress,
+        compress_level=args.compress_level, dictionaries=dictionaries, report_path=args.report
+    )
+
+    print(f"converted {stats['converted']} files, {stats['unchanged']} unchanged, {stats['skipped']} up to date, {stats['failed']} failed")
+    if stats["input_bytes"]:
+        print(f"input {stats['input_bytes'] / 2**20:.1f} MB -> output {stats['output_bytes'] / 2**20:.1f} MB (ratio {stats['output_bytes'] / stats['input_bytes']:.3f})")
+    if stats["converted"]:
+        # With enough cores, the CPU time of all conversions divided by the elapsed time approaches the number of workers
+        print(f"{stats['cpu_seconds']:.1f} s of CPU time in {stats['seconds']:.1f} s with {args.workers} workers (speed-up {stats['cpu_seconds'] / stats['seconds']:.1f}x)")
+    print(f"Total execution time: {stats['seconds']:.4f} seconds")
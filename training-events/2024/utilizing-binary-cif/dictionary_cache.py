@@ -0,0 +1,188 @@
+"""
+Persistent cache of the compiled `DictionaryApi` used to export BCIF files with MarshalUtil or BinaryCifWriter.
+
+This is a copy of example-use-cases/structures/dictionary_cache.py, so that the material of this course runs on its
+own; both copies share the same cache directory and file layout.
+
+Building a DictionaryApi means downloading the PDBx/mmCIF dictionary and the ModelCIF extension dictionary,
+parsing them with IoAdapterPy and consolidating them, which takes tens of seconds. This module does it once:
+    - dictionary files are kept in the cache directory and checked for updates at most once a day, with
+      conditional requests (ETag/Last-Modified), so an unchanged dictionary is not downloaded again
+    - the compiled dictionary is pickled under a key made of the SHA-256 of the dictionary contents and the mmcif
+      version, so a new dictionary release (or mmcif version) is compiled once and older pickles are removed
+
+Two forms are cached:
+    - `load_dictionary_api()`: the complete DictionaryApi
+    - `load_dictionary_api(compact=True)`: an `ItemTypeTable` with only the item types and mandatory codes, which
+      is all BCIF export uses (`getTypeCode`, `getTypePrimitive` and `getMandatoryCode`). It loads in milliseconds
+      and can be passed as `dictionaryApi` to MarshalUtil.doExport or BinaryCifWriter.
+
+The cache directory defaults to ~/.cache/rcsb-dictionaries and can be changed with the RCSB_DICTIONARY_CACHE
+environment variable. Recent mmcif versions detect column types automatically and only fall back on the
+dictionary for empty columns, but older versions (and `useAutoDetect=False`) need it for every export.
+
+Example:
+    from dictionary_cache import load_dictionary_api
+
+    dictionaryApi = load_dictionary_api(compact=True)
+    mU.doExport("4HHB.bcif", dataContainerList, fmt="bcif", dictionaryApi=dictionaryApi)
+
+Requirements:
+    pip install mmcif requests
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+from importlib.metadata import PackageNotFoundError, version
+import requests
+
+DEFAULT_CACHE_DIR = os.environ.get("RCSB_DICTIONARY_CACHE", os.path.join("~", ".cache", "rcsb-dictionaries"))
+
+# PDBx/mmCIF dictionary and CSM extension (ModelCIF) dictionary
+DICTIONARY_URLS = (
+    "https://raw.githubusercontent.com/wwpdb-dictionaries/mmcif_pdbx/master/dist/mmcif_pdbx_v5_next.dic",
+    "https://raw.githubusercontent.com/ihmwg/ModelCIF/master/dist/mmcif_ma_ext.dic",
+)
+
+# Minimum time between update checks of a downloaded dictionary (seconds)
+CHECK_INTERVAL = 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+
+class ItemTypeTable:
+    """Item types and mandatory codes of a DictionaryApi, i.e. the part of it used for BCIF export."""
+
+    def __init__(self, items, type_primitives):
+        # (category, attribute) -> (type code, mandatory code)
+        self._items = items
+        # type code -> primitive type ("char", "uchar" or "numb")
+        self._type_primitives = type_primitives
+
+    @classmethod
+    def from_dictionary_api(cls, dictionary_api):
+        items = {}
+        type_primitives = {}
+        for category in dictionary_api.getCategoryList():
+            for attribute in dictionary_api.getAttributeNameList(category) or []:
+                type_code = dictionary_api.getTypeCode(category, attribute)
+                items[(category, attribute)] = (type_code, dictionary_api.getMandatoryCode(category, attribute))
+                if type_code not in type_primitives:
+                    type_primitives[type_code] = dictionary_api.getTypePrimitive(category, attribute)
+        return cls(items, type_primitives)
+
+    def getTypeCode(self, category, attribute):
+        return self._items.get((category, attribute), (None, None))[0]
+
+    def getTypePrimitive(self, category, attribute):
+        return self._type_primitives.get(self.getTypeCode(category, attribute))
+
+    def getMandatoryCode(self, category, attribute):
+        return self._items.get((category, attribute), (None, None))[1]
+
+
+def fetch_dictionary(location, cache_dir=DEFAULT_CACHE_DIR, check_interval=CHECK_INTERVAL, session=None):
+    """Return a local path of a dictionary file or URL, downloading it (or an update of it) to `cache_dir`."""
+    if not location.startswith(("http://", "https://")):
+        return location
+    cache_dir = os.path.expanduser(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, os.path.basename(location))
+    meta_path = f"{path}.json"
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = {}
+    if os.path.exists(path) and meta.get("url") == location and time.time() - meta.get("checked", 0) < check_interval:
+        return path
+
+    headers = {}
+    if os.path.exists(path) and meta.get("url") == location:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    try:
+        response = (session or requests).get(location, headers=headers, timeout=120)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        if os.path.exists(path):
+            logger.warning("Could not check %s for updates (%s), using the cached copy", location, e)
+            return path
+        raise
+    if response.status_code != 304:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(response.content)
+        os.replace(tmp_path, path)
+        meta = {"url": location}
+    # A 304 response may leave out the validators of the cached copy
+    meta.update({key: response.headers[header] for key, header in (("etag", "ETag"), ("last_modified", "Last-Modified")) if header in response.headers})
+    meta["checked"] = time.time()
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    return path
+
+
+def _dictionary_key(dictionaries, paths, compact):
+    """Key of a compiled dictionary: its form, and hashes of the dictionary locations and of their contents."""
+    locations = hashlib.sha256("\n".join(dictionaries).encode()).hexdigest()[:8]
+    # Pickles of DictionaryApi objects may not load with another mmcif version
+    digest = hashlib.sha256()
+    try:
+        digest.update(version("mmcif").encode())
+    except PackageNotFoundError:
+        pass
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return f"{'item-types' if compact else 'dictionary-api'}-{locations}-{digest.hexdigest()[:24]}"
+
+
+def build_dictionary_api(paths):
+    """Parse dictionary files and build a consolidated DictionaryApi (the slow path, without cache)."""
+    from mmcif.api.DictionaryApi import DictionaryApi
+    from mmcif.io.IoAdapterPy import IoAdapterPy as IoAdapter
+
+    io_adapter = IoAdapter(raiseExceptions=True)
+    container_list = []
+    for path in paths:
+        container_list += io_adapter.readFile(inputFilePath=path)
+    return DictionaryApi(containerList=container_list, consolidate=True)
+
+
+def load_dictionary_api(dictionaries=DICTIONARY_URLS, compact=False, cache_dir=DEFAULT_CACHE_DIR, check_interval=CHECK_INTERVAL):
+    """Return the compiled DictionaryApi (or ItemTypeTable if `compact`) of dictionary files or URLs, from the cache
+    if it was already compiled.
+    """
+    cache_dir = os.path.expanduser(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    paths = [fetch_dictionary(location, cache_dir, check_interval) for location in dictionaries]
+    key = _dictionary_key(dictionaries, paths, compact)
+    pickle_path = os.path.join(cache_dir, f"{key}.pickle")
+    try:
+        with open(pickle_path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        logger.warning("Ignoring unreadable compiled dictionary %s (%s)", pickle_path, e)
+
+    dictionary_api = build_dictionary_api(paths)
+    compiled = ItemTypeTable.from_dictionary_api(dictionary_api) if compact else dictionary_api
+    tmp_path = f"{pickle_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, pickle_path)
+    # Compiled versions of older releases of the same dictionaries are no longer needed
+    prefix = key.rsplit("-", 1)[0]
+    for item in os.scandir(cache_dir):
+        if item.name.startswith(f"{prefix}-") and item.name.endswith(".pickle") and item.name != f"{key}.pickle":
+            os.remove(item.path)
+    return compiled
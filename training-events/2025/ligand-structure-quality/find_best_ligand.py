@@ -7,13 +7,17 @@ This script allows use of "copy-and-paste" from RCSB.org API query editors for p
 
 The process includes 3 steps:
 Step 1: Search for CCD IDs by name, then choose the first matched CCD ID
-Step 2: Search for PDB IDs with the CCD ID from step 1
-Step 3: Retrieve ligand quality metrics for each PDB entry, returns the PDB ID
-with the best fitted ligand
+Step 2: Search for PDB IDs with the CCD ID from step 1, paging through all hits
+(with `iter_search_ids` from ligand_quality.py in this folder)
+Step 3: Retrieve ligand quality metrics for the PDB entries in concurrent batches
+of entries (multi-entry Data API queries over one pooled HTTP session), returns
+the PDB ID with the best fitted ligand
+
+Requests are sent over one HTTP session, which retries rate-limited (429) and
+server error (5xx) responses.
 
 Requirements:
     pip install requests
-    pip install python_graphql_client
 
 Usage:
     python find_best_ligand.py
@@ -22,10 +26,11 @@ Output:
 
 """
 
-import json
 import requests
 import sys
-from python_graphql_client import GraphqlClient
+from concurrent.futures import ThreadPoolExecutor
+from ligand_quality import create_session, iter_search_ids
+
 
 ## Step 1: Search for CCD IDs by name, then choose the first matched CCD ID
 
@@ -115,34 +120,40 @@ payload_pdb_search = {
     },
 }
 
-# send POST request
-response_pdb = requests.post(search_api_url, json=payload_pdb_search)
+# create one HTTP session for all subsequent requests (8 concurrent connections, retrying 429 and 5xx responses)
+session = create_session(8)
+executor = ThreadPoolExecutor(max_workers=8)
 
-# check response
-if response_pdb.status_code == 200:
-    results_pdb = response_pdb.json()
-else:
-    print(f"Error {response_pdb.status_code}: {response_pdb.text}")
+
+def exit_with_error(error):
+    if isinstance(error, requests.HTTPError):
+        print(f"Error {error.response.status_code}: {error.response.text}")
+    else:
+        # e.g. connection errors, or a RetryError once 429/5xx responses have been retried
+        print(f"Error: {error}")
+    executor.shutdown(wait=False, cancel_futures=True)
     sys.exit()
 
-# retrieve PDB IDs from response
-l_pdb_id = []
-for each in results_pdb["result_set"]:
-    l_pdb_id.append(each["identifier"])
+
+# retrieve PDB IDs from all pages of results (the "paginate" option above is replaced for each page)
+try:
+    l_pdb_id = list(iter_search_ids(payload_pdb_search, session=session, url=search_api_url))
+except requests.RequestException as error:
+    exit_with_error(error)
 print(f"found {len(l_pdb_id)} PDB entries with {ccd_id}")
 
 
 ## Step 3: Retrieve ligand quality metrics for each PDB entry, returns the PDB ID with the best fitted ligand
 
-# define data API end point and initate query client
+# define data API end point
 data_api_url = "https://data.rcsb.org/graphql"
-client = GraphqlClient(endpoint = data_api_url)
 
-# provide query to retrieve ligand quality metrics
+# provide query to retrieve ligand quality metrics for a batch of PDB entries
 # (copy and paste from RCSB.org Data API query editor)
 ligand_query = """
-query test($pdb_id: String!) {
-  entry(entry_id:$pdb_id){
+query test($ids: [String!]!) {
+  entries(entry_ids:$ids){
+    rcsb_id
     nonpolymer_entities {
       nonpolymer_entity_instances {
         rcsb_nonpolymer_instance_validation_score {
@@ -166,27 +177,44 @@ query test($pdb_id: String!) {
 }
 """
 
-# review each PDB entry for best fitted ligand
+
+def fetch_entries(pdb_ids):
+    # send POST request for one batch of PDB entries
+    response = session.post(data_api_url, json={"query": ligand_query, "variables": {"ids": pdb_ids}}, timeout=120)
+    response.raise_for_status()
+    return response.json()["data"]["entries"] or []
+
+
+# review each PDB entry for best fitted ligand, as each batch of entries arrives
+# (batches of 200 entries, 8 batches at a time)
+pdb_id_batches = [l_pdb_id[i:i + 200] for i in range(0, len(l_pdb_id), 200)]
 pdb_id_best = None
 best_score = 0
-for pdb_id in l_pdb_id:
-    print(f"checking ligand quality in {pdb_id}")
-    ligand_query_var = {"pdb_id": pdb_id}
-    ligand_data = client.execute(query=ligand_query, variables=ligand_query_var)
-    if ligand_data["data"]["entry"]["nonpolymer_entities"]:
-        for each_entity in ligand_data["data"]["entry"]["nonpolymer_entities"]:
-            for each_instance in each_entity["nonpolymer_entity_instances"]:
-                ligand_id = each_instance["rcsb_nonpolymer_instance_annotation"][0][
-                    "comp_id"
-                ]
-                if ligand_id.upper() == ccd_id.upper():
-                    scores = each_instance["rcsb_nonpolymer_instance_validation_score"]
-                    if scores:
-                        score_1 = scores[0]
-                        ranking_model_fit = score_1["ranking_model_fit"]
-                        if ranking_model_fit and ranking_model_fit > best_score:
-                            best_score = ranking_model_fit
-                            pdb_id_best = pdb_id
+n_checked = 0
+try:
+    for entry_batch in executor.map(fetch_entries, pdb_id_batches):
+        for entry in entry_batch:
+            pdb_id = entry["rcsb_id"]
+            if entry["nonpolymer_entities"]:
+                for each_entity in entry["nonpolymer_entities"]:
+                    for each_instance in each_entity["nonpolymer_entity_instances"]:
+                        ligand_id = each_instance["rcsb_nonpolymer_instance_annotation"][0][
+                            "comp_id"
+                        ]
+                        if ligand_id.upper() == ccd_id.upper():
+                            scores = each_instance["rcsb_nonpolymer_instance_validation_score"]
+                            if scores:
+                                score_1 = scores[0]
+                                ranking_model_fit = score_1["ranking_model_fit"]
+                                if ranking_model_fit and ranking_model_fit > best_score:
+                                    best_score = ranking_model_fit
+                                    pdb_id_best = pdb_id
+        n_checked += len(entry_batch)
+        print(f"checked ligand quality in {n_checked} of {len(l_pdb_id)} PDB entries")
+except requests.RequestException as error:
+    exit_with_error(error)
+executor.shutdown()
+session.close()
 
 # print result at the terminal
 print(f"PDB entry {pdb_id_best} has the best fitted MX ligand structure for {ccd_id} at {best_score*100}%")
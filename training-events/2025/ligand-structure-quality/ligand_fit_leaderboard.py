@@ -0,0 +1,84 @@
+"""
+This script finds the best fitted MX ligand structures for every ligand (CCD ID) in the PDB archive, in a single
+pass over the archive, instead of one search per ligand as in find_best_ligand.py.
+
+The process includes 3 steps, which run concurrently as a stream:
+Step 1: Page through the PDB entries with non-covalently linked ligands (the next page is fetched in the background)
+Step 2: Retrieve ligand quality metrics for these entries in concurrent multi-entry Data API batches
+Step 3: Keep the top-k instances by ranking_model_fit for each CCD ID in a heap, as each batch arrives
+
+Requirements:
+    pip install requests
+
+Usage:
+    python ligand_fit_leaderboard.py --top-k 5 --output ligand_leaderboard.csv
+    python ligand_fit_leaderboard.py --max-entries 2000   # quick trial on part of the archive
+Output:
+    CSV file with one row per CCD ID and rank (ccd_id, rank, entry_id, asym_id, ranking_model_fit)
+
+"""
+
+import argparse
+import csv
+import heapq
+import time
+from ligand_quality import ENTRY_BATCH_SIZE, MAX_WORKERS, create_session, iter_ligand_instances, iter_search_ids, non_covalent_ligand_request
+
+
+def update_leaderboard(leaderboard, instances, top_k, metric="ranking_model_fit"):
+    """Add ligand instances to the per-CCD min-heaps of the `top_k` best (metric, entry ID, asym ID) tuples."""
+    for instance in instances:
+        score = instance[metric]
+        if score is None:
+            continue
+        heap = leaderboard.setdefault(instance["comp_id"], [])
+        item = (score, instance["entry_id"], instance["asym_id"] or "")
+        if len(heap) < top_k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+
+def build_leaderboard(top_k=5, max_entries=None, batch_size=ENTRY_BATCH_SIZE, max_workers=MAX_WORKERS, metric="ranking_model_fit"):
+    """Sweep the archive once and return the leaderboard (CCD ID -> heap) and the number of entries checked."""
+    session = create_session(max_workers + 1)
+    counts = {"entries": 0}
+
+    def entry_ids():
+        for entry_id in iter_search_ids(non_covalent_ligand_request(), max_hits=max_entries, session=session):
+            counts["entries"] += 1
+            yield entry_id
+
+    leaderboard = {}
+    try:
+        update_leaderboard(leaderboard, iter_ligand_instances(entry_ids(), batch_size=batch_size, max_workers=max_workers, session=session), top_k, metric)
+    finally:
+        session.close()
+    return leaderboard, counts["entries"]
+
+
+def write_leaderboard(leaderboard, path, metric="ranking_model_fit"):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ccd_id", "rank", "entry_id", "asym_id", metric])
+        for ccd_id in sorted(leaderboard):
+            for rank, (score, entry_id, asym_id) in enumerate(sorted(leaderboard[ccd_id], reverse=True), start=1):
+                writer.writerow([ccd_id, rank, entry_id, asym_id, score])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the best fitted ligand instances for every CCD ID in one archive sweep.")
+    parser.add_argument("--top-k", type=int, default=5, help="Number of instances to keep per CCD ID (default: %(default)s)")
+    parser.add_argument("--output", default="ligand_leaderboard.csv", help="Output CSV file (default: %(default)s)")
+    parser.add_argument("--max-entries", type=int, help="Only check this many entries (for a quick trial)")
+    parser.add_argument("--batch-size", type=int, default=ENTRY_BATCH_SIZE, help="Entries per Data API request (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Concurrent Data API requests (default: %(default)s)")
+    args = parser.parse_args()
+
+    s_time = time.time()
+    leaderboard, n_entries = build_leaderboard(top_k=args.top_k, max_entries=args.max_entries, batch_size=args.batch_size, max_workers=args.workers)
+    write_leaderboard(leaderboard, args.output)
+
+    print(f"checked {n_entries} PDB entries, found fitted instances of {len(leaderboard)} CCD IDs")
+    print(f"leaderboard written to {args.output}")
+    print(f"Total execution time: {time.time() - s_time:.4f} seconds")
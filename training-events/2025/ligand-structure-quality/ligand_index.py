@@ -0,0 +1,203 @@
+"""
+This script keeps a local index of the validation metrics of every non-covalently linked ligand instance in the
+PDB archive, so that "best ligand for X" lookups are local queries instead of a CCD search, an entry search and a
+Data API query each time.
+
+The index is an SQLite database with one row per ligand instance (CCD ID, PDB ID, asym ID and the
+`rcsb_nonpolymer_instance_validation_score` metrics), indexed by CCD ID. It is built once from all entries with
+non-covalently linked ligands (the HAS_NO_COVALENT_LINKAGE filter of find_best_ligand.py), and then refreshed
+incrementally after each weekly PDB release:
+    - entries revised since the last refresh and entries not yet in the index are (re)fetched
+    - entries that no longer match the search (e.g. obsoleted entries) are removed
+Fetched entries are written batch by batch, so an interrupted refresh resumes where it stopped.
+
+Requirements:
+    pip install requests
+
+Usage:
+    python ligand_index.py refresh            # build the index, or bring it up to date
+    python ligand_index.py best IBP --top 5   # best fitted instances of IBP
+    python ligand_index.py best IBP --metric RSR
+Output:
+    Best ligand instances displayed on the terminal
+
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+from ligand_quality import (
+    ENTRY_BATCH_SIZE, MAX_WORKERS, METRIC_DIRECTIONS, VALIDATION_FIELDS, create_session, current_release, iter_entry_batches, iter_search_ids,
+    ligand_instances, non_covalent_ligand_request
+)
+
+DEFAULT_INDEX = os.environ.get("RCSB_LIGAND_INDEX", os.path.join("~", ".cache", "rcsb-ligands", "ligand_index.sqlite"))
+
+
+def revised_entries_request(since):
+    """Search request for the entries with non-covalently linked ligands revised on or after `since` (YYYY-MM-DD)."""
+    request = non_covalent_ligand_request()
+    request["query"] = {
+        "type": "group",
+        "logical_operator": "and",
+        "nodes": [
+            request["query"],
+            {
+                "type": "terminal",
+                "service": "text",
+                "parameters": {
+                    "attribute": "rcsb_accession_info.revision_date",
+                    "operator": "greater_or_equal",
+                    "value": since,
+                },
+            },
+        ],
+    }
+    return request
+
+
+class LigandIndex:
+    """Local SQLite index of ligand instance validation metrics.
+
+    Args:
+        path (str): SQLite database file (":memory:" for an index that only lasts for the current run)
+    """
+
+    def __init__(self, path=DEFAULT_INDEX):
+        if path != ":memory:":
+            path = os.path.expanduser(path)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        metric_columns = ", ".join(f"{field} REAL" for field in VALIDATION_FIELDS)
+        self._connection.executescript(f"""
+            CREATE TABLE IF NOT EXISTS instances (
+                comp_id TEXT NOT NULL, entry_id TEXT NOT NULL, asym_id TEXT NOT NULL, {metric_columns},
+                PRIMARY KEY (entry_id, asym_id)
+            );
+            CREATE INDEX IF NOT EXISTS instances_comp_id ON instances (comp_id);
+            CREATE TABLE IF NOT EXISTS entries (entry_id TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+
+    @property
+    def last_refresh(self):
+        """Date (YYYY-MM-DD) on which the last complete refresh started, or None if the index was never built."""
+        row = self._connection.execute("SELECT value FROM meta WHERE key = 'last_refresh'").fetchone()
+        return row[0] if row else None
+
+    def needs_refresh(self):
+        """Whether a PDB release happened since the last refresh."""
+        return self.last_refresh is None or self.last_refresh < current_release()
+
+    def _write_batch(self, records):
+        """Replace the instances of a batch of fetched entry records."""
+        entry_ids = [(record["rcsb_id"],) for record in records]
+        rows = [
+            (instance["comp_id"], instance["entry_id"], instance["asym_id"] or "") + tuple(instance[field] for field in VALIDATION_FIELDS)
+            for record in records
+            for instance in ligand_instances(record)
+        ]
+        with self._connection:
+            self._connection.executemany("DELETE FROM instances WHERE entry_id = ?", entry_ids)
+            self._connection.executemany(f"INSERT OR REPLACE INTO instances VALUES ({', '.join('?' * (3 + len(VALIDATION_FIELDS)))})", rows)
+            self._connection.executemany("INSERT OR IGNORE INTO entries VALUES (?)", entry_ids)
+        return len(rows)
+
+    def _remove(self, entry_ids):
+        with self._connection:
+            self._connection.executemany("DELETE FROM instances WHERE entry_id = ?", [(entry_id,) for entry_id in entry_ids])
+            self._connection.executemany("DELETE FROM entries WHERE entry_id = ?", [(entry_id,) for entry_id in entry_ids])
+
+    def refresh(self, full=False, batch_size=ENTRY_BATCH_SIZE, max_workers=MAX_WORKERS, verbose=True):
+        """Build the index, or update it with the entries added, revised or removed since the last refresh.
+
+        Returns:
+            dict: numbers of fetched and removed entries, and of stored instances
+        """
+        started = datetime.now(timezone.utc).date().isoformat()
+        session = create_session(max_workers + 1)
+        try:
+            current = set(iter_search_ids(non_covalent_ligand_request(), session=session))
+            indexed = {row[0] for row in self._connection.execute("SELECT entry_id FROM entries")}
+            if full:
+                to_fetch = current
+            else:
+                # Entries not indexed yet include those left over by an interrupted refresh
+                to_fetch = current - indexed
+                if self.last_refresh is not None:
+                    to_fetch |= set(iter_search_ids(revised_entries_request(self.last_refresh), session=session)) & current
+            removed = indexed - current
+            self._remove(removed)
+            if verbose:
+                print(f"{len(current)} entries with non-covalently linked ligands: fetching {len(to_fetch)}, removing {len(removed)}")
+
+            stats = {"fetched": 0, "removed": len(removed), "instances": 0}
+            for records in iter_entry_batches(sorted(to_fetch), batch_size=batch_size, max_workers=max_workers, session=session):
+                stats["instances"] += self._write_batch(records)
+                stats["fetched"] += len(records)
+                if verbose:
+                    print(f"fetched {stats['fetched']} of {len(to_fetch)} entries")
+        finally:
+            session.close()
+
+        with self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('last_refresh', ?)", (started,))
+        return stats
+
+    def instances(self, comp_id):
+        """Return all indexed instances of a CCD ID as dicts (see `ligand_quality.ligand_instances`)."""
+        columns = ("entry_id", "asym_id", "comp_id") + VALIDATION_FIELDS
+        rows = self._connection.execute(f"SELECT {', '.join(columns)} FROM instances WHERE comp_id = ? ORDER BY entry_id, asym_id", (comp_id.upper(),))
+        return [dict(zip(columns, row)) for row in rows]
+
+    def best(self, comp_id, metric="ranking_model_fit", limit=1):
+        """Return the best `limit` instances of a CCD ID by `metric` (instances without a value are ranked last)."""
+        if metric not in VALIDATION_FIELDS:
+            raise ValueError(f"Unknown metric '{metric}' (available: {', '.join(VALIDATION_FIELDS)})")
+        direction = "DESC" if METRIC_DIRECTIONS[metric] > 0 else "ASC"
+        columns = ("entry_id", "asym_id", "comp_id") + VALIDATION_FIELDS
+        rows = self._connection.execute(
+            f"SELECT {', '.join(columns)} FROM instances WHERE comp_id = ? "
+            f"ORDER BY {metric} IS NULL, {metric} {direction}, entry_id, asym_id LIMIT ?",
+            (comp_id.upper(), limit)
+        )
+        return [dict(zip(columns, row)) for row in rows]
+
+    def close(self):
+        self._connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local index of ligand instance validation metrics.")
+    parser.add_argument("--index", default=DEFAULT_INDEX, help="SQLite index file (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    refresh_parser = commands.add_parser("refresh", help="Build the index, or update it after a PDB release")
+    refresh_parser.add_argument("--full", action="store_true", help="Refetch all entries")
+    refresh_parser.add_argument("--force", action="store_true", help="Refresh even if there was no PDB release since the last refresh")
+    refresh_parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Concurrent Data API requests (default: %(default)s)")
+    best_parser = commands.add_parser("best", help="Show the best instances of a ligand")
+    best_parser.add_argument("ccd_id", help="CCD ID of the ligand (e.g. IBP)")
+    best_parser.add_argument("--metric", default="ranking_model_fit", choices=VALIDATION_FIELDS, help="Metric to rank by (default: %(default)s)")
+    best_parser.add_argument("--top", type=int, default=1, help="Number of instances to display (default: %(default)s)")
+    args = parser.parse_args()
+
+    s_time = time.time()
+    index = LigandIndex(args.index)
+    if args.command == "refresh":
+        if index.needs_refresh() or args.full or args.force:
+            stats = index.refresh(full=args.full, max_workers=args.workers)
+            print(f"fetched {stats['fetched']} entries ({stats['instances']} ligand instances), removed {stats['removed']} entries")
+        else:
+            print(f"index is up to date (last refreshed on {index.last_refresh})")
+    else:
+        if index.last_refresh is None:
+            sys.exit(f"index {args.index} is empty, run 'python ligand_index.py refresh' first")
+        for instance in index.best(args.ccd_id, metric=args.metric, limit=args.top):
+            print(f"PDB entry {instance['entry_id']} (asym {instance['asym_id']}): {args.metric} {instance[args.metric]}")
+        if index.needs_refresh():
+            print(f"note: index last refreshed on {index.last_refresh}, before the latest PDB release")
+    index.close()
+    print(f"Total execution time: {time.time() - s_time:.4f} seconds")
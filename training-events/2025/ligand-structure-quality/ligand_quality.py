@@ -0,0 +1,280 @@
+"""
+Helpers for fetching ligand validation metrics for many PDB entries at once.
+
+Search results are paged through with `iter_search_ids`, which fetches the next page in the background while the
+current one is read. Instead of one Data API request per entry, entries are requested in batches with the
+multi-entry `entries(entry_ids: [...])` GraphQL query, several batches at a time over one pooled HTTP session. Entry
+IDs can be given as a lazy iterable (e.g. search results that are still being paged through), and results are
+yielded batch by batch as they arrive, so memory use does not grow with the number of entries.
+
+Each non-covalently linked ligand instance (annotation type HAS_NO_COVALENT_LINKAGE, the same filter as the
+search in find_best_ligand.py) is returned as a flat dict with the entry ID, asym ID, CCD ID and the
+`rcsb_nonpolymer_instance_validation_score` metrics (None where a metric is missing).
+
+Example:
+    from ligand_quality import iter_ligand_instances
+
+    for instance in iter_ligand_instances(["4PH4", "2PRG"], comp_ids={"IBP"}):
+        print(instance["entry_id"], instance["asym_id"], instance["ranking_model_fit"])
+
+Requirements:
+    pip install requests
+"""
+
+import copy
+import itertools
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from urllib3.util.retry import Retry
+
+SEARCH_API_URL = "https://search.rcsb.org/rcsbsearch/v2/query"
+DATA_API_URL = "https://data.rcsb.org/graphql"
+
+# Largest page size accepted by the Search API
+SEARCH_PAGE_ROWS = 10_000
+
+# Entries per multi-entry GraphQL request, and number of requests in flight
+ENTRY_BATCH_SIZE = 200
+MAX_WORKERS = 8
+
+NON_COVALENT = "HAS_NO_COVALENT_LINKAGE"
+
+VALIDATION_FIELDS = (
+    "ranking_model_fit",
+    "ranking_model_geometry",
+    "RSCC",
+    "RSR",
+    "mogul_bonds_RMSZ",
+    "mogul_angles_RMSZ",
+    "mogul_bond_outliers",
+    "mogul_angle_outliers",
+    "completeness",
+    "average_occupancy",
+)
+
+# +1 if higher values are better, -1 if lower values are better
+METRIC_DIRECTIONS = {
+    "ranking_model_fit": 1,
+    "ranking_model_geometry": 1,
+    "RSCC": 1,
+    "RSR": -1,
+    "mogul_bonds_RMSZ": -1,
+    "mogul_angles_RMSZ": -1,
+    "mogul_bond_outliers": -1,
+    "mogul_angle_outliers": -1,
+    "completeness": 1,
+    "average_occupancy": 1,
+}
+
+LIGAND_QUERY = """
+query ligands($ids: [String!]!) {
+  entries(entry_ids: $ids) {
+    rcsb_id
+    nonpolymer_entities {
+      nonpolymer_entity_instances {
+        rcsb_nonpolymer_entity_instance_container_identifiers {
+          asym_id
+        }
+        rcsb_nonpolymer_instance_annotation {
+          comp_id
+          type
+        }
+        rcsb_nonpolymer_instance_validation_score {
+          %s
+        }
+      }
+    }
+  }
+}
+""" % ",\n          ".join(VALIDATION_FIELDS)
+
+
+def non_covalent_ligand_request(comp_id=None):
+    """Search request for the entries with non-covalently linked ligands (of one CCD ID, if given)."""
+    nodes = [
+        {
+            "type": "terminal",
+            "service": "text",
+            "parameters": {
+                "attribute": "rcsb_nonpolymer_instance_annotation.type",
+                "operator": "exact_match",
+                "value": NON_COVALENT,
+            },
+        },
+    ]
+    if comp_id:
+        nodes.insert(0, {
+            "type": "terminal",
+            "service": "text",
+            "parameters": {
+                "attribute": "rcsb_nonpolymer_instance_annotation.comp_id",
+                "operator": "exact_match",
+                "value": comp_id,
+            },
+        })
+    return {
+        "query": {"type": "group", "nodes": nodes, "logical_operator": "and", "label": "nested-attribute"},
+        "return_type": "entry",
+        "request_options": {"results_content_type": ["experimental"]},
+    }
+
+
+def current_release(now=None):
+    """Date of the most recent weekly PDB release (released every Wednesday at 00:00 UTC).
+
+    >>> current_release(datetime(2025, 9, 9, tzinfo=timezone.utc)), current_release(datetime(2025, 9, 10, tzinfo=timezone.utc))
+    ('2025-09-03', '2025-09-10')
+    """
+    now = now or datetime.now(timezone.utc)
+    return (now - timedelta(days=(now.weekday() - 2) % 7)).date().isoformat()
+
+
+def create_session(pool_size=MAX_WORKERS):
+    """Return a session with a connection pool for `pool_size` concurrent requests, retrying 429 and 5xx errors."""
+    session = requests.Session()
+    retry = Retry(total=5, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=None, respect_retry_after_header=True)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def fetch_search_page(search_request, start, rows, session=None, url=None, timeout=60):
+    """Fetch a single page of results.
+
+    Returns:
+        dict: the parsed JSON response, or None if the query has no hits
+    """
+    request = copy.deepcopy(search_request)
+    request_options = request.setdefault("request_options", {})
+    request_options.pop("return_all_hits", None)
+    request_options["paginate"] = {"start": start, "rows": rows}
+    request_options.setdefault("results_verbosity", "compact")
+    response = (session or requests).post(url or SEARCH_API_URL, json=request, timeout=timeout)
+    response.raise_for_status()
+    return None if response.status_code == 204 else response.json()
+
+
+def iter_search_ids(search_request, rows=SEARCH_PAGE_ROWS, max_hits=None, prefetch=True, session=None, url=None):
+    """Lazily iterate over the result IDs of a search request, fetching the next page in the background.
+
+    This is the only paginator of this folder; it has the same arguments and behaviour as `iter_search_ids` in
+    example-use-cases/structures/search_pagination.py (without its cache), so that the webinar scripts run on their
+    own.
+
+    Args:
+        search_request (dict): Search API request body
+        rows (int): page size (at most 10,000)
+        max_hits (int, optional): stop after this many hits
+        prefetch (bool): request the next page while the current one is being consumed
+        session (requests.Session, optional): session to re-use for all page requests
+        url (str, optional): Search API endpoint (defaults to `SEARCH_API_URL`)
+    """
+    if max_hits is not None and max_hits <= 0:
+        return
+    rows = min(rows, SEARCH_PAGE_ROWS)
+    own_session = session is None
+    session = session or requests.Session()
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    pending = None
+
+    def page_rows(start):
+        return rows if max_hits is None else min(rows, max_hits - start)
+
+    def request_page(start):
+        if executor:
+            return executor.submit(fetch_search_page, search_request, start, page_rows(start), session, url)
+        return fetch_search_page(search_request, start, page_rows(start), session, url)
+
+    try:
+        start = 0
+        total = None
+        pending = request_page(start)
+        while pending is not None:
+            response = pending.result() if executor else pending
+            pending = None
+            if total is None:
+                total = response["total_count"] if response is not None else 0
+                if max_hits is not None:
+                    total = min(total, max_hits)
+            ids = response["result_set"] if response is not None else []
+            start += len(ids)
+            if ids and start < total:
+                pending = request_page(start)
+            yield from ids
+    finally:
+        if executor:
+            if pending is not None:
+                pending.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+        if own_session:
+            session.close()
+
+
+def fetch_entries(entry_ids, session, url=DATA_API_URL, timeout=120):
+    """Run the ligand query for one batch of entries and return the list of entry records."""
+    response = session.post(url, json={"query": LIGAND_QUERY, "variables": {"ids": list(entry_ids)}}, timeout=timeout)
+    response.raise_for_status()
+    return response.json()["data"]["entries"] or []
+
+
+def ligand_instances(entry, comp_ids=None):
+    """Return the non-covalently linked ligand instances of an entry record as flat dicts."""
+    instances = []
+    for entity in entry.get("nonpolymer_entities") or []:
+        for instance in entity.get("nonpolymer_entity_instances") or []:
+            comp_id = next(
+                (annotation["comp_id"] for annotation in instance.get("rcsb_nonpolymer_instance_annotation") or [] if annotation.get("type") == NON_COVALENT),
+                None
+            )
+            if comp_id is None or (comp_ids is not None and comp_id.upper() not in comp_ids):
+                continue
+            scores = (instance.get("rcsb_nonpolymer_instance_validation_score") or [None])[0] or {}
+            identifiers = instance.get("rcsb_nonpolymer_entity_instance_container_identifiers") or {}
+            row = {"entry_id": entry["rcsb_id"], "asym_id": identifiers.get("asym_id"), "comp_id": comp_id.upper()}
+            row.update({field: scores.get(field) for field in VALIDATION_FIELDS})
+            instances.append(row)
+    return instances
+
+
+def iter_entry_batches(entry_ids, batch_size=ENTRY_BATCH_SIZE, max_workers=MAX_WORKERS, session=None, url=DATA_API_URL):
+    """Lazily fetch entry records in concurrent batches, keeping at most 2 x `max_workers` batches in flight.
+
+    Yields:
+        list: entry records of each batch, in the order of `entry_ids`
+    """
+    own_session = session is None
+    session = session or create_session(max_workers)
+    entry_ids = iter(entry_ids)
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit_next():
+        batch = list(itertools.islice(entry_ids, batch_size))
+        if batch:
+            pending.append(executor.submit(fetch_entries, batch, session, url))
+        return bool(batch)
+
+    try:
+        while len(pending) < 2 * max_workers and submit_next():
+            pass
+        while pending:
+            records = pending.popleft().result()
+            submit_next()
+            yield records
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+        if own_session:
+            session.close()
+
+
+def iter_ligand_instances(entry_ids, comp_ids=None, batch_size=ENTRY_BATCH_SIZE, max_workers=MAX_WORKERS, session=None, url=DATA_API_URL):
+    """Lazily yield the non-covalently linked ligand instances of many entries (optionally only of `comp_ids`)."""
+    comp_ids = {comp_id.upper() for comp_id in comp_ids} if comp_ids is not None else None
+    for records in iter_entry_batches(entry_ids, batch_size=batch_size, max_workers=max_workers, session=session, url=url):
+        for entry in records:
+            yield from ligand_instances(entry, comp_ids)
@@ -0,0 +1,261 @@
+"""
+This script ranks all non-covalently linked instances of a ligand (CCD ID) by several validation metrics at once,
+instead of by ranking_model_fit alone.
+
+The validation metrics of every instance are loaded once into a NumPy matrix (one row per instance, one column per
+metric, NaN where a metric is missing), after which rankings under different criteria are vectorised:
+    - threshold filters, e.g. "RSCC>=0.9" or "mogul_bonds_RMSZ<2" (instances missing the metric fail the filter)
+    - weighted composite scores: each metric is scaled to [0, 1] over the filtered instances, oriented so that
+      higher is better (e.g. low RSR and RMSZ values score high), and averaged with the given weights
+    - Pareto front: the instances not dominated by any other instance on a set of metrics (by default
+      ranking_model_fit and ranking_model_geometry), i.e. the best trade-offs between fit and geometry
+
+The process includes 3 steps:
+Step 1: Search for PDB IDs with the CCD ID (non-covalently linked instances)
+Step 2: Retrieve ligand quality metrics in concurrent multi-entry Data API batches (or load them from --table,
+or from the local index of ligand_index.py with --index)
+Step 3: Filter, score and rank the instances
+
+Requirements:
+    pip install requests numpy
+
+Usage:
+    python ligand_ranking.py IBP --filter "RSCC>=0.9" --weight ranking_model_fit=2 --weight ranking_model_geometry=1
+    python ligand_ranking.py IBP --pareto --table ibp.npz
+    python ligand_ranking.py IBP --pareto --index ~/.cache/rcsb-ligands/ligand_index.sqlite
+Output:
+    Top-ranked instances displayed on the terminal
+
+"""
+
+import argparse
+import os
+import re
+import time
+import numpy as np
+from ligand_quality import METRIC_DIRECTIONS, VALIDATION_FIELDS, iter_ligand_instances, iter_search_ids, non_covalent_ligand_request
+
+DEFAULT_PARETO_METRICS = ("ranking_model_fit", "ranking_model_geometry")
+
+FILTER_RE = re.compile(r"^\s*(\w+)\s*(<=|>=|<|>|==)\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*$")
+COMPARISONS = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal, "==": np.equal}
+
+
+class LigandMetrics:
+    """Validation metrics of ligand instances as a NumPy matrix.
+
+    Attributes:
+        entry_ids, asym_ids, comp_ids (np.ndarray): identifiers of each instance
+        metrics (tuple): metric name of each column
+        values (np.ndarray): instances x metrics matrix (NaN where missing)
+    """
+
+    def __init__(self, entry_ids, asym_ids, comp_ids, metrics, values):
+        self.entry_ids = np.asarray(entry_ids, dtype=str)
+        self.asym_ids = np.asarray(asym_ids, dtype=str)
+        self.comp_ids = np.asarray(comp_ids, dtype=str)
+        self.metrics = tuple(metrics)
+        self.values = np.asarray(values, dtype=float).reshape(len(self.entry_ids), len(self.metrics))
+
+    @classmethod
+    def from_instances(cls, instances, metrics=VALIDATION_FIELDS):
+        """Build the matrix from the instance dicts of `ligand_quality.iter_ligand_instances`."""
+        instances = list(instances)
+        values = [[np.nan if instance[metric] is None else instance[metric] for metric in metrics] for instance in instances]
+        return cls(
+            [instance["entry_id"] for instance in instances],
+            [instance["asym_id"] or "" for instance in instances],
+            [instance["comp_id"] for instance in instances],
+            metrics,
+            values
+        )
+
+    def save(self, path, ccd_id=""):
+        """Save the table (with the CCD ID it was fetched for, checked by `load`)."""
+        np.savez_compressed(
+            path, ccd_id=np.asarray(ccd_id), entry_ids=self.entry_ids, asym_ids=self.asym_ids, comp_ids=self.comp_ids,
+            metrics=np.asarray(self.metrics), values=self.values
+        )
+
+    @classmethod
+    def load(cls, path, ccd_id=None):
+        """Load a table saved with `save`.
+
+        Raises:
+            ValueError: if `ccd_id` is given and the table was saved for another CCD ID
+        """
+        with np.load(path) as arrays:
+            ligands = cls(arrays["entry_ids"], arrays["asym_ids"], arrays["comp_ids"], arrays["metrics"].tolist(), arrays["values"])
+            saved_ccd_ids = {str(arrays["ccd_id"])} if "ccd_id" in arrays.files and str(arrays["ccd_id"]) else set(ligands.comp_ids.tolist())
+        if ccd_id is not None and saved_ccd_ids and saved_ccd_ids != {ccd_id}:
+            raise ValueError(f"{path} holds the metrics of {', '.join(sorted(saved_ccd_ids))}, not of {ccd_id}")
+        return ligands
+
+    def __len__(self):
+        return len(self.entry_ids)
+
+    def column(self, metric):
+        if metric not in self.metrics:
+            raise ValueError(f"Unknown metric '{metric}' (available: {', '.join(self.metrics)})")
+        return self.values[:, self.metrics.index(metric)]
+
+    def filter_mask(self, filters=()):
+        """Return the boolean mask of instances passing all filters (strings such as "RSCC>=0.9")."""
+        mask = np.ones(len(self), dtype=bool)
+        for expression in filters:
+            metric, operator, threshold = parse_filter(expression)
+            column = self.column(metric)
+            # Comparisons with NaN are False, so instances missing the metric are filtered out
+            with np.errstate(invalid="ignore"):
+                mask &= COMPARISONS[operator](column, threshold)
+        return mask
+
+    def oriented(self, metrics, mask=None):
+        """Return the columns of `metrics` for the masked instances, negated where lower values are better."""
+        columns = np.stack([self.column(metric) * METRIC_DIRECTIONS.get(metric, 1) for metric in metrics], axis=1)
+        return columns if mask is None else columns[mask]
+
+    def composite_scores(self, weights, mask=None):
+        """Return the weighted composite score (0 to 1) of the masked instances.
+
+        Each metric is scaled to [0, 1] over the masked instances (1 being the best value), and missing values count
+        as the worst value.
+        """
+        metrics = list(weights)
+        columns = self.oriented(metrics, mask)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            low, high = np.zeros(len(metrics)), np.ones(len(metrics))
+            if len(columns):
+                # Metrics missing for every instance would make nanmin/nanmax warn; they score 0 anyway
+                known = np.where(np.isnan(columns).all(axis=0), 0.0, columns)
+                low, high = np.nanmin(known, axis=0), np.nanmax(known, axis=0)
+            span = np.where(high > low, high - low, 1)
+            scaled = np.nan_to_num((columns - low) / span, nan=0.0)
+        w = np.array([weights[metric] for metric in metrics], dtype=float)
+        return scaled @ w / w.sum()
+
+    def rank(self, weights, filters=()):
+        """Return the indices of the instances passing `filters`, sorted by decreasing composite score, and the scores."""
+        mask = self.filter_mask(filters)
+        indices = np.flatnonzero(mask)
+        scores = self.composite_scores(weights, mask)
+        # Ties are broken by entry ID and asym ID
+        order = np.lexsort((self.asym_ids[indices], self.entry_ids[indices], -scores))
+        return indices[order], scores[order]
+
+    def pareto_front(self, metrics=DEFAULT_PARETO_METRICS, filters=()):
+        """Return the indices of the non-dominated instances passing `filters` (instances missing a metric are excluded).
+
+        An instance is dominated if another instance is at least as good on every metric and better on at least one.
+        """
+        mask = self.filter_mask(filters)
+        points = self.oriented(metrics)
+        mask &= ~np.isnan(points).any(axis=1)
+        candidates = np.flatnonzero(mask)
+        points = points[candidates]
+
+        # Visit candidates from the best sum of metrics, which removes most dominated points early
+        order = np.argsort(-points.sum(axis=1), kind="stable")
+        candidates, points = candidates[order], points[order]
+        i = 0
+        while i < len(points):
+            keep = np.any(points > points[i], axis=1) | np.all(points == points[i], axis=1)
+            candidates, points = candidates[keep], points[keep]
+            i = np.count_nonzero(keep[:i]) + 1
+        return candidates
+
+
+def parse_filter(expression):
+    """Split a filter such as "RSCC>=0.9" into metric, operator and threshold.
+
+    >>> parse_filter("RSR < 1e-1")
+    ('RSR', '<', 0.1)
+    >>> parse_filter("RSCC>=e")
+    Traceback (most recent call last):
+        ...
+    ValueError: Invalid filter 'RSCC>=e' (expected e.g. 'RSCC>=0.9')
+    """
+    match = FILTER_RE.match(expression)
+    if not match:
+        raise ValueError(f"Invalid filter '{expression}' (expected e.g. 'RSCC>=0.9')")
+    metric, operator, threshold = match.groups()
+    return metric, operator, float(threshold)
+
+
+def fetch_ligand_metrics(ccd_id):
+    """Search the entries with non-covalently linked instances of `ccd_id` and fetch their metrics."""
+    entry_ids = iter_search_ids(non_covalent_ligand_request(ccd_id))
+    return LigandMetrics.from_instances(iter_ligand_instances(entry_ids, comp_ids={ccd_id}))
+
+
+def parse_weights(values):
+    weights = {}
+    for value in values:
+        metric, _, weight = value.partition("=")
+        try:
+            weights[metric] = float(weight or 1)
+        except ValueError:
+            raise ValueError(f"Invalid weight '{value}' (expected e.g. 'ranking_model_fit=2')")
+    return weights
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank ligand instances by several validation metrics.")
+    parser.add_argument("ccd_id", help="CCD ID of the ligand (e.g. IBP)")
+    parser.add_argument("--filter", action="append", default=[], help="Threshold filter, e.g. 'RSCC>=0.9' (repeatable)")
+    parser.add_argument("--weight", action="append", default=[], help="Metric weight for the composite score, e.g. 'ranking_model_fit=2' (repeatable; default: ranking_model_fit=1)")
+    parser.add_argument("--pareto", action="store_true", help="List the Pareto front instead of the composite ranking")
+    parser.add_argument("--pareto-metric", action="append", help=f"Metric of the Pareto front (repeatable; default: {', '.join(DEFAULT_PARETO_METRICS)})")
+    parser.add_argument("--top", type=int, default=10, help="Number of instances to display (default: %(default)s)")
+    parser.add_argument("--table", help="Read the metrics from this .npz file if it exists, or save them to it")
+    parser.add_argument("--index", help="Read the metrics from this local ligand index (see ligand_index.py)")
+    args = parser.parse_args()
+
+    # Check the filters and weights before fetching any metrics
+    try:
+        weights = parse_weights(args.weight) or {"ranking_model_fit": 1}
+        metrics = [parse_filter(expression)[0] for expression in args.filter] + list(weights) + list(args.pareto_metric or ())
+    except ValueError as e:
+        parser.error(str(e))
+    unknown = [metric for metric in metrics if metric not in VALIDATION_FIELDS]
+    if unknown:
+        parser.error(f"Unknown metric '{unknown[0]}' (available: {', '.join(VALIDATION_FIELDS)})")
+    if args.index and not os.path.exists(os.path.expanduser(args.index)):
+        parser.error(f"Ligand index {args.index} does not exist (build it with 'python ligand_index.py refresh')")
+
+    s_time = time.time()
+    ccd_id = args.ccd_id.upper()
+    if args.index:
+        from ligand_index import LigandIndex
+        ligands = LigandMetrics.from_instances(LigandIndex(args.index).instances(ccd_id))
+    elif args.table and os.path.exists(args.table):
+        try:
+            ligands = LigandMetrics.load(args.table, ccd_id=ccd_id)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        ligands = fetch_ligand_metrics(ccd_id)
+        if args.table:
+            ligands.save(args.table, ccd_id=ccd_id)
+    print(f"loaded metrics of {len(ligands)} instances of {ccd_id}")
+
+    columns = ("ranking_model_fit", "ranking_model_geometry", "RSCC", "RSR", "mogul_bonds_RMSZ", "mogul_angles_RMSZ")
+    try:
+        if args.pareto:
+            indices = ligands.pareto_front(args.pareto_metric or DEFAULT_PARETO_METRICS, filters=args.filter)
+        else:
+            indices, scores = ligands.rank(weights, filters=args.filter)
+    except ValueError as e:
+        # e.g. a metric missing from a --table file
+        parser.error(str(e))
+    if args.pareto:
+        print(f"{len(indices)} instances on the Pareto front")
+        labels = [f"{ligands.entry_ids[index]} {ligands.asym_ids[index]}" for index in indices]
+    else:
+        print(f"{len(indices)} instances pass the filters")
+        labels = [f"{ligands.entry_ids[index]} {ligands.asym_ids[index]} score {score:.3f}" for index, score in zip(indices, scores)]
+
+    for index, label in list(zip(indices, labels))[:args.top]:
+        metrics = ", ".join(f"{column} {ligands.column(column)[index]:.3g}" for column in columns)
+        print(f"{label} ({metrics})")
+    print(f"Total execution time: {time.time() - s_time:.4f} seconds")